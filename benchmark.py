@@ -0,0 +1,93 @@
+"""
+Closed-loop HTTP load generator for comparing serving modes.
+
+    # dev server (single process)
+    python hr_ticket_system.py
+    python benchmark.py http://127.0.0.1:8112/login --concurrency 32 --duration 20
+
+    # production server
+    gunicorn -c gunicorn.conf.py wsgi:app
+    python benchmark.py http://127.0.0.1:8112/login --concurrency 32 --duration 20
+
+Clients run in several processes so the load generator itself is not held
+back by the GIL. Run it from another machine (or pin it to other cores) when
+measuring large worker counts.
+"""
+import argparse
+import multiprocessing
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+def _client_process(url, threads, duration, results):
+    deadline = time.monotonic() + duration
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def loop():
+        nonlocal errors
+        local_latencies, local_errors = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                local_latencies.append(time.perf_counter() - start)
+            except (urllib.error.URLError, OSError):
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((latencies, errors))
+
+def run(url, concurrency, duration, processes):
+    processes = max(1, min(processes, concurrency))
+    per_process = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_client_process, args=(url, n, duration, results)) for n in per_process]
+    started = time.monotonic()
+    for proc in procs:
+        proc.start()
+    latencies, errors = [], 0
+    for _ in procs:
+        proc_latencies, proc_errors = results.get()
+        latencies.extend(proc_latencies)
+        errors += proc_errors
+    for proc in procs:
+        proc.join()
+    elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure requests/second against a running server.')
+    parser.add_argument('url')
+    parser.add_argument('--concurrency', '-c', type=int, default=32, help='concurrent connections')
+    parser.add_argument('--duration', '-d', type=float, default=20, help='seconds')
+    parser.add_argument('--processes', '-p', type=int, default=multiprocessing.cpu_count(), help='client processes')
+    args = parser.parse_args(argv)
+
+    print(f"🚀 {args.url}: {args.concurrency} connections for {args.duration:.0f}s from {args.processes} processes")
+    latencies, errors, elapsed = run(args.url, args.concurrency, args.duration, args.processes)
+    if not latencies:
+        print(f"❌ No successful requests ({errors} errors)")
+        return 1
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"✅ {len(latencies)} requests, {errors} errors in {elapsed:.1f}s")
+    print(f"   Throughput: {len(latencies) / elapsed:,.1f} req/s")
+    print(f"   Latency ms: mean {statistics.mean(latencies) * 1000:.1f} | p50 {pct(0.50):.1f} | p95 {pct(0.95):.1f} | p99 {pct(0.99):.1f}")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,423 @@
+"""
+Bulk import of legacy tickets, users and HR mappings.
+
+Files are streamed through COPY into temporary staging tables, validated and
+upserted with set-based SQL in a single transaction. Nothing is buffered in
+memory beyond one read chunk, so inputs can be far larger than RAM. No email or
+WhatsApp notifications are sent for imported rows.
+
+Usage:
+    python bulk_import.py users users.csv
+    python bulk_import.py mappings mappings.ndjson
+    python bulk_import.py tickets tickets.csv --rejects rejected_tickets.csv
+
+CSV files need a header row; NDJSON files hold one JSON object per line.
+Unknown CSV columns / JSON keys are ignored. Dates and timestamps must be ISO
+formatted (YYYY-MM-DD[ HH:MM[:SS]]). Rows that fail validation are
+skipped and counted; use --rejects to write them out with the reason.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from hr_ticket_system import db_pool, init_db, notify_hr_directory_changed, invalidate_dashboard_cache, GRIEVANCE_TYPES
+
+COPY_CHUNK_SIZE = 1024 * 1024
+TICKET_STATUSES = ('Submitted', 'In Progress', 'Resolved', 'Reopened')
+USER_ROLES = ('employee', 'hr', 'admin')
+
+IMPORT_SPECS = {
+    'users': {
+        'staging': 'import_users',
+        'columns': ['emp_code', 'employee_name', 'employee_phone', 'employee_email', 'role', 'is_active'],
+        'key': 'emp_code',
+        'typed': {'is_active': 'BOOLEAN'},
+    },
+    'mappings': {
+        'staging': 'import_mappings',
+        'columns': ['grievance_type', 'hr_emp_code'],
+        'key': 'grievance_type',
+        'typed': {},
+    },
+    'tickets': {
+        'staging': 'import_tickets',
+        'columns': ['id', 'emp_code', 'employee_name', 'employee_email', 'employee_phone',
+                    'date_of_birth', 'business_unit', 'department', 'grievance_type', 'subject',
+                    'description', 'submission_date', 'status', 'updated_at', 'assigned_hr_emp_code'],
+        'key': 'id',
+        'typed': {'date_of_birth': 'DATE', 'submission_date': 'TIMESTAMP', 'updated_at': 'TIMESTAMP'},
+    },
+}
+
+def _v(col):
+    """Cleaned staging value: trimmed, empty strings become NULL."""
+    return f"NULLIF(btrim(s.{col}), '')"
+
+def _typed(col):
+    """Staging value after the one-off cast into its typed column (NULL if blank or invalid)."""
+    return f"s._typed_{col}"
+
+ISO_DATE_PATTERN = r'^(\d{4})-(\d{1,2})-(\d{1,2})$'
+ISO_TIMESTAMP_PATTERN = r'^(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}(?:\.\d{1,6})?))?)?$'
+
+def _cast(col, sql_type):
+    """
+    Expression casting a staging value to sql_type, or NULL when it does not
+    parse. Values are pre-checked with a regex and range tests so the actual
+    cast never raises; CASE evaluates its branches in order, which keeps the
+    cast behind the checks.
+    """
+    value = _v(col)
+    if sql_type == 'BOOLEAN':
+        return (f"CASE WHEN lower({value}) IN ('t', 'true', 'y', 'yes', 'on', '1') THEN TRUE "
+                f"WHEN lower({value}) IN ('f', 'false', 'n', 'no', 'off', '0') THEN FALSE END")
+    pattern = ISO_DATE_PATTERN if sql_type == 'DATE' else ISO_TIMESTAMP_PATTERN
+    return f'''(
+        SELECT CASE
+            WHEN p IS NULL OR p[1]::int < 1 OR p[2]::int NOT BETWEEN 1 AND 12 THEN NULL
+            WHEN p[3]::int NOT BETWEEN 1 AND
+                 extract(day FROM make_date(p[1]::int, p[2]::int, 1) + interval '1 month - 1 day') THEN NULL
+            WHEN COALESCE(p[4]::int, 0) > 23 OR COALESCE(p[5]::int, 0) > 59
+                 OR COALESCE(p[6]::numeric, 0) >= 60 THEN NULL
+            ELSE {value}::{sql_type}
+        END
+        FROM regexp_match({value}, '{pattern}') AS p
+    )'''
+
+# (reason, condition) pairs evaluated in order; the first match wins.
+VALIDATION_RULES = {
+    'users': [
+        ('missing emp_code', f"{_v('emp_code')} IS NULL"),
+        ('missing employee_name', f"{_v('employee_name')} IS NULL"),
+        ('invalid role', f"lower({_v('role')}) <> ALL(%(roles)s)"),
+        ('invalid is_active', f"{_v('is_active')} IS NOT NULL AND {_typed('is_active')} IS NULL"),
+    ],
+    'mappings': [
+        ('missing grievance_type', f"{_v('grievance_type')} IS NULL"),
+        ('missing hr_emp_code', f"{_v('hr_emp_code')} IS NULL"),
+        ('unknown grievance_type', f"{_v('grievance_type')} <> ALL(%(grievance_types)s)"),
+        ('unknown hr_emp_code', f"NOT EXISTS (SELECT 1 FROM users u WHERE u.emp_code = {_v('hr_emp_code')})"),
+    ],
+    'tickets': [
+        ('missing id', f"{_v('id')} IS NULL"),
+        ('missing emp_code', f"{_v('emp_code')} IS NULL"),
+        ('missing employee_name', f"{_v('employee_name')} IS NULL"),
+        ('missing email and phone', f"{_v('employee_email')} IS NULL AND {_v('employee_phone')} IS NULL"),
+        ('missing subject', f"{_v('subject')} IS NULL"),
+        ('missing description', f"{_v('description')} IS NULL"),
+        ('unknown grievance_type', f"{_v('grievance_type')} IS NULL OR {_v('grievance_type')} <> ALL(%(grievance_types)s)"),
+        ('invalid status', f"{_v('status')} <> ALL(%(statuses)s)"),
+        ('invalid submission_date', f"{_typed('submission_date')} IS NULL"),
+        ('invalid updated_at', f"{_v('updated_at')} IS NOT NULL AND {_typed('updated_at')} IS NULL"),
+        ('invalid date_of_birth', f"{_v('date_of_birth')} IS NOT NULL AND {_typed('date_of_birth')} IS NULL"),
+        ('unknown assigned_hr_emp_code', f"{_v('assigned_hr_emp_code')} IS NOT NULL AND NOT EXISTS "
+                                         f"(SELECT 1 FROM users u WHERE u.emp_code = {_v('assigned_hr_emp_code')})"),
+    ],
+}
+
+UPSERT_STATEMENTS = {
+    # Existing users keep any field the file leaves blank (including role), so an
+    # employee roster import never demotes HR/admin accounts.
+    'users': [
+        ('updated', f'''
+            UPDATE users u SET
+                employee_name = {_v('employee_name')},
+                employee_phone = COALESCE({_v('employee_phone')}, u.employee_phone),
+                employee_email = COALESCE({_v('employee_email')}, u.employee_email),
+                role = COALESCE(lower({_v('role')}), u.role),
+                is_active = COALESCE({_typed('is_active')}, u.is_active)
+            FROM import_users s
+            WHERE s._reject IS NULL AND u.emp_code = {_v('emp_code')}
+        '''),
+        ('inserted', f'''
+            INSERT INTO users (emp_code, employee_name, employee_phone, employee_email, role, is_active)
+            SELECT {_v('emp_code')}, {_v('employee_name')}, COALESCE({_v('employee_phone')}, ''),
+                   {_v('employee_email')}, COALESCE(lower({_v('role')}), 'employee'),
+                   COALESCE({_typed('is_active')}, TRUE)
+            FROM import_users s
+            WHERE s._reject IS NULL
+              AND NOT EXISTS (SELECT 1 FROM users u WHERE u.emp_code = {_v('emp_code')})
+            ON CONFLICT (emp_code) DO NOTHING
+        '''),
+    ],
+    'mappings': [
+        ('upserted', f'''
+            INSERT INTO hr_grievance_mapping (grievance_type, hr_emp_code)
+            SELECT {_v('grievance_type')}, {_v('hr_emp_code')}
+            FROM import_mappings s
+            WHERE s._reject IS NULL
+            ON CONFLICT (grievance_type) DO UPDATE
+            SET hr_emp_code = EXCLUDED.hr_emp_code
+        '''),
+    ],
+    'tickets': [
+        ('upserted', f'''
+            INSERT INTO grievances
+                (id, emp_code, employee_name, employee_email, employee_phone, date_of_birth,
+                 business_unit, department, grievance_type, subject, description,
+                 submission_date, status, updated_at, assigned_hr_emp_code)
+            SELECT {_v('id')}, {_v('emp_code')}, {_v('employee_name')}, COALESCE({_v('employee_email')}, ''),
+                   {_v('employee_phone')}, {_typed('date_of_birth')},
+                   {_v('business_unit')}, {_v('department')}, {_v('grievance_type')},
+                   {_v('subject')}, {_v('description')},
+                   {_typed('submission_date')},
+                   COALESCE({_v('status')}, 'Submitted'),
+                   COALESCE({_typed('updated_at')}, {_typed('submission_date')}),
+                   {_v('assigned_hr_emp_code')}
+            FROM import_tickets s
+            WHERE s._reject IS NULL
+            ON CONFLICT (id) DO UPDATE SET
+                emp_code = EXCLUDED.emp_code,
+                employee_name = EXCLUDED.employee_name,
+                employee_email = EXCLUDED.employee_email,
+                employee_phone = EXCLUDED.employee_phone,
+                date_of_birth = EXCLUDED.date_of_birth,
+                business_unit = EXCLUDED.business_unit,
+                department = EXCLUDED.department,
+                grievance_type = EXCLUDED.grievance_type,
+                subject = EXCLUDED.subject,
+                description = EXCLUDED.description,
+                submission_date = EXCLUDED.submission_date,
+                status = EXCLUDED.status,
+                updated_at = EXCLUDED.updated_at,
+                assigned_hr_emp_code = EXCLUDED.assigned_hr_emp_code
+        '''),
+    ],
+}
+
+class NdjsonCopyReader:
+    """
+    File-like adapter that turns NDJSON lines into CSV rows on demand, so COPY
+    can consume an NDJSON file chunk by chunk.
+    """
+
+    def __init__(self, fileobj, columns):
+        self._file = fileobj
+        self._columns = columns
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out, lineterminator='\n')
+        self._buffer = ''
+        self.line_number = 0
+
+    def _encode(self, value):
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return str(value)
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = self._file.readline()
+            if not line:
+                break
+            self.line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON on line {self.line_number}: {e}")
+            self._writer.writerow([self._encode(record.get(col)) for col in self._columns])
+            self._buffer += self._out.getvalue()
+            self._out.seek(0)
+            self._out.truncate()
+
+        if size < 0:
+            chunk, self._buffer = self._buffer, ''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    lowered = path.lower()
+    if lowered.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return 'csv'
+
+def _create_staging(c, spec, copy_columns):
+    known = set(spec['columns'])
+    column_defs = ',\n'.join(f'"{col}" TEXT' for col in copy_columns)
+    missing = [col for col in spec['columns'] if col not in copy_columns]
+    if missing:
+        column_defs += ',\n' + ',\n'.join(f'"{col}" TEXT' for col in missing)
+    for col, sql_type in spec['typed'].items():
+        column_defs += f',\n_typed_{col} {sql_type}'
+    c.execute(f'''
+        CREATE TEMP TABLE {spec['staging']} (
+            _line BIGSERIAL,
+            _reject TEXT,
+            {column_defs}
+        ) ON COMMIT DROP
+    ''')
+    ignored = [col for col in copy_columns if col not in known]
+    return ignored
+
+def _copy_into_staging(c, spec, path, fmt):
+    """Stream the file into the staging table. Returns number of rows copied."""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            header_line = f.readline()
+            if not header_line:
+                raise ValueError(f"{path} is empty")
+            header = [h.strip().lower() for h in next(csv.reader([header_line]))]
+            # Unknown CSV columns still need a staging column for COPY; they are never read.
+            copy_columns = [h if h in spec['columns'] else f'_ignored_{i}' for i, h in enumerate(header)]
+            ignored = _create_staging(c, spec, copy_columns)
+            source = f
+        else:
+            copy_columns = list(spec['columns'])
+            ignored = _create_staging(c, spec, copy_columns)
+            source = NdjsonCopyReader(f, copy_columns)
+
+        if ignored:
+            print(f"ℹ️ Ignoring {len(ignored)} unknown column(s)")
+
+        quoted = ', '.join(f'"{col}"' for col in copy_columns)
+        c.copy_expert(
+            f"COPY {spec['staging']} ({quoted}) FROM STDIN WITH (FORMAT csv)",
+            source,
+            size=COPY_CHUNK_SIZE,
+        )
+        return c.rowcount
+
+def _cast_typed_columns(c, spec):
+    """Cast date/time/boolean values once, in one pass, so validation and upserts reuse them."""
+    if not spec['typed']:
+        return
+    assignments = ',\n'.join(f"_typed_{col} = {_cast(col, sql_type)}" for col, sql_type in spec['typed'].items())
+    c.execute(f'''
+        UPDATE {spec['staging']} s
+        SET {assignments}
+    ''')
+
+def _validate(c, kind, spec):
+    """Mark invalid and duplicate rows in one pass each; return {reason: count}."""
+    _cast_typed_columns(c, spec)
+    rules = VALIDATION_RULES[kind]
+    params = {
+        'roles': list(USER_ROLES),
+        'statuses': list(TICKET_STATUSES),
+        'grievance_types': list(GRIEVANCE_TYPES.keys()),
+    }
+    case_sql = '\n'.join(f"WHEN {condition} THEN '{reason}'" for reason, condition in rules)
+    c.execute(f'''
+        UPDATE {spec['staging']} s
+        SET _reject = CASE {case_sql} END
+    ''', params)
+
+    # Later rows win when the same key appears more than once in the file.
+    key = _v(spec['key'])
+    c.execute(f'''
+        UPDATE {spec['staging']} t
+        SET _reject = 'duplicate {spec['key']} (later row wins)'
+        FROM (
+            SELECT s._line,
+                   row_number() OVER (PARTITION BY {key} ORDER BY s._line DESC) AS rn
+            FROM {spec['staging']} s
+            WHERE s._reject IS NULL
+        ) d
+        WHERE d._line = t._line AND d.rn > 1
+    ''')
+
+    c.execute(f'''
+        SELECT _reject, COUNT(*) FROM {spec['staging']}
+        WHERE _reject IS NOT NULL
+        GROUP BY _reject ORDER BY COUNT(*) DESC
+    ''')
+    return dict(c.fetchall())
+
+def _write_rejects(c, spec, path):
+    columns = ', '.join(f'"{col}"' for col in spec['columns'])
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        c.copy_expert(f'''
+            COPY (
+                SELECT _line, _reject, {columns}
+                FROM {spec['staging']}
+                WHERE _reject IS NOT NULL
+                ORDER BY _line
+            ) TO STDOUT WITH (FORMAT csv, HEADER true)
+        ''', out, size=COPY_CHUNK_SIZE)
+
+def run_import(kind, path, fmt=None, rejects_path=None, dry_run=False):
+    spec = IMPORT_SPECS[kind]
+    fmt = _detect_format(path, fmt)
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    print("\n" + "=" * 60)
+    print(f"📦 BULK IMPORT: {kind} from {path} ({fmt}, {size_mb:.1f} MB)")
+    print("=" * 60)
+
+    started = time.time()
+    conn = db_pool.getconn(budget='bulk')
+    try:
+        with conn.cursor() as c:
+            # The import can be re-run if the server crashes before the WAL is flushed
+            c.execute("SET LOCAL synchronous_commit TO OFF")
+
+            copied = _copy_into_staging(c, spec, path, fmt)
+            copy_time = time.time() - started
+            print(f"📥 Copied {copied} rows in {copy_time:.2f}s "
+                  f"({copied / copy_time if copy_time else copied:,.0f} rows/s)")
+
+            c.execute(f"ANALYZE {spec['staging']}")
+            rejected = _validate(c, kind, spec)
+            for reason, count in rejected.items():
+                print(f"   ⚠️ {count} row(s) skipped: {reason}")
+            if rejects_path and rejected:
+                _write_rejects(c, spec, rejects_path)
+                print(f"   📝 Rejected rows written to {rejects_path}")
+
+            results = {}
+            for label, statement in UPSERT_STATEMENTS[kind]:
+                c.execute(statement)
+                results[label] = c.rowcount
+                print(f"✅ {c.rowcount} row(s) {label}")
+            if kind in ('users', 'mappings'):
+                notify_hr_directory_changed(c)
+
+        if dry_run:
+            conn.rollback()
+            print("↩️ Dry run: transaction rolled back")
+        else:
+            conn.commit()
+            if kind in ('mappings', 'tickets'):
+                invalidate_dashboard_cache()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_pool.putconn(conn)
+
+    total_time = time.time() - started
+    print(f"⏱️ Finished in {total_time:.2f}s ({copied / total_time if total_time else copied:,.0f} rows/s overall)")
+    print("=" * 60)
+    return {'copied': copied, 'rejected': rejected, **results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import users, HR mappings or historical tickets.')
+    parser.add_argument('kind', choices=sorted(IMPORT_SPECS))
+    parser.add_argument('path', help='CSV (with header) or NDJSON file')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+    parser.add_argument('--rejects', help='write rejected rows with their reason to this CSV file')
+    parser.add_argument('--dry-run', action='store_true', help='validate and report, then roll back')
+    args = parser.parse_args(argv)
+
+    init_db()
+    try:
+        run_import(args.kind, args.path, args.format, args.rejects, args.dry_run)
+    except (OSError, ValueError) as e:
+        print(f"❌ Import failed: {e}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Cold-start budget check for hr_ticket_system.
+
+Imports the module in a fresh interpreter under ``python -X importtime``
+and fails when the cumulative import time exceeds the budget, or when a
+module that should only load on first use is pulled in at import.
+
+Usage:
+    python check_import_time.py            # budget from IMPORT_TIME_BUDGET_MS (default 1500)
+    python check_import_time.py --budget-ms 800 --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = int(os.environ.get('IMPORT_TIME_BUDGET_MS', 1500))
+TARGET_MODULE = 'hr_ticket_system'
+
+# Loaded lazily by the code paths that need them (SAP/WhatsApp calls,
+# schedulers, Excel exports, the Redis cache backend); importing any of these
+# at startup is a regression.
+LAZY_MODULES = ('requests', 'apscheduler', 'sqlalchemy', 'pandas', 'xlsxwriter', 'openpyxl', 'redis')
+
+
+def run_importtime(module):
+    """Return the -X importtime rows as (self_us, cumulative_us, name), in import order."""
+    env = dict(os.environ)
+    # No ngrok probe or DB connection should happen on import anyway; make sure of it.
+    env['NGROK_AUTODETECT'] = '0'
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"❌ 'import {module}' failed (exit {proc.returncode})")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # header row
+        rows.append((int(parts[0]), int(parts[1]), parts[2].rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=int, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=10, help='show the N slowest imports')
+    args = parser.parse_args()
+
+    rows = run_importtime(TARGET_MODULE)
+    target = [r for r in rows if r[2].strip() == TARGET_MODULE]
+    if not target:
+        raise SystemExit(f"❌ {TARGET_MODULE} not found in -X importtime output")
+    total_ms = target[-1][1] / 1000.0
+
+    print(f"⏱️ import {TARGET_MODULE}: {total_ms:.0f} ms cumulative (budget {args.budget_ms} ms)")
+    for self_us, cumulative_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"   {cumulative_us / 1000.0:8.1f} ms  {name.strip()}")
+
+    loaded = {name.strip() for _, _, name in rows}
+    offenders = sorted(m for m in LAZY_MODULES if m in loaded)
+
+    failed = False
+    if offenders:
+        print(f"❌ Imported at startup but should load lazily: {', '.join(offenders)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"❌ Import time {total_ms:.0f} ms exceeds budget {args.budget_ms} ms")
+        failed = True
+    if failed:
+        return 1
+    print("✅ Import time within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# Gunicorn settings for production serving: gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8112')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = '-'
+
+# Each worker imports the app itself, so DB pools, listener threads and
+# caches are never shared across a fork. create_app() warms the worker
+# before it accepts connections.
+preload_app = False
+
+# Postgres connections all web workers together may hold. Each worker has its
+# pool plus one LISTEN connection for HR directory changes. Keep this below
+# max_connections (default 100) minus worker.py, sap_proxy and admin sessions.
+db_connection_budget = int(os.environ.get('DB_CONNECTION_BUDGET', 80))
+pool_max = max(1, db_connection_budget // workers - 1)
+if pool_max < threads:
+    # Sessions and HR directory reloads can hold a second connection, and
+    # background threads share the pool, so this is a floor, not a target.
+    print(f"⚠️ DB_CONNECTION_BUDGET={db_connection_budget} leaves {pool_max} pooled connection(s) "
+          f"per worker for {threads} threads; busy requests wait up to DB_POOL_TIMEOUT_SECONDS "
+          f"for a connection, then get a 503")
+os.environ.setdefault('DB_POOL_MAX_CONNECTIONS', str(pool_max))
+# Keep one pooled connection per request thread
+os.environ.setdefault('DB_POOL_MIN_CONNECTIONS', str(min(threads, int(os.environ['DB_POOL_MAX_CONNECTIONS']))))
+
+def on_starting(server):
+    # Create/upgrade the schema once, before any worker boots. Runs in a
+    # child process so the master never holds DB connections.
+    subprocess.run([sys.executable, '-c', 'from hr_ticket_system import init_db; init_db()'], check=True)
@@ -1,31 +1,44 @@
-from flask import Flask, render_template, render_template_string, request, redirect, url_for, flash, jsonify , send_from_directory , send_file
+from flask import Flask, render_template, render_template_string, request, redirect, url_for, flash, jsonify , send_file
 from flask_mail import Mail, Message
 from werkzeug.utils import secure_filename
 import os
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
 from psycopg2 import pool
+from psycopg2 import errors as pg_errors
 from datetime import datetime, timedelta
 import uuid
 import traceback2 as traceback
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
 import time
+import select
 import random
+import hashlib
+import socket
+import secrets
+import zlib
+import bisect
+import unicodedata
+import math
+import threading
+from collections import OrderedDict, defaultdict, deque
 import string
-from flask import session, make_response
+from flask import session, make_response, has_request_context, Request, g
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+from werkzeug.exceptions import RequestEntityTooLarge, NotFound
+from werkzeug.security import safe_join
+import tempfile
+import importlib.util
+import mimetypes
+from urllib.parse import quote
 import smtplib
-import requests
-from requests.auth import HTTPBasicAuth
 from markupsafe import Markup
 import re
+import json
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 
 load_dotenv()
 
@@ -51,6 +64,8 @@ REMINDER_SCAN_INTERVAL_HOURS = 1             # scan frequency
 DAILY_SUMMARY_HOURS = [9, 16]                # 09:00 & 16:00 HR summaries
 MAX_ITEMS_IN_DAILY_EMAIL = 40                
 EMPLOYEE_MAX_REPLIES = 2                     # employee reply cap (instead of edit)
+MY_QUERY_RESPONSES_PER_PAGE = 20             # thread page size on the employee portal
+MY_QUERY_RESPONSES_MAX_PER_PAGE = 50
 
 def nl2br_filter(text):
     if text is None:
@@ -71,9 +86,14 @@ COMPANY_EMAIL_DOMAIN = os.environ.get('COMPANY_EMAIL_DOMAIN', 'example.com').str
 
 # Existing SERVER_HOST env var (if provided)
 SERVER_HOST = os.environ.get('SERVER_HOST')
+SERVER_HOST_CONFIGURED = bool(SERVER_HOST)
+# The ngrok probe is a blocking HTTP call, so it only runs from the dev
+# server entrypoint (never on import) and can be switched off.
+NGROK_AUTODETECT = os.environ.get('NGROK_AUTODETECT', '1') == '1'
 
 def get_ngrok_url():
     """Return the public HTTPS ngrok tunnel URL if ngrok is running locally."""
+    import requests
     try:
         r = requests.get("http://127.0.0.1:4042/api/tunnels", timeout=1)
         tunnels = r.json().get("tunnels", [])
@@ -83,41 +103,84 @@ def get_ngrok_url():
     except Exception:
         return None
 
-# Auto-detect ngrok URL if SERVER_HOST not provided
-if not SERVER_HOST:
+def configure_server_host(server_host):
+    """Set SERVER_HOST and the matching Flask URL generation config."""
+    global SERVER_HOST
+    SERVER_HOST = server_host
+    os.environ['SERVER_HOST'] = server_host
+
+    # Configure Flask URL generation to use the detected host and scheme
+    env_server_name = os.environ.get('SERVER_NAME')
+    if env_server_name:
+        app.config['SERVER_NAME'] = env_server_name
+        print(f"Using SERVER_NAME from environment: {env_server_name}")
+    else:
+        # When ngrok is auto-detected we avoid setting SERVER_NAME to prevent host-header mismatch (causes 404s)
+        if 'ngrok' in SERVER_HOST:
+            app.config['SERVER_NAME'] = None
+            print("Detected ngrok tunnel; skipping setting app.config['SERVER_NAME'] (allows both ngrok and LAN access).")
+        else:
+            host_for_config = SERVER_HOST.replace('https://','').replace('http://','')
+            app.config['SERVER_NAME'] = host_for_config
+            print(f"SERVER_NAME set to {host_for_config}")
+    app.config['PREFERRED_URL_SCHEME'] = os.environ.get('PREFERRED_URL_SCHEME', 'https' if SERVER_HOST.startswith('https') else 'http')
+
+def detect_ngrok_host():
+    """Dev server only: switch SERVER_HOST to a running ngrok tunnel when none was configured."""
+    if SERVER_HOST_CONFIGURED or not NGROK_AUTODETECT:
+        return
     ngrok_url = get_ngrok_url()
     if ngrok_url:
-        SERVER_HOST = ngrok_url
-        os.environ['SERVER_HOST'] = ngrok_url
+        configure_server_host(ngrok_url)
         print(f"🔗 SERVER_HOST auto-set to ngrok URL: {ngrok_url}")
-    else:
-        # Fallback to LAN host + port
-        SERVER_HOST = f"http://{LAN_HOST}:{PORT}"
-        os.environ['SERVER_HOST'] = SERVER_HOST
-        print(f"🔁 SERVER_HOST set to LAN host: {SERVER_HOST}")
-else:
-    print(f"Using SERVER_HOST from environment: {SERVER_HOST}")
 
-# Configure Flask URL generation to use the detected host and scheme
-env_server_name = os.environ.get('SERVER_NAME')
-if env_server_name:
-    app.config['SERVER_NAME'] = env_server_name
-    print(f"Using SERVER_NAME from environment: {env_server_name}")
+if SERVER_HOST_CONFIGURED:
+    print(f"Using SERVER_HOST from environment: {SERVER_HOST}")
+    configure_server_host(SERVER_HOST)
 else:
-    # When ngrok is auto-detected we avoid setting SERVER_NAME to prevent host-header mismatch (causes 404s)
-    if 'ngrok' in SERVER_HOST:
-        print("Detected ngrok tunnel; skipping setting app.config['SERVER_NAME'] (allows both ngrok and LAN access).")
-    else:
-        host_for_config = SERVER_HOST.replace('https://','').replace('http://','')
-        app.config['SERVER_NAME'] = host_for_config
-        print(f"SERVER_NAME set to {host_for_config}")
-app.config['PREFERRED_URL_SCHEME'] = os.environ.get('PREFERRED_URL_SCHEME', 'https' if SERVER_HOST.startswith('https') else 'http')
+    # Fallback to LAN host + port
+    configure_server_host(f"http://{LAN_HOST}:{PORT}")
+    print(f"🔁 SERVER_HOST set to LAN host: {SERVER_HOST}")
 app.config['APPLICATION_ROOT'] = '/' 
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
 
+# Per-type attachment limits, enforced while the upload streams in
+MB = 1024 * 1024
+UPLOAD_SIZE_LIMITS = {
+    'pdf': 25 * MB,      # multi-page scans from HR
+    'doc': 10 * MB,
+    'docx': 10 * MB,
+    'png': 8 * MB,
+    'jpg': 8 * MB,
+    'jpeg': 8 * MB,
+    'gif': 5 * MB,
+}
+UPLOAD_DEFAULT_SIZE_LIMIT = 2 * MB           # anything else is discarded by allowed_file() anyway
+UPLOAD_FORM_OVERHEAD_BYTES = 256 * 1024      # text fields + multipart framing
+# Uploads are streamed here, then renamed into uploads/<user_type>/<emp_code>/.
+# Same filesystem as the final location, so the rename is atomic.
+UPLOAD_INCOMING_DIR = os.path.join(UPLOAD_FOLDER, '.incoming')
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Content-addressed attachment store: uploads/blobs/ab/cd/<sha256>
+ATTACHMENT_BLOB_DIR = os.path.join(UPLOAD_FOLDER, 'blobs')
+# Unreferenced blobs (and stray files) younger than this are left alone, so a
+# purge never races an upload whose reference row is not committed yet.
+ATTACHMENT_PURGE_GRACE_SECONDS = 60 * 60
+ATTACHMENT_PURGE_HOUR = 3
+# Downloads: 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd) lets the
+# worker only authorise the request while the front proxy sends the bytes.
+ATTACHMENT_OFFLOAD = os.environ.get('ATTACHMENT_OFFLOAD', '').strip().lower()
+ATTACHMENT_ACCEL_PREFIX = os.environ.get('ATTACHMENT_ACCEL_PREFIX', '/_protected_uploads/')
+ATTACHMENT_CACHE_MAX_AGE = 365 * 24 * 3600
+app.config['USE_X_SENDFILE'] = ATTACHMENT_OFFLOAD == 'x-sendfile'
+# Thumbnails / PDF first-page previews are rendered off the request path
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+mimetypes.add_type('image/webp', '.webp')
+app.config['MAX_CONTENT_LENGTH'] = max(UPLOAD_SIZE_LIMITS.values()) + UPLOAD_FORM_OVERHEAD_BYTES
+
 app.config['DB_CONFIG'] = {
     'dbname': os.environ.get('DB_NAME'),
     'user': os.environ.get('DB_USER'),
@@ -125,10 +188,676 @@ app.config['DB_CONFIG'] = {
     'host': os.environ.get('DB_HOST'),
     'port': os.environ.get('DB_PORT')
 }
+# Per process. Connections above the minimum are closed when returned, so
+# keep it at least at the number of request threads per worker.
+DB_POOL_MIN_CONNECTIONS = int(os.environ.get('DB_POOL_MIN_CONNECTIONS', 4))
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', 20))
+# How long a checkout waits for a free connection before the request gets a 503
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 5))
+
+# Per-route database budgets, applied when a connection is checked out.
+# Interactive pages fail fast; exports and scheduler jobs get more room.
+DB_TIMEOUT_BUDGETS = {
+    'interactive': {'statement_timeout_ms': 5000, 'lock_timeout_ms': 2000},
+    'export': {'statement_timeout_ms': 60000, 'lock_timeout_ms': 5000},
+    'background': {'statement_timeout_ms': 300000, 'lock_timeout_ms': 10000},
+    'bulk': {'statement_timeout_ms': 0, 'lock_timeout_ms': 30000},   # 0 disables the timeout
+}
+ROUTE_DB_BUDGETS = {
+    'export_grievance_stats': 'export',
+}
+# Optional pre-flight EXPLAIN ceiling for ad-hoc dashboard filters (0 disables)
+QUERY_COST_CEILING = float(os.environ.get('QUERY_COST_CEILING', 0) or 0)
+
+_metrics_lock = threading.Lock()
+_metric_counters = defaultdict(int)
+_metric_timings = {}
+_metric_gauges = {}
+
+def metric_inc(name, amount=1):
+    with _metrics_lock:
+        _metric_counters[name] += amount
+
+def metric_observe(name, seconds):
+    """Record a duration sample as count / total / max."""
+    with _metrics_lock:
+        stats = _metric_timings.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        stats['count'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+def metric_set(name, value):
+    with _metrics_lock:
+        _metric_gauges[name] = value
+
+def metrics_snapshot():
+    with _metrics_lock:
+        return {
+            'counters': dict(_metric_counters),
+            'gauges': dict(_metric_gauges),
+            'timings': {name: dict(stats) for name, stats in _metric_timings.items()},
+        }
+
+# Per-integration circuit breakers: open when at least min_calls calls in the
+# last window_seconds failed at failure_rate or worse, fail fast for
+# open_seconds, then let one probe call through to decide.
+CIRCUIT_BREAKER_SETTINGS = {
+    'smtp': {'window_seconds': 120, 'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 60},
+    'whatsapp': {'window_seconds': 60, 'min_calls': 5, 'failure_rate': 0.5, 'open_seconds': 30},
+    'sap': {'window_seconds': 30, 'min_calls': 5, 'failure_rate': 0.5, 'open_seconds': 15},
+}
 
-db_pool = pool.SimpleConnectionPool(
-    1, 20, **app.config['DB_CONFIG']
-)
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f'{name} circuit is open')
+        self.name = name
+
+class CircuitBreaker:
+    """
+    Closed -> open -> half-open breaker over a sliding failure-rate window.
+    Callers ask allow() before the call and report record_success() or
+    record_failure() after it. State is per process.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, window_seconds=60, min_calls=5, failure_rate=0.5, open_seconds=30, half_open_probes=1):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.opened_at = None
+        self._calls = deque()   # (monotonic time, ok)
+        self._probes = 0
+        self._lock = threading.Lock()
+        metric_set(f'circuit.{name}.open', 0)
+
+    def _trim(self, now):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _transition(self, state, now):
+        self.state = state
+        self._probes = 0
+        if state == self.OPEN:
+            self.opened_at = now
+            metric_inc(f'circuit.{self.name}.opened')
+            print(f"⛔ {self.name} circuit OPEN: failing fast for {self.open_seconds}s")
+        elif state == self.CLOSED:
+            self.opened_at = None
+            self._calls.clear()
+            print(f"✅ {self.name} circuit closed")
+        metric_set(f'circuit.{self.name}.open', 0 if state == self.CLOSED else 1)
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.open_seconds:
+                self._transition(self.HALF_OPEN, now)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            metric_inc(f'circuit.{self.name}.rejected')
+            return False
+
+    def is_open(self):
+        with self._lock:
+            return self.state == self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                self._transition(self.CLOSED, now)
+                return
+            self._calls.append((now, True))
+            self._trim(now)
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            metric_inc(f'circuit.{self.name}.failures')
+            if self.state == self.HALF_OPEN:
+                self._transition(self.OPEN, now)
+                return
+            if self.state == self.OPEN:
+                return
+            self._calls.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self._transition(self.OPEN, now)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            snapshot = {
+                'state': self.state,
+                'calls_in_window': len(self._calls),
+                'failures_in_window': failures,
+                'window_seconds': self.window_seconds,
+            }
+            if self.state == self.OPEN:
+                snapshot['probe_in_seconds'] = max(0, round(self.open_seconds - (now - self.opened_at), 1))
+            return snapshot
+
+circuit_breakers = {name: CircuitBreaker(name, **settings) for name, settings in CIRCUIT_BREAKER_SETTINGS.items()}
+
+# GET handlers that only read. Their connections run in autocommit read-only
+# mode, so no transaction stays open while templates render.
+READ_ONLY_ENDPOINTS = {
+    'dashboard', 'hr_dashboard', 'master_dashboard', 'my_queries', 'my_query_responses',
+    'get_grievance_details', 'get_current_hr', 'get_user_details', 'feedback',
+    'respond_grievance', 'reply_grievance', 'edit_grievance', 'manage_hr_mappings',
+    'export_grievance_stats', 'scheduler_status', 'download_file', 'preview_attachment',
+}
+
+def current_db_readonly():
+    return (has_request_context() and request.method in ('GET', 'HEAD')
+            and request.endpoint in READ_ONLY_ENDPOINTS)
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings. No deletes; rebuild to shrink."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.num_bits = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing (Kirsch-Mitzenmacher) from one 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def size_bytes(self):
+        return len(self.bits)
+
+    @property
+    def false_positive_rate(self):
+        """Expected rate for the current fill."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+CACHE_URL = os.environ.get('CACHE_URL', '').strip()
+CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'hrts')
+CACHE_LOCAL_MAX_ENTRIES = 5000
+CACHE_NEAR_TTL_SECONDS = 30           # in-process copy kept in front of Redis
+CACHE_LOCK_TIMEOUT_SECONDS = 10       # how long one process may hold a key's load lock
+
+class LocalCache:
+    """
+    In-process cache backend: one bounded TTL LRU per namespace, with
+    concurrent loads of the same key coalesced. Invalidations only reach this
+    process.
+    """
+
+    def __init__(self, max_entries=CACHE_LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._subscribers = []
+
+    def _namespace(self, namespace):
+        with self._lock:
+            cache = self._namespaces.get(namespace)
+            if cache is None:
+                cache = self._namespaces[namespace] = TTLCache(self.max_entries)
+            return cache
+
+    def get(self, namespace, key):
+        return self._namespace(namespace).get(key)
+
+    def set(self, namespace, key, value, ttl):
+        self._namespace(namespace).set(key, value, ttl)
+
+    def invalidate(self, namespace, key=None):
+        """Drop one key, or the whole namespace when key is None."""
+        if key is None:
+            self._namespace(namespace).clear()
+        else:
+            self._namespace(namespace).delete(key)
+        for callback in self._subscribers:
+            callback(namespace, key)
+
+    def subscribe(self, callback):
+        """callback(namespace, key) runs after every invalidation."""
+        self._subscribers.append(callback)
+
+    def start_listener(self):
+        return None
+
+    def get_or_load(self, namespace, key, loader, ttl):
+        """
+        Return (value, source) where source is 'hit', 'miss' or 'coalesced'.
+        ttl is seconds, or a callable of the loaded value; a falsy ttl means
+        the value is not cached.
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            metric_inc(f'cache.{namespace}.hits')
+            return value, 'hit'
+
+        def load():
+            value = loader()
+            seconds = ttl(value) if callable(ttl) else ttl
+            if seconds:
+                self.set(namespace, key, value, seconds)
+            return value
+
+        value, shared = self._flight.do((namespace, key), load)
+        metric_inc(f'cache.{namespace}.' + ('coalesced' if shared else 'misses'))
+        return value, 'coalesced' if shared else 'miss'
+
+class RedisCache(LocalCache):
+    """
+    Shared cache backend for any server speaking the Redis protocol. Values
+    are JSON encoded under <prefix>:<namespace>:<generation>:<key>; dropping
+    a whole namespace bumps its generation counter with INCR, and the old
+    keys simply expire. A short-lived in-process copy sits in front of it and
+    is dropped on pub/sub invalidation from any worker. Loads are coalesced
+    within the process and guarded by a SET NX lock across processes.
+    """
+
+    _RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url=None, prefix=CACHE_KEY_PREFIX, max_entries=CACHE_LOCAL_MAX_ENTRIES, client=None):
+        import redis  # optional; only needed when CACHE_URL points at a Redis-compatible server
+        super().__init__(max_entries)
+        self.redis = redis
+        self.prefix = prefix
+        self.channel = f'{prefix}:invalidate'
+        self.client = client or redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._release_lock = self.client.register_script(self._RELEASE_LOCK)
+        # namespace -> (generation, re-read after); pub/sub pushes bumps sooner
+        self._generations = {}
+
+    def _generation(self, namespace):
+        cached = self._generations.get(namespace)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            generation = int(self.client.get(f'{self.prefix}:{namespace}:generation') or 0)
+        except self.redis.RedisError:
+            metric_inc('cache.redis_errors')
+            return cached[0] if cached else 0
+        self._set_generation(namespace, generation)
+        return generation
+
+    def _set_generation(self, namespace, generation):
+        self._generations[namespace] = (generation, time.monotonic() + CACHE_NEAR_TTL_SECONDS)
+
+    def _key(self, namespace, key):
+        return f'{self.prefix}:{namespace}:{self._generation(namespace)}:{key}'
+
+    def get(self, namespace, key):
+        value = super().get(namespace, key)
+        if value is not None:
+            return value
+        try:
+            raw = self.client.get(self._key(namespace, key))
+        except self.redis.RedisError as e:
+            metric_inc('cache.redis_errors')
+            print(f"⚠️ Cache read failed for {namespace}:{key}: {e}")
+            return None
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        super().set(namespace, key, value, CACHE_NEAR_TTL_SECONDS)
+        return value
+
+    def set(self, namespace, key, value, ttl):
+        super().set(namespace, key, value, min(ttl, CACHE_NEAR_TTL_SECONDS))
+        try:
+            self.client.set(self._key(namespace, key), json.dumps(value, default=str), ex=int(ttl))
+        except self.redis.RedisError as e:
+            metric_inc('cache.redis_errors')
+            print(f"⚠️ Cache write failed for {namespace}:{key}: {e}")
+
+    def invalidate(self, namespace, key=None):
+        try:
+            generation = None
+            if key is None:
+                generation = self.client.incr(f'{self.prefix}:{namespace}:generation')
+                self._set_generation(namespace, generation)
+            else:
+                self.client.delete(self._key(namespace, key))
+            self.client.publish(self.channel, json.dumps([namespace, key, generation]))
+        except self.redis.RedisError as e:
+            metric_inc('cache.redis_errors')
+            print(f"⚠️ Cache invalidation failed for {namespace}:{key}: {e}")
+        # Our own message also comes back through the listener; drop now anyway
+        super().invalidate(namespace, key)
+
+    def get_or_load(self, namespace, key, loader, ttl):
+        def guarded_loader():
+            lock_key = self._key(namespace, key) + ':lock'
+            token = uuid.uuid4().hex
+            try:
+                acquired = self.client.set(lock_key, token, nx=True, px=CACHE_LOCK_TIMEOUT_SECONDS * 1000)
+            except self.redis.RedisError:
+                return loader()
+            if not acquired:
+                # Another worker is loading this key; wait for its result
+                deadline = time.monotonic() + CACHE_LOCK_TIMEOUT_SECONDS
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    value = self.get(namespace, key)
+                    if value is not None:
+                        metric_inc(f'cache.{namespace}.remote_waits')
+                        return value
+                return loader()
+            try:
+                return loader()
+            finally:
+                try:
+                    self._release_lock(keys=[lock_key], args=[token])
+                except self.redis.RedisError:
+                    pass
+
+        return super().get_or_load(namespace, key, guarded_loader, ttl)
+
+    def _listen_loop(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    namespace, key, *generation = json.loads(message['data'])
+                    generation = generation[0] if generation else None
+                    if generation is not None:
+                        self._set_generation(namespace, generation)
+                    LocalCache.invalidate(self, namespace, key)
+            except Exception as e:
+                print(f"⚠️ Cache invalidation listener error: {e}; reconnecting in 5s")
+                time.sleep(5)
+
+    def start_listener(self):
+        thread = threading.Thread(target=self._listen_loop, name='cache-invalidation-listener', daemon=True)
+        thread.start()
+        return thread
+
+def create_cache(url=CACHE_URL):
+    """RedisCache when CACHE_URL is set (redis://, rediss://, unix://), else LocalCache."""
+    if not url:
+        return LocalCache()
+    if importlib.util.find_spec('redis') is None:
+        print("⚠️ CACHE_URL is set but the redis package is not installed; using in-process cache")
+        return LocalCache()
+    backend = RedisCache(url)
+    print(f"🗄️ Shared cache enabled (prefix '{backend.prefix}')")
+    return backend
+
+shared_cache = create_cache()
+
+DASHBOARD_CACHE_NAMESPACE = 'dashboard'
+DASHBOARD_AGGREGATE_CACHE_TTL_SECONDS = 120
+
+def invalidate_dashboard_cache():
+    """Call after committing any change to grievances, feedback or HR mappings."""
+    shared_cache.invalidate(DASHBOARD_CACHE_NAMESPACE)
+
+def current_db_budget():
+    if has_request_context():
+        return ROUTE_DB_BUDGETS.get(request.endpoint, 'interactive')
+    return 'background'
+
+class QueryCostExceeded(Exception):
+    """Raised when a filter query's planner estimate is above QUERY_COST_CEILING."""
+
+class PoolTimeout(pool.PoolError):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT_SECONDS."""
+
+DB_BUDGET_ERRORS = (pg_errors.QueryCanceled, pg_errors.LockNotAvailable, QueryCostExceeded, PoolTimeout)
+
+def note_db_budget_error(e):
+    """
+    Remember a budget error on the current request, so it still becomes a 503
+    (see surface_db_budget_errors) when a view's catch-all handler swallows it.
+    """
+    if not has_request_context() or 'db_budget_error' in g:
+        return
+    g.db_budget_error = e
+    current_session = session._get_current_object()  # None while the session itself is loading
+    g.db_budget_flash_count = len(current_session.get('_flashes', [])) if current_session is not None else 0
+
+class BudgetTrackingCursorMixin:
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        except DB_BUDGET_ERRORS as e:
+            note_db_budget_error(e)
+            raise
+
+    def executemany(self, query, vars_list):
+        try:
+            return super().executemany(query, vars_list)
+        except DB_BUDGET_ERRORS as e:
+            note_db_budget_error(e)
+            raise
+
+class BudgetTrackingCursor(BudgetTrackingCursorMixin, psycopg2.extensions.cursor):
+    """Default cursor for pooled connections."""
+
+class BudgetTrackingDictCursor(BudgetTrackingCursorMixin, psycopg2.extras.DictCursor):
+    """DictCursor variant for views that want rows by column name."""
+
+def check_query_cost(c, query, params):
+    """Pre-flight EXPLAIN for ad-hoc filter queries; no-op unless a ceiling is configured."""
+    if not QUERY_COST_CEILING:
+        return
+    c.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+    plan = c.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    total_cost = plan[0]['Plan']['Total Cost']
+    if total_cost > QUERY_COST_CEILING:
+        metric_inc(f'db.query_cost_rejected.{request.endpoint if has_request_context() else "background"}')
+        e = QueryCostExceeded(f'estimated cost {total_cost:.0f} exceeds ceiling {QUERY_COST_CEILING:.0f}')
+        note_db_budget_error(e)
+        raise e
+
+class BudgetedConnectionPool(pool.ThreadedConnectionPool):
+    """
+    Connection pool that sets statement_timeout / lock_timeout on checkout,
+    hands read-only GET handlers an autocommit read-only session, and always
+    returns connections to the pool outside any transaction. When all maxconn
+    connections are out, checkouts wait up to DB_POOL_TIMEOUT_SECONDS instead
+    of failing at once, then raise PoolTimeout (a 503).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._applied_modes = {}
+        self._checkouts = {}
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+
+    def getconn(self, key=None, budget=None, readonly=None):
+        endpoint = request.endpoint if has_request_context() else 'background'
+        wait_start = time.monotonic()
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT_SECONDS):
+            metric_inc(f'db.pool_timeouts.{endpoint}')
+            e = PoolTimeout(f'no database connection free after {DB_POOL_TIMEOUT_SECONDS:g}s')
+            note_db_budget_error(e)
+            raise e
+        metric_observe('db.pool_wait_seconds', time.monotonic() - wait_start)
+        try:
+            conn = super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+        budget = budget or current_db_budget()
+        readonly = current_db_readonly() if readonly is None else readonly
+        mode = (budget, readonly)
+        applied = self._applied_modes.get(id(conn))
+        # Settings are session-level, so only pay the round trip when the mode changes
+        if not applied or applied[0] is not conn or applied[1] != mode:
+            timeouts = DB_TIMEOUT_BUDGETS[budget]
+            try:
+                conn.set_session(readonly=readonly, autocommit=readonly)
+                with conn.cursor() as c:
+                    c.execute("SELECT set_config('statement_timeout', %s, false), set_config('lock_timeout', %s, false)",
+                              (f"{timeouts['statement_timeout_ms']}ms", f"{timeouts['lock_timeout_ms']}ms"))
+                conn.commit()
+            except Exception:
+                self._applied_modes.pop(id(conn), None)
+                super().putconn(conn, key, close=True)
+                self._slots.release()
+                raise
+            self._applied_modes[id(conn)] = (conn, mode)
+        self._checkouts[id(conn)] = (conn, time.monotonic(), endpoint)
+        return conn
+
+    def putconn(self, conn, key=None, close=False):
+        checkout = self._checkouts.pop(id(conn), None)
+        if checkout and checkout[0] is conn:
+            held = time.monotonic() - checkout[1]
+            endpoint = checkout[2]
+            metric_observe(f'db.checkout_seconds.{endpoint}', held)
+            if not conn.closed and conn.get_transaction_status() in (
+                    psycopg2.extensions.TRANSACTION_STATUS_INTRANS,
+                    psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+                # The handler never committed or rolled back: the session sat
+                # "idle in transaction" for (up to) the whole checkout.
+                metric_inc(f'db.uncommitted_returns.{endpoint}')
+                metric_observe(f'db.idle_in_transaction_seconds.{endpoint}', held)
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            self._applied_modes.pop(id(conn), None)
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            if checkout and checkout[0] is conn:
+                self._slots.release()
+
+class LazyConnectionPool:
+    """
+    Defers opening the pool (and its min connections) until the first
+    checkout, so importing the module never blocks on Postgres.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = self._factory()
+        return self._pool
+
+    def getconn(self, key=None, budget=None, readonly=None):
+        return self._get_pool().getconn(key, budget=budget, readonly=readonly)
+
+    def putconn(self, conn, key=None, close=False):
+        self._get_pool().putconn(conn, key, close)
+
+    def closeall(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
+db_pool = LazyConnectionPool(lambda: BudgetedConnectionPool(
+    DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS,
+    cursor_factory=BudgetTrackingCursor, **app.config['DB_CONFIG']
+))
 
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER')
 app.config['MAIL_PORT'] = os.environ.get('MAIL_PORT')
@@ -137,10 +866,173 @@ app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
 
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)  # also the server-side idle timeout
 app.jinja_env.globals['COMPANY_EMAIL_DOMAIN'] = COMPANY_EMAIL_DOMAIN
 
+SESSION_CACHE_NAMESPACE = 'session'
+SESSION_HOT_CACHE_MAX_ENTRIES = 2000
+SESSION_HOT_CACHE_TTL_SECONDS = 60
+SESSION_PURGE_INTERVAL_MINUTES = 30
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict whose contents live in user_sessions; the cookie only carries sid."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = sid is None
+        self.modified = False
+        self.rotate = False
+
+    def regenerate(self):
+        """Issue a fresh sid on save (call on login to prevent session fixation)."""
+        self.rotate = True
+        self.modified = True
+
+class PostgresSessionInterface(SessionInterface):
+    """
+    Server-side sessions in the user_sessions table. Records are tagged-JSON,
+    zlib-compressed into BYTEA. With a Redis CACHE_URL recently used records
+    are also kept in process, and writes drop other workers' copies through
+    the shared_cache pub/sub. Without one there is no way to reach the other
+    workers, so every request reads the table.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, cache=None):
+        cache = cache or shared_cache
+        self.hot_cache = TTLCache(SESSION_HOT_CACHE_MAX_ENTRIES) if isinstance(cache, RedisCache) else None
+        self.cache = cache
+        cache.subscribe(self._on_invalidate)
+
+    def _on_invalidate(self, namespace, key):
+        if namespace != SESSION_CACHE_NAMESPACE or self.hot_cache is None:
+            return
+        if key is None:
+            self.hot_cache.clear()
+        else:
+            self.hot_cache.delete(key)
+
+    def _encode(self, data):
+        return zlib.compress(self.serializer.dumps(dict(data)).encode('utf-8'))
+
+    def _decode(self, blob):
+        return self.serializer.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        # Static files never read the session; skip the lookup entirely. The
+        # URL is not matched yet at this point, so test the path, not the endpoint.
+        if not sid or (app.static_url_path and request.path.startswith(app.static_url_path + '/')):
+            return ServerSideSession()
+
+        now = datetime.now()
+        hot = self.hot_cache.get(sid) if self.hot_cache is not None else None
+        if hot is not None and hot[1] > now:
+            metric_inc('session.hot_hits')
+            return ServerSideSession(self._decode(hot[0]), sid, hot[1])
+
+        conn = db_pool.getconn()
+        try:
+            with conn.cursor() as c:
+                c.execute('SELECT data, expires_at FROM user_sessions WHERE sid = %s AND expires_at > %s', (sid, now))
+                row = c.fetchone()
+        finally:
+            db_pool.putconn(conn)
+        metric_inc('session.db_loads')
+        if not row:
+            # Unknown or expired id: start over with a server-issued one
+            return ServerSideSession()
+        blob, expires_at = bytes(row[0]), row[1]
+        if self.hot_cache is not None:
+            self.hot_cache.set(sid, (blob, expires_at), SESSION_HOT_CACHE_TTL_SECONDS)
+        return ServerSideSession(self._decode(blob), sid, expires_at)
+
+    def _write(self, statement, params, sid):
+        conn = db_pool.getconn(readonly=False)
+        try:
+            with conn.cursor() as c:
+                c.execute(statement, params)
+            conn.commit()
+        finally:
+            db_pool.putconn(conn)
+        if self.hot_cache is not None:
+            self.cache.invalidate(SESSION_CACHE_NAMESPACE, sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        lifetime = app.permanent_session_lifetime
+        now = datetime.now()
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.sid and (session.rotate or (session.modified and not session)):
+            self._write('DELETE FROM user_sessions WHERE sid = %s', (session.sid,), session.sid)
+            if not session:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+                return
+            session.sid = None
+
+        if not session:
+            return
+
+        if not session.modified:
+            # Sliding expiry, written at most once per half lifetime
+            if session.expires_at and session.expires_at - now < lifetime / 2:
+                session.expires_at = now + lifetime
+                self._write('UPDATE user_sessions SET expires_at = %s WHERE sid = %s',
+                            (session.expires_at, session.sid), session.sid)
+            return
+
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires_at = now + lifetime
+        blob = self._encode(session)
+        self._write('''
+            INSERT INTO user_sessions (sid, data, expires_at) VALUES (%s, %s, %s)
+            ON CONFLICT (sid) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+        ''', (session.sid, psycopg2.Binary(blob), session.expires_at), session.sid)
+        if self.hot_cache is not None:
+            self.hot_cache.set(session.sid, (blob, session.expires_at), SESSION_HOT_CACHE_TTL_SECONDS)
+        metric_inc('session.writes')
+        metric_observe('session.record_bytes', len(blob))
+
+        if new_sid:
+            response.set_cookie(name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+app.session_interface = PostgresSessionInterface()
+
+def purge_expired_sessions():
+    """Delete every expired session record in one statement."""
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute('DELETE FROM user_sessions WHERE expires_at <= %s', (datetime.now(),))
+            purged = c.rowcount
+        conn.commit()
+    finally:
+        db_pool.putconn(conn)
+    metric_inc('session.purged', purged)
+    if purged:
+        print(f"🧹 Purged {purged} expired session(s)")
+    return purged
+
 mail = Mail(app)
 
 GRIEVANCE_TYPES = {
@@ -173,34 +1065,485 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_upload_path(user_type, emp_code):
+def upload_size_limit(filename):
+    ext = filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+    return UPLOAD_SIZE_LIMITS.get(ext, UPLOAD_DEFAULT_SIZE_LIMIT)
+
+def _human_size(num_bytes):
+    return f"{num_bytes / MB:.0f} MB" if num_bytes >= MB else f"{num_bytes // 1024} KB"
+
+class HashedUploadStream:
+    """
+    Writable file target for one multipart file part. Chunks go straight to a
+    temp file under UPLOAD_INCOMING_DIR while SHA-256 and size are tracked;
+    the part is rejected with 413 as soon as it passes its type's limit.
+    commit() renames it into place; close() without commit() deletes it.
+    """
+
+    def __init__(self, filename, limit=None):
+        os.makedirs(UPLOAD_INCOMING_DIR, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix='upload-', suffix='.part', dir=UPLOAD_INCOMING_DIR)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.filename = filename
+        self.limit = limit if limit is not None else upload_size_limit(filename)
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            self.discard()
+            metric_inc('uploads.rejected_too_large')
+            raise RequestEntityTooLarge(f"{self.filename} is larger than the {_human_size(self.limit)} limit for this file type.")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def commit(self, dest_path):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, dest_path)
+        self.temp_path = None
+        return dest_path
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.temp_path:
+            try:
+                os.unlink(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
+
+    def close(self):
+        self.discard()
+
+    def __getattr__(self, name):
+        # read/seek/tell for FileStorage and the multipart parser
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """Request whose multipart file parts stream into HashedUploadStream."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = upload_size_limit(filename)
+        # Reject from the Content-Length header before reading any of the body
+        if total_content_length and total_content_length > limit + UPLOAD_FORM_OVERHEAD_BYTES:
+            metric_inc('uploads.rejected_too_large')
+            raise RequestEntityTooLarge(f"{filename} is larger than the {_human_size(limit)} limit for this file type.")
+        return HashedUploadStream(filename, limit)
+
+app.request_class = UploadRequest
+
+def blob_path(sha256):
+    return os.path.join(ATTACHMENT_BLOB_DIR, sha256[:2], sha256[2:4], sha256)
+
+def save_upload(file):
+    """
+    Store an uploaded FileStorage in the blob store, keyed by its SHA-256.
+    A file whose content is already stored is dropped instead of kept twice.
+    Returns (blob_path, sha256_hex, size_bytes); record who uses it with
+    add_attachment_ref() in the same transaction as the grievance/response row.
+    """
+    stream = file.stream
+    if not isinstance(stream, HashedUploadStream):
+        # Parsed outside UploadRequest (e.g. test client with a prebuilt FileStorage)
+        stream = HashedUploadStream(file.filename)
+        try:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                stream.write(chunk)
+        except Exception:
+            stream.discard()
+            raise
+    path = blob_path(stream.sha256)
+    if os.path.exists(path):
+        stream.discard()
+        os.utime(path)  # keeps purge_unreferenced_blobs() off it until the ref row lands
+        metric_inc('uploads.deduplicated')
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stream.commit(path)
+    metric_observe('uploads.bytes', stream.size)
+    schedule_preview(path, file.filename)
+    return path, stream.sha256, stream.size
+
+_preview_pool = None
+_preview_pool_lock = threading.Lock()
+_preview_pending = set()
+_preview_warned = set()
+
+def get_preview_pool():
+    """Process pool for preview rendering, started on first upload."""
+    global _preview_pool
+    if _preview_pool is None:
+        with _preview_pool_lock:
+            if _preview_pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn: never fork a process that is running request threads
+                _preview_pool = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+    return _preview_pool
+
+def schedule_preview(blob_file, filename):
+    """Queue thumbnail/preview rendering for a stored blob. Returns True if queued."""
+    import previews
+    kind = previews.preview_kind(filename)
+    if not kind or PREVIEW_WORKERS <= 0:
+        return False
+    if not previews.renderer_available(kind):
+        if kind not in _preview_warned:
+            _preview_warned.add(kind)
+            print(f"⚠️ Previews for {kind} attachments disabled: install Pillow" + (" and PyMuPDF" if kind == 'pdf' else ''))
+        return False
+    if all(os.path.exists(previews.preview_path(blob_file, v)) for v in previews.variants_for(kind)):
+        return False
+    with _preview_pool_lock:
+        if blob_file in _preview_pending:
+            return False
+        _preview_pending.add(blob_file)
+    started = time.monotonic()
+
+    def done(future):
+        with _preview_pool_lock:
+            _preview_pending.discard(blob_file)
+        error = future.exception()
+        if error:
+            metric_inc('previews.failed')
+            print(f"❌ Preview rendering failed for {os.path.basename(blob_file)[:12]}: {error}")
+        else:
+            metric_observe('previews.render_seconds', time.monotonic() - started)
+
+    try:
+        get_preview_pool().submit(previews.render_previews, blob_file, kind).add_done_callback(done)
+    except RuntimeError as e:  # pool shut down / broken
+        with _preview_pool_lock:
+            _preview_pending.discard(blob_file)
+        print(f"❌ Could not queue preview: {e}")
+        return False
+    return True
+
+def attachment_preview_url(user_type, emp_code, filename, variant='thumb'):
+    """Preview URL for templates, or None when the attachment type has no preview."""
+    import previews
+    kind = previews.preview_kind(filename)
+    if not kind or variant not in previews.variants_for(kind):
+        return None
+    return url_for('preview_attachment', user_type=user_type, emp_code=emp_code, filename=filename, variant=variant)
+
+app.jinja_env.globals['attachment_preview_url'] = attachment_preview_url
+
+def unique_attachment_name(c, user_type, emp_code, filename, sha256):
+    """
+    Download names are write-once, which is what lets download_file mark
+    responses immutable. A name already used for different content gets
+    the content hash as a prefix.
+    """
+    c.execute("""SELECT sha256 FROM attachment_refs
+                 WHERE user_type = %s AND emp_code = %s AND filename = %s""",
+              (user_type, emp_code, filename))
+    row = c.fetchone()
+    if row and row[0] != sha256:
+        return f"{sha256[:12]}_{filename}"
+    return filename
+
+def add_attachment_ref(c, user_type, emp_code, filename, sha256, size_bytes, grievance_id, original_name, response_id=None):
+    """
+    Point the download name uploads/<user_type>/<emp_code>/<filename> at a blob
+    and bump its reference count. Pick filename with unique_attachment_name().
+    """
+    c.execute("""INSERT INTO attachment_blobs (sha256, size_bytes, ref_count)
+                 VALUES (%s, %s, 0)
+                 ON CONFLICT (sha256) DO UPDATE SET last_referenced_at = NOW()""",
+              (sha256, size_bytes))
+    c.execute("""INSERT INTO attachment_refs
+                 (user_type, emp_code, filename, sha256, grievance_id, response_id, original_name)
+                 VALUES (%s, %s, %s, %s, %s, %s, %s)
+                 ON CONFLICT (user_type, emp_code, filename) DO NOTHING
+                 RETURNING sha256""",
+              (user_type, emp_code, filename, sha256, grievance_id, response_id, original_name))
+    if c.fetchone():
+        c.execute('UPDATE attachment_blobs SET ref_count = ref_count + 1 WHERE sha256 = %s', (sha256,))
+
+def release_attachment_ref(c, user_type, emp_code, filename):
+    """Drop a download name; its blob is deleted by the purge job once nothing else uses it."""
+    c.execute("""DELETE FROM attachment_refs
+                 WHERE user_type = %s AND emp_code = %s AND filename = %s
+                 RETURNING sha256""", (user_type, emp_code, filename))
+    row = c.fetchone()
+    if row:
+        c.execute("""UPDATE attachment_blobs SET ref_count = ref_count - 1, last_referenced_at = NOW()
+                     WHERE sha256 = %s""", (row[0],))
+
+def release_grievance_attachments(c, grievance_id):
+    """Drop every download name of a deleted query and its responses in one statement."""
+    c.execute("""
+        WITH released AS (
+            DELETE FROM attachment_refs WHERE grievance_id = %s RETURNING sha256
+        )
+        UPDATE attachment_blobs b
+        SET ref_count = b.ref_count - r.refs, last_referenced_at = NOW()
+        FROM (SELECT sha256, COUNT(*) AS refs FROM released GROUP BY sha256) r
+        WHERE b.sha256 = r.sha256
+    """, (grievance_id,))
+
+def lookup_attachment(user_type, emp_code, filename):
+    """(blob_path, sha256, size_bytes) for a download name, or None for legacy per-employee files."""
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute("""SELECT r.sha256, b.size_bytes
+                         FROM attachment_refs r JOIN attachment_blobs b ON b.sha256 = r.sha256
+                         WHERE r.user_type = %s AND r.emp_code = %s AND r.filename = %s""",
+                      (user_type, emp_code, filename))
+            row = c.fetchone()
+    finally:
+        db_pool.putconn(conn)
+    if not row:
+        return None
+    return blob_path(row[0]), row[0], row[1]
+
+def can_view_attachment(user, user_type, emp_code, filename):
+    """
+    Whether the session user may see an upload: its uploader, the employee who
+    owns the ticket, the ticket's HR (assigned, else mapped) or an admin.
+    """
+    if not user or not user.get('authenticated'):
+        return False
+    if user.get('role') == 'admin' or user.get('emp_code') == emp_code:
+        return True
+    params = {'user_type': user_type, 'emp_code': emp_code, 'filename': filename}
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute("""SELECT grievance_id FROM attachment_refs
+                         WHERE user_type = %(user_type)s AND emp_code = %(emp_code)s AND filename = %(filename)s""",
+                      params)
+            grievance_ids = [row[0] for row in c.fetchall() if row[0]]
+            if not grievance_ids:
+                # Uploaded before the blob store: find the ticket by its stored attachment name
+                c.execute("""SELECT g.id FROM grievances g
+                             WHERE %(user_type)s = 'employee' AND g.emp_code = %(emp_code)s
+                               AND g.attachment_path = %(filename)s
+                             UNION
+                             SELECT r.grievance_id FROM responses r
+                             JOIN grievances g ON g.id = r.grievance_id
+                             WHERE r.attachment_path = %(filename)s
+                               AND CASE WHEN %(user_type)s = 'employee' THEN g.emp_code = %(emp_code)s
+                                        ELSE EXISTS (SELECT 1 FROM users u
+                                                     WHERE u.emp_code = %(emp_code)s
+                                                       AND u.employee_email = r.responder_email) END""",
+                          params)
+                grievance_ids = [row[0] for row in c.fetchall()]
+            if not grievance_ids:
+                return False
+            c.execute("""SELECT 1 FROM grievances g
+                         LEFT JOIN hr_grievance_mapping m ON m.grievance_type = g.grievance_type
+                         WHERE g.id = ANY(%s)
+                           AND (g.emp_code = %s OR COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s)
+                         LIMIT 1""",
+                      (grievance_ids, user.get('emp_code'), user.get('emp_code') if user.get('role') == 'hr' else None))
+            return c.fetchone() is not None
+    finally:
+        db_pool.putconn(conn)
+
+def purge_unreferenced_blobs():
+    """
+    Delete blobs whose reference count reached zero, plus blob files that never
+    got a row (the upload's transaction failed). Both wait out the grace period.
+    """
+    cutoff = datetime.now() - timedelta(seconds=ATTACHMENT_PURGE_GRACE_SECONDS)
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute("""DELETE FROM attachment_blobs
+                         WHERE ref_count <= 0 AND last_referenced_at < %s
+                         RETURNING sha256""", (cutoff,))
+            released = [row[0] for row in c.fetchall()]
+        conn.commit()
+        with conn.cursor() as c:
+            c.execute('SELECT sha256 FROM attachment_blobs')
+            known = {row[0] for row in c.fetchall()}
+        conn.commit()
+    finally:
+        db_pool.putconn(conn)
+
+    cutoff_ts = cutoff.timestamp()
+    removed = 0
+    candidates = [blob_path(sha) for sha in released]
+    for root, _dirs, files in os.walk(ATTACHMENT_BLOB_DIR):
+        # <sha256> and its <sha256>.<variant>.webp previews
+        candidates.extend(os.path.join(root, name) for name in files if name.split('.', 1)[0] not in known)
+    for path in set(candidates):
+        try:
+            # A fresh mtime means an upload just deduplicated onto this blob
+            if os.path.getmtime(path) < cutoff_ts:
+                os.unlink(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    metric_inc('attachments.blobs_purged', removed)
+    if removed:
+        print(f"🧹 Purged {removed} unreferenced attachment blob(s)")
+    return removed
+
+HR_DIRECTORY_CHANNEL = 'hr_directory_changed'
+
+class HRDirectory:
     """
-    Returns the directory path for uploads based on user type and emp_code.
+    In-process routing table (grievance type -> HR emp_code) and HR roster.
+
+    Loaded once and reloaded lazily after invalidate(). Writers to users or
+    hr_grievance_mapping call invalidate() after committing and NOTIFY
+    HR_DIRECTORY_CHANNEL so other processes drop their copy as well.
     """
-    base_dir = os.path.join(UPLOAD_FOLDER, user_type, emp_code)
-    os.makedirs(base_dir, exist_ok=True)
-    return base_dir
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._people = {}
+        self._generation = 0
+        self._loaded_generation = -1
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def reload(self):
+        with self._lock:
+            generation = self._generation
+        conn = db_pool.getconn(readonly=True)
+        try:
+            with conn.cursor() as c:
+                c.execute('SELECT grievance_type, hr_emp_code FROM hr_grievance_mapping')
+                routes = dict(c.fetchall())
+                c.execute('''
+                    SELECT emp_code, employee_name, employee_email, employee_phone, role, is_active
+                    FROM users
+                    WHERE role IN ('hr', 'admin')
+                       OR emp_code IN (SELECT hr_emp_code FROM hr_grievance_mapping)
+                ''')
+                people = {
+                    row[0]: {
+                        'emp_code': row[0],
+                        'employee_name': row[1],
+                        'employee_email': row[2],
+                        'employee_phone': row[3],
+                        'role': row[4],
+                        'is_active': row[5],
+                    }
+                    for row in c.fetchall()
+                }
+        finally:
+            db_pool.putconn(conn)
+        with self._lock:
+            self._routes = routes
+            self._people = people
+            # An invalidate() that raced with this load keeps the directory stale
+            self._loaded_generation = generation
+        metric_inc('hr_directory.reloads')
+
+    def _snapshot(self):
+        if self._loaded_generation != self._generation:
+            self.reload()
+        return self._routes, self._people
+
+    def hr_for_type(self, grievance_type):
+        routes, _ = self._snapshot()
+        return routes.get(grievance_type)
+
+    def person(self, emp_code):
+        _, people = self._snapshot()
+        return people.get(emp_code)
+
+    def contact(self, emp_code):
+        """(email, name, phone) for an HR/admin emp_code, or None."""
+        person = self.person(emp_code) if emp_code else None
+        if not person:
+            return None
+        return (person['employee_email'], person['employee_name'], person['employee_phone'])
+
+    def contact_for_type(self, grievance_type):
+        return self.contact(self.hr_for_type(grievance_type))
+
+    def hr_staff(self):
+        """[(emp_code, employee_name)] for role 'hr', ordered by name."""
+        _, people = self._snapshot()
+        staff = [(p['emp_code'], p['employee_name']) for p in people.values() if p['role'] == 'hr']
+        return sorted(staff, key=lambda row: (row[1] or '').lower())
+
+    def mappings(self):
+        routes, people = self._snapshot()
+        return {
+            grievance_type: {
+                'name': people.get(hr_emp_code, {}).get('employee_name'),
+                'emp_code': hr_emp_code if hr_emp_code in people else None,
+            }
+            for grievance_type, hr_emp_code in routes.items()
+        }
+
+hr_directory = HRDirectory()
+
+def notify_hr_directory_changed(c):
+    """Tell every process to drop its HR directory once the current transaction commits."""
+    c.execute(f'NOTIFY {HR_DIRECTORY_CHANNEL}')
+
+def _hr_directory_listen_loop():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**app.config['DB_CONFIG'])
+            conn.autocommit = True
+            with conn.cursor() as c:
+                c.execute(f'LISTEN {HR_DIRECTORY_CHANNEL}')
+            # Anything may have changed while we were not listening
+            hr_directory.invalidate()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    hr_directory.invalidate()
+        except Exception as e:
+            print(f"⚠️ HR directory listener error: {e}; reconnecting in 5s")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+def start_hr_directory_listener():
+    """Invalidate hr_directory when another process changes users or mappings."""
+    thread = threading.Thread(target=_hr_directory_listen_loop, name='hr-directory-listener', daemon=True)
+    thread.start()
+    return thread
 
 def get_hr_contact(c, grievance_id=None, grievance_type=None):
     """Resolve HR contact using grievance override first, then type mapping."""
     hr_emp_code = None
     if grievance_id:
-        c.execute('''
-            SELECT COALESCE(g.assigned_hr_emp_code, m.hr_emp_code)
-            FROM grievances g
-            LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
-            WHERE g.id = %s
-        ''', (grievance_id,))
+        c.execute('SELECT assigned_hr_emp_code, grievance_type FROM grievances WHERE id = %s', (grievance_id,))
         row = c.fetchone()
-        hr_emp_code = row[0] if row else None
+        if row:
+            hr_emp_code = row[0] or hr_directory.hr_for_type(row[1])
     elif grievance_type:
-        c.execute('SELECT hr_emp_code FROM hr_grievance_mapping WHERE grievance_type = %s', (grievance_type,))
-        row = c.fetchone()
-        hr_emp_code = row[0] if row else None
+        hr_emp_code = hr_directory.hr_for_type(grievance_type)
 
     if not hr_emp_code:
         return None
 
+    contact = hr_directory.contact(hr_emp_code)
+    if contact:
+        return contact
+    # Assigned to someone outside the HR roster
     c.execute('SELECT employee_email, employee_name, employee_phone FROM users WHERE emp_code = %s', (hr_emp_code,))
     return c.fetchone()
 
@@ -263,6 +1606,8 @@ def init_db():
     conn = db_pool.getconn()
     try:
         with conn.cursor() as c:
+            # The web server and worker.py may both run this at boot; serialize them
+            c.execute("SELECT pg_advisory_xact_lock(hashtext('hr_ticket_system.init_db'))")
             c.execute('''CREATE TABLE IF NOT EXISTS grievances
                         (id TEXT PRIMARY KEY,
                          emp_code TEXT NOT NULL,
@@ -464,20 +1809,104 @@ def init_db():
 
             c.execute('CREATE INDEX IF NOT EXISTS idx_hr_mapping_grievance_type ON hr_grievance_mapping(grievance_type)')
 
+            # Local copy of SAP EmpJob data, refreshed by sync_employee_directory()
+            c.execute('''CREATE TABLE IF NOT EXISTS employee_directory
+                        (emp_code TEXT PRIMARY KEY,
+                         employee_name TEXT,
+                         employee_email TEXT,
+                         employee_phone TEXT,
+                         date_of_birth DATE,
+                         business_unit TEXT,
+                         department TEXT,
+                         employment_status TEXT,
+                         is_active BOOLEAN NOT NULL DEFAULT TRUE,
+                         sap_last_modified TIMESTAMP,
+                         synced_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)''')
+
+            c.execute('''CREATE TABLE IF NOT EXISTS user_sessions
+                        (sid TEXT PRIMARY KEY,
+                         data BYTEA NOT NULL,
+                         expires_at TIMESTAMP NOT NULL)''')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_expires_at ON user_sessions(expires_at)')
+
+            c.execute('''CREATE TABLE IF NOT EXISTS attachment_blobs
+                        (sha256 TEXT PRIMARY KEY,
+                         size_bytes BIGINT NOT NULL,
+                         ref_count INTEGER NOT NULL DEFAULT 0,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         last_referenced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_attachment_blobs_unreferenced
+                         ON attachment_blobs(last_referenced_at) WHERE ref_count <= 0''')
+            # Download name (uploads/<user_type>/<emp_code>/<filename>) -> blob
+            c.execute('''CREATE TABLE IF NOT EXISTS attachment_refs
+                        (user_type TEXT NOT NULL,
+                         emp_code TEXT NOT NULL,
+                         filename TEXT NOT NULL,
+                         sha256 TEXT NOT NULL REFERENCES attachment_blobs(sha256),
+                         grievance_id TEXT,
+                         response_id INTEGER,
+                         original_name TEXT,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         PRIMARY KEY (user_type, emp_code, filename))''')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_attachment_refs_sha256 ON attachment_refs(sha256)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_attachment_refs_grievance ON attachment_refs(grievance_id)')
+
+            c.execute('''CREATE TABLE IF NOT EXISTS scheduler_jobs
+                        (job_id TEXT PRIMARY KEY,
+                         node TEXT,
+                         status TEXT,
+                         started_at TIMESTAMP,
+                         finished_at TIMESTAMP,
+                         duration_seconds DOUBLE PRECISION,
+                         lease_until TIMESTAMP,
+                         error TEXT)''')
+
+            c.execute('''CREATE TABLE IF NOT EXISTS sap_sync_state
+                        (job TEXT PRIMARY KEY,
+                         watermark TIMESTAMP,
+                         last_run_at TIMESTAMP,
+                         rows_synced INTEGER)''')
+
+            # Employee notifications queued by bulk actions, sent by deliver_queued_notifications
+            c.execute('''CREATE TABLE IF NOT EXISTS notification_outbox
+                        (id SERIAL PRIMARY KEY,
+                         channel TEXT NOT NULL,
+                         payload JSONB NOT NULL,
+                         status TEXT NOT NULL DEFAULT 'pending',
+                         attempts INTEGER NOT NULL DEFAULT 0,
+                         next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                         claimed_at TIMESTAMP,
+                         last_error TEXT,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         sent_at TIMESTAMP)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+                         ON notification_outbox(next_attempt_at) WHERE status IN ('pending', 'sending')''')
+            notify_hr_directory_changed(c)
+
         conn.commit()
+        hr_directory.invalidate()
     except psycopg2.Error as e:
         print(f"Database initialization error: {str(e)}")
         raise
     finally:
         db_pool.putconn(conn)
         
-def send_email_flask_mail(to_email, subject, body, attachment_path=None):
+def send_email_flask_mail(to_email, subject, body, attachment_path=None, attachment_name=None):
     if not to_email:
         print("\n" + "="*60)
         print("📭 NO EMAIL PROVIDED – SKIPPING SMTP SEND (WhatsApp-only flow).")
         print(f" Subject: {subject}")
         print(" Returning success=True so process continues.\n" + "="*60)
         return True
+    breaker = circuit_breakers['smtp']
+    if not breaker.allow():
+        print(f"⛔ SMTP circuit open – not sending '{subject}' to {to_email}")
+        return False
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.base import MIMEBase
+    from email import encoders
+
     print("\n" + "="*60)
     print("📧 SMTP EMAIL SENDING STARTED")
     print("="*60)
@@ -520,12 +1949,13 @@ def send_email_flask_mail(to_email, subject, body, attachment_path=None):
                         part.set_payload(attachment.read())
                     
                     encoders.encode_base64(part)
+                    attachment_name = attachment_name or os.path.basename(attachment_path)
                     part.add_header(
                         'Content-Disposition',
-                        f'attachment; filename= {os.path.basename(attachment_path)}'
+                        f'attachment; filename= {attachment_name}'
                     )
                     msg.attach(part)
-                    print(f"✅ Attachment added: {os.path.basename(attachment_path)}")
+                    print(f"✅ Attachment added: {attachment_name}")
                 except Exception as attachment_error:
                     print(f"❌ ATTACHMENT ERROR: {str(attachment_error)}")
                     print(f" Continuing without attachment...")
@@ -546,6 +1976,7 @@ def send_email_flask_mail(to_email, subject, body, attachment_path=None):
             text = msg.as_string()
             server.sendmail(from_email, recipients, text)
             server.quit()
+            breaker.record_success()
             
             print(f"✅ Email sent successfully using internal SMTP server!")
             print(f"\n🎉 EMAIL SENDING COMPLETED SUCCESSFULLY!")
@@ -556,7 +1987,8 @@ def send_email_flask_mail(to_email, subject, body, attachment_path=None):
             print(f"\n❌ SMTP CONNECTION ERROR:")
             print(f" Error: {str(e)}")
             print(f" Server: {smtp_server}:{smtp_port}")
-            if retry_count < MAX_RETRIES - 1:
+            breaker.record_failure()
+            if retry_count < MAX_RETRIES - 1 and not breaker.is_open():
                 retry_delay = BASE_DELAY * (2 ** retry_count)
                 print(f"⏳ Retrying in {retry_delay} seconds... (Attempt {retry_count + 1}/{MAX_RETRIES})")
                 time.sleep(retry_delay)
@@ -566,6 +1998,7 @@ def send_email_flask_mail(to_email, subject, body, attachment_path=None):
                 return False
                 
         except smtplib.SMTPRecipientsRefused as e:
+            breaker.record_success()  # the relay answered; the address is the problem
             print(f"\n❌ SMTP RECIPIENTS REFUSED:")
             print(f" Error: {str(e)}")
             print(f" Check recipient email addresses")
@@ -579,8 +2012,9 @@ def send_email_flask_mail(to_email, subject, body, attachment_path=None):
             import traceback
             print(f"\n🔍 FULL TRACEBACK:")
             print(f" {traceback.format_exc()}")
+            breaker.record_failure()
             
-            if retry_count < MAX_RETRIES - 1:
+            if retry_count < MAX_RETRIES - 1 and not breaker.is_open():
                 retry_delay = BASE_DELAY * (2 ** retry_count)
                 print(f"⏳ Retrying in {retry_delay} seconds... (Attempt {retry_count + 1}/{MAX_RETRIES})")
                 time.sleep(retry_delay)
@@ -594,6 +2028,7 @@ def send_email_flask_mail(to_email, subject, body, attachment_path=None):
 
 
 def send_whatsapp_template(to_phone, template_name, lang_code, parameters):
+    import requests
 
     phone_number_id = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
     access_token = os.environ.get('META_ACCESS_TOKEN')
@@ -637,9 +2072,18 @@ def send_whatsapp_template(to_phone, template_name, lang_code, parameters):
     if components:
         payload["template"]["components"] = components
     
+    breaker = circuit_breakers['whatsapp']
+    if not breaker.allow():
+        print(f"⛔ WhatsApp circuit open – not sending {template_name}")
+        return False
     try:
         resp = requests.post(url, headers=headers, json=payload, timeout=10)
         print(f"WhatsApp API response: {resp.status_code} {resp.text}")
+        # 4xx is a bad request or recipient, not an outage (429 is throttling)
+        if resp.status_code >= 500 or resp.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
         if resp.status_code == 200:
             response_data = resp.json()
             message_id = response_data.get('messages', [{}])[0].get('id', 'N/A')
@@ -649,60 +2093,385 @@ def send_whatsapp_template(to_phone, template_name, lang_code, parameters):
             print(f"❌ Failed to send {template_name}")
             return False
     except Exception as e:
+        breaker.record_failure()
         print(f"WhatsApp API error: {e}")
         return False
 
-def load_grievance_responses(grievance_id, cur):
+RESPONSE_FEEDBACK_URL = 'http://172.19.66.141:8112/login'
+
+def response_notifications(employee_name, employee_email, employee_phone, tickets, new_status,
+                           additional_info_required, response_date, attachment_path=None, attachment_name=None):
     """
-    Returns list of response dicts with role inference (hr/admin vs employee)
+    Email and WhatsApp messages telling an employee their queries were updated,
+    as (channel, payload) pairs for deliver_notification. tickets is a list of
+    (grievance_id, subject); several tickets go out as one message.
     """
-    cur.execute("""SELECT responder_name, response_text, response_date, attachment_path, responder_email
-        FROM responses
-        WHERE grievance_id=%s
-        ORDER BY response_date ASC
-    """, (grievance_id,))
-    rows = cur.fetchall()
-    out = []
-    for r in rows:
-        responder_name, text, rdate, attach, remail = r
-        role = 'employee'
-        if remail:
-            cur.execute("SELECT role, emp_code FROM users WHERE employee_email=%s LIMIT 1", (remail,))
-            role_row = cur.fetchone()
-            if role_row:
-                role = role_row[0]
-                hr_emp_code = role_row[1]
-            else:
-                hr_emp_code = ''
-        else:
-            hr_emp_code = ''
-        out.append({
-            'responder_name': responder_name,
-            'response_text': text,
-            'response_date': rdate,
-            'created_at': rdate,
-            'attachment_path': attach,
-            'role': role,
-            'hr_emp_code': hr_emp_code
-        })
-    return out
-
-@app.route('/run-check')
-def run_check():
-    with app.app_context():
-        check_pending_grievances()
-    return "Check completed! See console for details."
-
-@app.route('/')
-def index():
-    user = session.get('user')
+    additional_info_message = ""
+    if additional_info_required:
+        additional_info_message = """
+                    <div style="background: #fff3cd; padding: 15px; border-radius: 8px; margin: 15px 0; border-left: 4px solid #ffc107;">
+                        <p style="margin: 0; color: #856404; font-weight: bold;">⚠️ Additional Information Required</p>
+                        <p style="margin: 5px 0 0 0; color: #856404;">The HR team requires additional information from you to process your query. Please review the response and provide the requested details.</p>
+                    </div>
+                    """
 
-    if user and user.get('authenticated'):
-        if user.get('role') == 'admin':
-            return redirect(url_for('master_dashboard'))
-        elif user.get('role') == 'hr':
-            return redirect(url_for('hr_dashboard'))
-        else:
+    if len(tickets) == 1:
+        grievance_id, subject = tickets[0]
+        intro = "Your query has been successfully updated with the following details:"
+        details = f"""<p><strong>Reference ID:</strong> {grievance_id}</p>
+            <p><strong>Subject:</strong> {subject}</p>"""
+        email_subject = f"Query Response (ID: {grievance_id})"
+        whatsapp_ids, whatsapp_subject = grievance_id, subject
+    else:
+        intro = f"{len(tickets)} of your queries have been successfully updated with the following details:"
+        details = ''.join(f"<p><strong>Reference ID:</strong> {Markup.escape(gid)} – {Markup.escape(subject or '')}</p>"
+                          for gid, subject in tickets)
+        email_subject = f"Query Response ({len(tickets)} queries)"
+        whatsapp_ids = ', '.join(gid for gid, _ in tickets[:5]) + (f' +{len(tickets) - 5} more' if len(tickets) > 5 else '')
+        whatsapp_subject = f"{len(tickets)} queries updated"
+
+    body = f"""
+<html>
+<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #2c3e50;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 20px; background: #f7fafc; border-radius: 8px;">
+        <p>Dear {employee_name},</p>
+        <p>{intro}</p>
+        <div style="background: white; padding: 20px; border-radius: 8px;">
+            {details}
+            <p><strong>Status:</strong> {new_status}</p>
+            <p><strong>Resolution Date:</strong> {response_date.strftime('%d-%m-%Y, %H:%M:%S')}</p>
+        </div>
+        {additional_info_message}
+        <p>Please click on the below link to submit the feedback.</p>
+        <p>
+            <a href="{RESPONSE_FEEDBACK_URL}"            
+            style="display:inline-block; background:#1e3a8a; color:#fff; padding:10px 18px; border-radius:5px; text-decoration:none; font-weight:bold;">
+               Submit Feedback
+            </a>
+        </p>
+        <p><strong>Human Resources</strong></p>
+    </div>
+</body>
+</html>
+"""
+    notifications = [('email', {'to_email': employee_email, 'subject': email_subject, 'body': body,
+                                'attachment_path': attachment_path, 'attachment_name': attachment_name})]
+    if employee_phone:
+        if new_status == 'Resolved':
+            template_name = "grievance_resolution_confirmation"
+        elif additional_info_required:
+            template_name = "grievance_additional_info_required"
+        else:
+            template_name = "grievance_in_progress"
+        notifications.append(('whatsapp', {
+            'to_phone': employee_phone,
+            'template_name': template_name,
+            'lang_code': 'en',
+            'parameters': [employee_name, whatsapp_ids, whatsapp_subject, new_status,
+                           response_date.strftime('%d-%m-%Y, %H:%M:%S')],
+        }))
+    return notifications
+
+def deliver_notification(channel, payload):
+    if channel == 'email':
+        return send_email_flask_mail(**payload)
+    if channel == 'whatsapp':
+        return send_whatsapp_template(**payload)
+    raise ValueError(f'Unknown notification channel: {channel}')
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE_SECONDS = 60
+# A 'sending' row older than this belongs to a worker that died mid-send
+OUTBOX_STALE_SENDING_SECONDS = 10 * 60
+OUTBOX_DELIVERY_INTERVAL_MINUTES = 1
+
+def queue_notifications(c, notifications):
+    """Add (channel, payload) pairs to notification_outbox in the caller's transaction."""
+    if not notifications:
+        return
+    psycopg2.extras.execute_values(
+        c,
+        'INSERT INTO notification_outbox (channel, payload) VALUES %s',
+        [(channel, json.dumps(payload)) for channel, payload in notifications],
+        template='(%s, %s::jsonb)',
+    )
+
+def deliver_queued_notifications(limit=OUTBOX_BATCH_SIZE):
+    """
+    Send one batch from notification_outbox. Rows are claimed with SKIP LOCKED
+    and committed as 'sending' before any network call, so concurrent workers
+    never send the same row and no transaction stays open during SMTP retries.
+    Failures go back to 'pending' with exponential backoff until
+    OUTBOX_MAX_ATTEMPTS, and so do rows whose sender died mid-send. Returns
+    the number of rows claimed.
+    """
+    conn = db_pool.getconn(budget='background', readonly=False)
+    try:
+        with conn.cursor() as c:
+            # A row whose sender keeps dying must not be reclaimed forever
+            c.execute('''
+                UPDATE notification_outbox
+                SET status = 'failed', last_error = COALESCE(last_error, 'sender stopped while sending')
+                WHERE status = 'sending' AND attempts >= %s
+                  AND claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ''', (OUTBOX_MAX_ATTEMPTS, OUTBOX_STALE_SENDING_SECONDS))
+            c.execute('''
+                UPDATE notification_outbox o
+                SET status = 'sending', attempts = o.attempts + 1, claimed_at = CURRENT_TIMESTAMP
+                WHERE o.id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+                       OR (status = 'sending' AND claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING o.id, o.channel, o.payload, o.attempts
+            ''', (OUTBOX_STALE_SENDING_SECONDS, limit))
+            claimed = c.fetchall()
+            conn.commit()
+    finally:
+        db_pool.putconn(conn)
+    if not claimed:
+        return 0
+
+    sent, failed = [], []
+    for outbox_id, channel, payload, attempts in claimed:
+        try:
+            ok, error = deliver_notification(channel, payload), None
+        except Exception as e:
+            ok, error = False, str(e)
+        if ok:
+            sent.append(outbox_id)
+        else:
+            failed.append((outbox_id, attempts, error or f'{channel} delivery failed'))
+
+    conn = db_pool.getconn(budget='background', readonly=False)
+    try:
+        with conn.cursor() as c:
+            if sent:
+                c.execute('''UPDATE notification_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                             WHERE id = ANY(%s)''', (sent,))
+            for outbox_id, attempts, error in failed:
+                c.execute('''
+                    UPDATE notification_outbox
+                    SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                        last_error = %s
+                    WHERE id = %s
+                ''', (OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), error[:1000], outbox_id))
+            conn.commit()
+    finally:
+        db_pool.putconn(conn)
+
+    metric_inc('notifications.sent', len(sent))
+    if failed:
+        metric_inc('notifications.failed', len(failed))
+        print(f"⚠️ {len(failed)} queued notification(s) failed; will retry")
+    return len(claimed)
+
+_outbox_drain_lock = threading.Lock()
+
+def _drain_notification_outbox():
+    try:
+        while deliver_queued_notifications() == OUTBOX_BATCH_SIZE:
+            pass
+    except Exception as e:
+        print(f"⚠️ Notification outbox drain failed: {str(e)}")
+    finally:
+        _outbox_drain_lock.release()
+
+def kick_notification_delivery():
+    """
+    Start draining the outbox in the background right after a commit. Only
+    one drain thread per process; anything it misses is picked up by the
+    deliver_queued_notifications job.
+    """
+    if not _outbox_drain_lock.acquire(blocking=False):
+        return
+    threading.Thread(target=_drain_notification_outbox, name='notification-outbox', daemon=True).start()
+
+def load_grievance_responses(grievance_id, cur):
+    """
+    Returns list of response dicts with role inference (hr/admin vs employee)
+    """
+    cur.execute("""SELECT responder_name, response_text, response_date, attachment_path, responder_email
+        FROM responses
+        WHERE grievance_id=%s
+        ORDER BY response_date ASC
+    """, (grievance_id,))
+    rows = cur.fetchall()
+    out = []
+    for r in rows:
+        responder_name, text, rdate, attach, remail = r
+        role = 'employee'
+        if remail:
+            cur.execute("SELECT role, emp_code FROM users WHERE employee_email=%s LIMIT 1", (remail,))
+            role_row = cur.fetchone()
+            if role_row:
+                role = role_row[0]
+                hr_emp_code = role_row[1]
+            else:
+                hr_emp_code = ''
+        else:
+            hr_emp_code = ''
+        out.append({
+            'responder_name': responder_name,
+            'response_text': text,
+            'response_date': rdate,
+            'created_at': rdate,
+            'attachment_path': attach,
+            'role': role,
+            'hr_emp_code': hr_emp_code
+        })
+    return out
+
+DB_UNAVAILABLE_PAGE = """
+<html><body style="font-family: Arial, sans-serif; text-align: center; padding: 60px; color: #2c3e50;">
+    <h2>{{ title }}</h2>
+    <p>{{ message }}</p>
+    <p><a href="{{ back_url }}">Go back</a></p>
+</body></html>
+"""
+
+def _wants_json():
+    return (request.path.startswith('/api/') or request.is_json or
+            request.accept_mimetypes.best == 'application/json')
+
+def _db_unavailable_response(title, message):
+    if _wants_json():
+        response = jsonify({'success': False, 'error': message})
+    else:
+        response = make_response(render_template_string(
+            DB_UNAVAILABLE_PAGE, title=title, message=message,
+            back_url=request.referrer or url_for('index')))
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+@app.errorhandler(pg_errors.QueryCanceled)
+@app.errorhandler(pg_errors.LockNotAvailable)
+@app.errorhandler(PoolTimeout)
+def handle_db_timeout(e):
+    """Statement/lock timeouts and pool waits from the per-route budgets become a clean 503."""
+    if isinstance(e, PoolTimeout):
+        kind = 'pool_timeout'
+    elif isinstance(e, pg_errors.LockNotAvailable):
+        kind = 'lock_timeout'
+    else:
+        kind = 'statement_timeout'
+    metric_inc(f'db.{kind}.{request.endpoint}')
+    print(f"⏱️ {kind} on {request.endpoint} ({request.path}): {str(e).strip()}")
+    return _db_unavailable_response(
+        'Service temporarily busy',
+        'The request took too long to complete. Please narrow your filters or try again shortly.')
+
+UPLOAD_ENDPOINTS = {'submit_grievance', 'respond_grievance', 'reply_grievance', 'edit_grievance'}
+
+@app.before_request
+def parse_uploads_early():
+    """Parse multipart bodies before the view runs so size limits surface as a 413, not a generic view error."""
+    if request.method == 'POST' and request.endpoint in UPLOAD_ENDPOINTS:
+        request.files
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_upload_too_large(e):
+    print(f"📦 Upload rejected on {request.endpoint}: {e.description}")
+    limits = ', '.join(f"{ext.upper()} {_human_size(limit)}" for ext, limit in UPLOAD_SIZE_LIMITS.items())
+    message = f"The attachment is too large. Limits: {limits}."
+    if _wants_json():
+        return jsonify({'success': False, 'error': message}), 413
+    response = make_response(render_template_string(
+        DB_UNAVAILABLE_PAGE, title='Attachment too large', message=message,
+        back_url=request.referrer or url_for('index')))
+    response.status_code = 413
+    return response
+
+@app.errorhandler(QueryCostExceeded)
+def handle_query_cost_exceeded(e):
+    print(f"🧮 Rejected expensive query on {request.endpoint}: {e}")
+    return _db_unavailable_response(
+        'Search too broad',
+        'This filter combination is too broad. Please add a date range or a more specific search.')
+
+@app.after_request
+def surface_db_budget_errors(response):
+    """
+    Views catch Exception for their own error flashes; a budget error they
+    swallowed still turns into the 503 its error handler would have sent.
+    """
+    e = g.pop('db_budget_error', None)
+    if e is None or response.status_code == 503:
+        return response
+    flashes = session.get('_flashes')
+    if flashes:
+        # Drop the catch-all's "Error: canceling statement..." flash
+        del flashes[g.pop('db_budget_flash_count', 0):]
+        session.modified = True
+    if isinstance(e, QueryCostExceeded):
+        return handle_query_cost_exceeded(e)
+    return handle_db_timeout(e)
+
+@app.route('/metrics')
+def metrics():
+    user = session.get('user')
+    token = os.environ.get('METRICS_TOKEN')
+    is_admin = user and user.get('authenticated') and user.get('role') == 'admin'
+    if not is_admin and not (token and request.headers.get('X-Metrics-Token') == token):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    return jsonify(metrics_snapshot())
+
+@app.route('/health')
+def health():
+    """Liveness plus integration circuit states for this worker process."""
+    breakers = {name: breaker.snapshot() for name, breaker in circuit_breakers.items()}
+    degraded = any(b['state'] != CircuitBreaker.CLOSED for b in breakers.values())
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'pid': os.getpid(),
+        'integrations': breakers,
+    })
+
+@app.route('/scheduler-status')
+def scheduler_status():
+    user = session.get('user')
+    if not user or not user.get('authenticated') or user.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute('''
+                SELECT job_id, node, status, started_at, finished_at, duration_seconds, error,
+                       status = 'running' AND lease_until > CURRENT_TIMESTAMP AS running
+                FROM scheduler_jobs
+                ORDER BY job_id
+            ''')
+            jobs = fetchall_as_dicts(c)
+    finally:
+        db_pool.putconn(conn)
+    for job in jobs:
+        for field in ('started_at', 'finished_at'):
+            if job[field]:
+                job[field] = job[field].isoformat()
+    return jsonify({'success': True, 'node': SCHEDULER_NODE_ID, 'jobs': jobs})
+
+@app.route('/run-check')
+def run_check():
+    with app.app_context():
+        check_pending_grievances()
+    return "Check completed! See console for details."
+
+@app.route('/')
+def index():
+    user = session.get('user')
+
+    if user and user.get('authenticated'):
+        if user.get('role') == 'admin':
+            return redirect(url_for('master_dashboard'))
+        elif user.get('role') == 'hr':
+            return redirect(url_for('hr_dashboard'))
+        else:
             return redirect(url_for('my_queries'))
 
     return render_template('index.html', grievance_types=GRIEVANCE_TYPES)
@@ -795,15 +2564,13 @@ def submit_grievance():
             print(f"   Filename: {file.filename if file else 'None'}")
 
             if file and file.filename != '' and allowed_file(file.filename):
-                upload_dir = get_upload_path('employee', emp_code)
                 original_filename = secure_filename(file.filename)
                 file_extension = original_filename.rsplit('.', 1)[1].lower()
                 filename = f"{grievance_id}.{file_extension}"        
-                attachment_full_path = os.path.join(upload_dir, filename)
-                file.save(attachment_full_path)
+                attachment_full_path, attachment_sha256, attachment_size = save_upload(file)
                 attachment_path = filename  
                 print(f"   ✅ File saved: {attachment_path}")
-                print(f"   File size: {os.path.getsize(attachment_full_path)} bytes")
+                print(f"   File size: {attachment_size} bytes | sha256: {attachment_sha256[:12]}")
             elif file and file.filename != '':
                 print(f"   ❌ File type not allowed: {file.filename}")
 
@@ -811,6 +2578,8 @@ def submit_grievance():
         conn = db_pool.getconn()
         try:
             with conn.cursor() as c:
+                if attachment_path:
+                    attachment_path = unique_attachment_name(c, 'employee', emp_code, attachment_path, attachment_sha256)
                 c.execute('''INSERT INTO grievances
                             (id, emp_code, employee_name, employee_email, employee_phone,date_of_birth,
                             business_unit, department, grievance_type, subject, description,
@@ -819,7 +2588,11 @@ def submit_grievance():
                          (grievance_id, emp_code, employee_name, employee_email, employee_phone,
                           date_of_birth, business_unit, department, grievance_type, subject, description,
                           attachment_path, datetime.now()))
+                if attachment_path:
+                    add_attachment_ref(c, 'employee', emp_code, attachment_path, attachment_sha256,
+                                       attachment_size, grievance_id, file.filename)
                 conn.commit()
+                invalidate_dashboard_cache()
             print(f"✅ Data saved to database")
         finally:
             db_pool.putconn(conn)
@@ -831,24 +2604,16 @@ def submit_grievance():
         hr_phone = None
         hr_name = DEFAULT_HR_NAME
         try:
-            with conn.cursor() as c:
-                c.execute('''
-                    SELECT u.employee_email, u.employee_name , u.employee_phone
-                    FROM hr_grievance_mapping m
-                    JOIN users u ON m.hr_emp_code = u.emp_code
-                    WHERE m.grievance_type = %s
-                ''', (grievance_type,))
-
-                hr_info = c.fetchone()
-                if hr_info and hr_info[0]:
-                    hr_email = hr_info[0]
-                    hr_name = hr_info[1]
-                    hr_phone = hr_info[2]
-                    print(f"✅ Found HR email: {hr_email} and HR phone: {hr_phone} for grievance type: {grievance_type}")
-                else:
-                    hr_email = DEFAULT_HR_EMAIL
-                    hr_name = DEFAULT_HR_NAME
-                    print(f"⚠️ No HR mapping found for type: {grievance_type}, using default")
+            hr_info = hr_directory.contact_for_type(grievance_type)
+            if hr_info and hr_info[0]:
+                hr_email = hr_info[0]
+                hr_name = hr_info[1]
+                hr_phone = hr_info[2]
+                print(f"✅ Found HR email: {hr_email} and HR phone: {hr_phone} for grievance type: {grievance_type}")
+            else:
+                hr_email = DEFAULT_HR_EMAIL
+                hr_name = DEFAULT_HR_NAME
+                print(f"⚠️ No HR mapping found for type: {grievance_type}, using default")
         except Exception as e:
             hr_email = DEFAULT_HR_EMAIL
             hr_name = DEFAULT_HR_NAME
@@ -877,7 +2642,7 @@ def submit_grievance():
 """
 
         print(f"✅ Email content prepared")
-        email_success = send_email_flask_mail(hr_email, email_subject, email_body, attachment_full_path)
+        email_success = send_email_flask_mail(hr_email, email_subject, email_body, attachment_full_path, attachment_path)
         if hr_phone:
             print(f"📱 Sending WhatsApp notification to HR...")
             whatsapp_success = send_whatsapp_template(
@@ -995,10 +2760,9 @@ def respond_grievance(grievance_id):
     conn = db_pool.getconn()
     try:
         with conn.cursor() as c:
-            c.execute('SELECT employee_name, employee_email FROM users WHERE emp_code = %s', (user['emp_code'],))
-            hr_row = c.fetchone()
-            responder_name = hr_row[0] if hr_row else user.get('employee_name', '')
-            responder_email = hr_row[1] if hr_row else user.get('employee_email', '')
+            hr_row = hr_directory.person(user['emp_code'])
+            responder_name = hr_row['employee_name'] if hr_row else user.get('employee_name', '')
+            responder_email = hr_row['employee_email'] if hr_row else user.get('employee_email', '')
 
             c.execute('SELECT * FROM grievances WHERE id = %s', (grievance_id,))
             grievance = c.fetchone()
@@ -1022,11 +2786,9 @@ def respond_grievance(grievance_id):
                 file = request.files.get('attachment')
                 response_attachment_path = None
                 if file and file.filename and allowed_file(file.filename):
-                    upload_dir = get_upload_path('hr', user['emp_code'])
                     filename = secure_filename(f"response_{grievance_id}_{file.filename}")
-                    full_path = os.path.join(upload_dir, filename)
-                    file.save(full_path)
-                    response_attachment_path = filename
+                    full_path, attachment_sha256, attachment_size = save_upload(file)
+                    response_attachment_path = unique_attachment_name(c, 'hr', user['emp_code'], filename, attachment_sha256)
                 else:
                     full_path = None
 
@@ -1035,99 +2797,22 @@ def respond_grievance(grievance_id):
                 # MODIFIED: Insert with additional_info_required column
                 c.execute('''INSERT INTO responses
                             (grievance_id, responder_email, responder_name, response_text, response_date, attachment_path, additional_info_required)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+                            VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id''',
                          (grievance_id, responder_email, responder_name, response_text, response_date, response_attachment_path, additional_info_required))
+                response_id = c.fetchone()[0]
+                if response_attachment_path:
+                    add_attachment_ref(c, 'hr', user['emp_code'], response_attachment_path, attachment_sha256,
+                                       attachment_size, grievance_id, file.filename, response_id)
 
                 c.execute('UPDATE grievances SET status = %s, updated_at = %s WHERE id = %s',
                          (new_status, datetime.now(), grievance_id))
                 conn.commit()
+                invalidate_dashboard_cache()
 
-                employee_email = grievance[3]
-                employee_name = grievance[2]
-                feedback_url = 'http://172.19.66.141:8112/login'
-                print("Final feedback URL:", feedback_url)
-                
-                # MODIFIED: Add additional information message to email
-                additional_info_message = ""
-                if additional_info_required:
-                    additional_info_message = """
-                    <div style="background: #fff3cd; padding: 15px; border-radius: 8px; margin: 15px 0; border-left: 4px solid #ffc107;">
-                        <p style="margin: 0; color: #856404; font-weight: bold;">⚠️ Additional Information Required</p>
-                        <p style="margin: 5px 0 0 0; color: #856404;">The HR team requires additional information from you to process your query. Please review the response and provide the requested details.</p>
-                    </div>
-                    """
-                
-                response_email_body = f"""
-<html>
-<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #2c3e50;">
-    <div style="max-width: 600px; margin: 0 auto; padding: 20px; background: #f7fafc; border-radius: 8px;">
-        <p>Dear {employee_name},</p>
-        <p>Your query has been successfully updated with the following details:</p>
-        <div style="background: white; padding: 20px; border-radius: 8px;">
-            <p><strong>Reference ID:</strong> {grievance_id}</p>
-            <p><strong>Subject:</strong> {grievance[8]}</p>
-            <p><strong>Status:</strong> {new_status}</p>
-            <p><strong>Resolution Date:</strong> {response_date.strftime('%d-%m-%Y, %H:%M:%S')}</p>
-        </div>
-        {additional_info_message}
-        <p>Please click on the below link to submit the feedback.</p>
-        <p>
-            <a href="{feedback_url}"            
-            style="display:inline-block; background:#1e3a8a; color:#fff; padding:10px 18px; border-radius:5px; text-decoration:none; font-weight:bold;">
-               Submit Feedback
-            </a>
-        </p>
-        <p><strong>Human Resources</strong></p>
-    </div>
-</body>
-</html>
-"""
-                send_email_flask_mail(employee_email, f"Query Response (ID: {grievance_id})", response_email_body, full_path if file and file.filename != '' and allowed_file(file.filename) else None)
-                
-                employee_phone = grievance[4]
-                if employee_phone:
-                    if new_status == 'Resolved':
-                        send_whatsapp_template(
-                            to_phone=employee_phone,
-                            template_name="grievance_resolution_confirmation",
-                            lang_code="en",
-                            parameters=[
-                                employee_name,         
-                                grievance_id,      
-                                grievance[8],
-                                new_status,      
-                                datetime.now().strftime('%d-%m-%Y, %H:%M:%S')  
-                            ]
-                        )
-                    else:
-                        # MODIFIED: Check if additional info is required for In Progress status
-                        if additional_info_required:
-                            # Use a different WhatsApp template that includes additional info message
-                            send_whatsapp_template(
-                                to_phone=employee_phone,
-                                template_name="grievance_additional_info_required",
-                                lang_code="en",
-                                parameters=[
-                                    employee_name,         
-                                    grievance_id,      
-                                    grievance[8],
-                                    new_status,      
-                                    datetime.now().strftime('%d-%m-%Y, %H:%M:%S')  
-                                ]
-                            )
-                        else:
-                            send_whatsapp_template(
-                                to_phone=employee_phone,
-                                template_name="grievance_in_progress",
-                                lang_code="en",
-                                parameters=[
-                                    employee_name,         
-                                    grievance_id,      
-                                    grievance[8],
-                                    new_status,      
-                                    datetime.now().strftime('%d-%m-%Y, %H:%M:%S')  
-                                ]
-                            )
+                for channel, payload in response_notifications(
+                        grievance[2], grievance[3], grievance[4], [(grievance_id, grievance[8])], new_status,
+                        additional_info_required, response_date, full_path, response_attachment_path):
+                    deliver_notification(channel, payload)
                 
                 flash('Response submitted successfully.', 'success')
                 return redirect(url_for('hr_dashboard'))
@@ -1205,6 +2890,7 @@ def submit_feedback(grievance_id):
                 print(f"   ✅ Grievance status updated to: Resolved")
 
             conn.commit()
+            invalidate_dashboard_cache()
 
             if satisfaction == 'not_resolved' and reopen_ticket == 'yes':
                 c.execute('SELECT emp_code, employee_name, employee_email, employee_phone, grievance_type, subject FROM grievances WHERE id = %s', (grievance_id,))
@@ -1356,11 +3042,8 @@ def check_pending_grievances(debug=True):
             for (gid, emp_name, emp_email, subject, sub_dt,
                  hr_emp_code, hr_email, hr_phone, last_rem) in rows:
                 age_h = int((now - sub_dt).total_seconds() / 3600)
-                hr_name = None
-                if hr_emp_code:
-                    c.execute("SELECT employee_name FROM users WHERE emp_code=%s", (hr_emp_code,))
-                    rnm = c.fetchone()
-                    hr_name = rnm[0] if rnm else None
+                hr_person = hr_directory.person(hr_emp_code) if hr_emp_code else None
+                hr_name = hr_person['employee_name'] if hr_person else None
 
                 target_email = hr_email or admin_email
                 target_phone = hr_phone or admin_phone
@@ -1604,6 +3287,95 @@ def generate_otp():
     """Generate a 6-digit OTP"""
     return ''.join(random.choices(string.digits, k=6))
 
+CONVERSATION_CACHE_MAX_ENTRIES = 500
+_conversation_cache = OrderedDict()
+_conversation_cache_lock = threading.Lock()
+
+def _conversation_cache_get(grievance_id, version):
+    with _conversation_cache_lock:
+        entry = _conversation_cache.get(grievance_id)
+        if not entry or entry[0] != version:
+            return None
+        _conversation_cache.move_to_end(grievance_id)
+        return entry[1]
+
+def _conversation_cache_put(grievance_id, version, snapshot):
+    with _conversation_cache_lock:
+        _conversation_cache[grievance_id] = (version, snapshot)
+        _conversation_cache.move_to_end(grievance_id)
+        while len(_conversation_cache) > CONVERSATION_CACHE_MAX_ENTRIES:
+            _conversation_cache.popitem(last=False)
+
+def build_conversation_snapshot(cur, grievance_id):
+    """
+    Assemble grievance, responses (with responder roles) and feedback in a single
+    query. Returns the dict served by get_grievance_details, or None if missing.
+    """
+    cur.execute("""
+        SELECT g.*,
+               f.rating, f.feedback_comments, f.feedback_date::text AS feedback_date,
+               COALESCE(t.responses, '[]'::json) AS responses
+        FROM grievances g
+        LEFT JOIN feedback f ON f.grievance_id = g.id
+        LEFT JOIN LATERAL (
+            SELECT json_agg(json_build_object(
+                       'id', r.id,
+                       'grievance_id', r.grievance_id,
+                       'responder_email', r.responder_email,
+                       'responder_name', r.responder_name,
+                       'response_text', r.response_text,
+                       'response_date', r.response_date::text,
+                       'attachment_path', r.attachment_path,
+                       'created_at', r.created_at::text,
+                       'additional_info_required', r.additional_info_required,
+                       'user_emp_code', u.emp_code,
+                       'user_role', u.role,
+                       'user_name', u.employee_name
+                   ) ORDER BY r.response_date ASC, r.id ASC) AS responses
+            FROM responses r
+            LEFT JOIN LATERAL (
+                SELECT emp_code, role, employee_name
+                FROM users
+                WHERE employee_email = r.responder_email
+                LIMIT 1
+            ) u ON TRUE
+            WHERE r.grievance_id = g.id
+        ) t ON TRUE
+        WHERE g.id = %s
+    """, (grievance_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    grievance_dict = dict(row)
+    grievance_dict['grievance_type_name'] = GRIEVANCE_TYPES.get(grievance_dict['grievance_type'], 'Unknown')
+    if grievance_dict['submission_date']:
+        grievance_dict['submission_date'] = grievance_dict['submission_date'].strftime('%Y-%m-%d %H:%M')
+    if grievance_dict['updated_at']:
+        grievance_dict['updated_at'] = grievance_dict['updated_at'].strftime('%Y-%m-%d %H:%M')
+
+    responses = []
+    for resp_dict in grievance_dict['responses']:
+        user_emp_code = resp_dict.pop('user_emp_code')
+        user_role = resp_dict.pop('user_role')
+        user_name = resp_dict.pop('user_name')
+
+        # Employee replies are identified by the grievance's own email address
+        resp_dict['is_employee_reply'] = resp_dict['responder_email'] == grievance_dict.get('employee_email')
+        if resp_dict['is_employee_reply']:
+            resp_dict['responder_type'] = 'Employee'
+        elif user_role:
+            resp_dict['responder_type'] = 'System Admin' if user_role == 'admin' else 'HR'
+            resp_dict['hr_emp_code'] = user_emp_code
+            if user_name:
+                resp_dict['responder_name'] = user_name
+        else:
+            resp_dict['responder_type'] = 'HR'  # Default if user not found
+        responses.append(resp_dict)
+
+    grievance_dict['responses'] = responses
+    return grievance_dict
+
 @app.route('/get_grievance_details/<grievance_id>')
 def get_grievance_details(grievance_id):
     if 'user' not in session:
@@ -1611,108 +3383,47 @@ def get_grievance_details(grievance_id):
     
     conn = db_pool.getconn()
     try:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Fetch the grievance details
+        cur = conn.cursor(cursor_factory=BudgetTrackingDictCursor)
+
+        # Cheap version probe: primary-key lookup plus the latest response id
         cur.execute("""
-            SELECT g.*, 
-                g.employee_name, 
-                g.employee_email
+            SELECT g.updated_at, g.grievance_type,
+                   (SELECT MAX(r.id) FROM responses r WHERE r.grievance_id = g.id) AS latest_response_id
             FROM grievances g
             WHERE g.id = %s
         """, (grievance_id,))
-        
-        grievance = cur.fetchone()
-        if not grievance:
+        probe = cur.fetchone()
+        if not probe:
             return jsonify({'success': False, 'error': 'Grievance not found'})
-        
+
         # Check if the user has access to this grievance
         is_admin = session['user']['role'] == 'admin'
-        
-        # Get the HR assigned to this grievance type
-        cur.execute("""
-            SELECT hr_emp_code FROM hr_grievance_mapping 
-            WHERE grievance_type = %s
-        """, (grievance['grievance_type'],))
-        
-        hr_mapping = cur.fetchone()
-        hr_emp_code = hr_mapping[0] if hr_mapping else None
-        
-        is_hr_for_grievance = (session['user']['role'] == 'hr' and 
-                            session['user']['emp_code'] == hr_emp_code)
-        
+        is_hr_for_grievance = (session['user']['role'] == 'hr' and
+                            session['user']['emp_code'] == hr_directory.hr_for_type(probe['grievance_type']))
         if not (is_admin or is_hr_for_grievance):
             return jsonify({'success': False, 'error': 'Access denied'})
-        
-        # Convert to dict for JSON serialization
-        grievance_dict = dict(grievance)
-        
-        # Add grievance type name
-        grievance_dict['grievance_type_name'] = GRIEVANCE_TYPES.get(grievance_dict['grievance_type'], 'Unknown')
-        
-        # Format dates
-        if grievance_dict['submission_date']:
-            grievance_dict['submission_date'] = grievance_dict['submission_date'].strftime('%Y-%m-%d %H:%M')
-        if grievance_dict['updated_at']:
-            grievance_dict['updated_at'] = grievance_dict['updated_at'].strftime('%Y-%m-%d %H:%M')
-        
-        # MODIFIED: Get responses with additional_info_required
-        cur.execute("""
-            SELECT r.id, r.grievance_id, r.responder_email, r.responder_name, 
-                   r.response_text, r.response_date::text, r.attachment_path,
-                   r.created_at, r.additional_info_required
-            FROM responses r
-            WHERE r.grievance_id = %s
-            ORDER BY r.response_date ASC
-        """, (grievance_id,))
-        
-        responses = []
-        for row in cur.fetchall():
-            resp_dict = dict(row)
-            
-            # Determine if this is an employee reply by comparing with grievance's employee email
-            resp_dict['is_employee_reply'] = resp_dict['responder_email'] == grievance_dict.get('employee_email')
-            
-            # Only for non-employee replies (HR/Admin), determine the proper role 
-            if not resp_dict['is_employee_reply']:
-                # Check if this user exists and what role they have
-                cur.execute("""
-                    SELECT emp_code, role, employee_name 
-                    FROM users 
-                    WHERE employee_email = %s 
-                    LIMIT 1
-                """, (resp_dict['responder_email'],))
-                user_info = cur.fetchone()
-                
-                if user_info:
-                    # Add responder type based on role in users table
-                    resp_dict['responder_type'] = 'System Admin' if user_info['role'] == 'admin' else 'HR'
-                    
-                    # Make sure we use the proper name from users table if available
-                    if user_info['employee_name']:
-                        resp_dict['responder_name'] = user_info['employee_name']
-                else:
-                    resp_dict['responder_type'] = 'HR' # Default if user not found
-            else:
-                resp_dict['responder_type'] = 'Employee'
-            
-            responses.append(resp_dict)
-        
-        grievance_dict['responses'] = responses
-        
-        # Get feedback information if available
-        cur.execute("""
-            SELECT rating, feedback_comments, feedback_date::text
-            FROM feedback
-            WHERE grievance_id = %s
-        """, (grievance_id,))
-        feedback = cur.fetchone()
-        if feedback:
-            grievance_dict['rating'] = feedback['rating']
-            grievance_dict['feedback_comments'] = feedback['feedback_comments']
-            grievance_dict['feedback_date'] = feedback['feedback_date']
-        
-        return jsonify({'success': True, 'grievance': grievance_dict})
+
+        updated_at = probe['updated_at'].isoformat() if probe['updated_at'] else ''
+        version = f"{updated_at}:{probe['latest_response_id'] or 0}"
+        etag = hashlib.sha1(f"{grievance_id}:{version}".encode('utf-8')).hexdigest()
+
+        if request.if_none_match.contains(etag):
+            not_modified = make_response('', 304)
+            not_modified.set_etag(etag)
+            not_modified.headers['Cache-Control'] = 'private, no-cache'
+            return not_modified
+
+        grievance_dict = _conversation_cache_get(grievance_id, version)
+        if grievance_dict is None:
+            grievance_dict = build_conversation_snapshot(cur, grievance_id)
+            if grievance_dict is None:
+                return jsonify({'success': False, 'error': 'Grievance not found'})
+            _conversation_cache_put(grievance_id, version, grievance_dict)
+
+        response = jsonify({'success': True, 'grievance': grievance_dict})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         import traceback
@@ -1782,6 +3493,7 @@ def verify_login():
                         flash('Invalid credentials or date of birth. Please check your details.', 'error')
                         return redirect(url_for('login'))
 
+                    session.regenerate()
                     session['user'] = {
                         'emp_code': emp_code,
                         'employee_name': employee_name,
@@ -1954,6 +3666,7 @@ def verify_otp():
     session.pop('login_otp', None)
     user_role = login_data['role']
 
+    session.regenerate()
     session['user'] = {
         'emp_code': emp_code,
         'employee_name': employee_name,
@@ -2023,8 +3736,7 @@ def hr_dashboard():
                 ''', (emp_code, emp_code, emp_code))
                 assigned_types = [row[0] for row in c.fetchall()]
             
-            c.execute("SELECT emp_code, employee_name FROM users WHERE role = 'hr' ORDER BY employee_name")
-            hr_staff = c.fetchall()
+            hr_staff = hr_directory.hr_staff()
             
             stats_query = '''
                 SELECT
@@ -2102,6 +3814,8 @@ def hr_dashboard():
                 query_params.extend([search_param, search_param, search_param, search_param])
 
             query += " AND ".join(query_conditions)
+            if filter_args:
+                check_query_cost(c, query, query_params)
             query += " ORDER BY submission_date DESC LIMIT %s OFFSET %s"
             query_params.extend([per_page, offset])
 
@@ -2167,54 +3881,27 @@ def my_queries():
     conn = db_pool.getconn()
     try:
         with conn.cursor() as c:
+            # One round trip: grievance summaries plus a per-ticket response count.
+            # Full threads are fetched on demand by my_query_responses().
             c.execute('''
-                SELECT g.*, f.rating, f.satisfaction
+                SELECT g.*, f.rating, f.satisfaction, rc.response_count
                 FROM grievances g
                 LEFT JOIN feedback f ON g.id = f.grievance_id
+                LEFT JOIN LATERAL (
+                    SELECT COUNT(*) AS response_count
+                    FROM responses r
+                    WHERE r.grievance_id = g.id
+                ) rc ON TRUE
                 WHERE g.emp_code = %s
                 ORDER BY g.submission_date DESC
             ''', (emp_code,))
-            grievances_raw = c.fetchall()
-            columns = [desc[0] for desc in c.description]
-            grievances = []
-            for gr in grievances_raw:
-                grievance_dict = dict(zip(columns, gr))
-                c.execute('''
-                    SELECT responder_name, response_text, response_date, attachment_path, responder_email
-                    FROM responses
-                    WHERE grievance_id = %s
-                    ORDER BY response_date ASC
-                    ''', (grievance_dict['id'],))
-                responses = []
-                for resp in c.fetchall():
-                    hr_emp_code = None
-                    if resp[4]:  
-                        c.execute('SELECT emp_code FROM users WHERE employee_email = %s', (resp[4],))
-                        hr_row = c.fetchone()
-                        hr_emp_code = hr_row[0] if hr_row else ''
-                    responses.append({
-                        'responder_name': resp[0],
-                        'response_text': resp[1],
-                        'response_date': resp[2],
-                        'attachment_path': resp[3],  
-                        'hr_emp_code': hr_emp_code
-                        })
-                grievance_dict['responses'] = responses
-                grievances.append(grievance_dict)
-
-            print(f"Found {len(grievances)} grievances for emp_code {emp_code}")
-            for g in grievances:
-                print(f"Grievance {g['id']}: status={g['status']}, rating={g['rating'] if 'rating' in g else 'N/A'}")
-
-            c.execute('''
-                SELECT status, COUNT(*)
-                FROM grievances
-                WHERE emp_code = %s
-                GROUP BY status''', (emp_code,))
+            grievances = fetchall_as_dicts(c)
 
-            status_counts = {status: count for status, count in c.fetchall()}
+            status_counts = {}
+            for g in grievances:
+                status_counts[g['status']] = status_counts.get(g['status'], 0) + 1
 
-            total_grievances = sum(status_counts.values()) if status_counts else 0
+            total_grievances = len(grievances)
 
             masked_phone = mask_phone(user['employee_phone'])
 
@@ -2230,6 +3917,68 @@ def my_queries():
     finally:
         db_pool.putconn(conn)
 
+@app.route('/my-queries/<grievance_id>/responses')
+def my_query_responses(grievance_id):
+    """Paginated conversation thread for one of the logged-in employee's queries."""
+    user = session.get('user')
+    if not user or not user.get('authenticated'):
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', MY_QUERY_RESPONSES_PER_PAGE, type=int)
+    per_page = min(max(per_page, 1), MY_QUERY_RESPONSES_MAX_PER_PAGE)
+    offset = (page - 1) * per_page
+
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute('SELECT 1 FROM grievances WHERE id = %s AND emp_code = %s',
+                      (grievance_id, user['emp_code']))
+            if not c.fetchone():
+                return jsonify({'success': False, 'error': 'Query not found'}), 404
+
+            # Fetch one extra row to know whether another page exists.
+            c.execute('''
+                SELECT r.responder_name, r.response_text, r.response_date, r.attachment_path,
+                       CASE WHEN r.responder_email IS NULL THEN NULL
+                            ELSE COALESCE(u.emp_code, '') END AS hr_emp_code
+                FROM responses r
+                LEFT JOIN LATERAL (
+                    SELECT emp_code FROM users
+                    WHERE employee_email = r.responder_email
+                    LIMIT 1
+                ) u ON TRUE
+                WHERE r.grievance_id = %s
+                ORDER BY r.response_date ASC, r.id ASC
+                LIMIT %s OFFSET %s
+            ''', (grievance_id, per_page + 1, offset))
+            rows = c.fetchall()
+
+        has_more = len(rows) > per_page
+        responses = []
+        for responder_name, response_text, response_date, attachment_path, hr_emp_code in rows[:per_page]:
+            attachment_url = None
+            if attachment_path and hr_emp_code:
+                attachment_url = url_for('download_file', user_type='hr',
+                                         emp_code=hr_emp_code, filename=attachment_path)
+            responses.append({
+                'responder_name': responder_name,
+                'response_text': response_text,
+                'response_date': response_date.strftime('%Y-%m-%d %H:%M') if response_date else '',
+                'attachment_path': attachment_path,
+                'attachment_url': attachment_url,
+            })
+
+        return jsonify({
+            'success': True,
+            'responses': responses,
+            'page': page,
+            'per_page': per_page,
+            'has_more': has_more,
+        })
+    finally:
+        db_pool.putconn(conn)
+
 @app.route('/master-dashboard')
 def master_dashboard():
     user = session.get('user')
@@ -2269,214 +4018,228 @@ def master_dashboard():
     conn = db_pool.getconn()
     try:
         with conn.cursor() as c:
-            # ✅ BUILD DYNAMIC STATS QUERY WITH FILTERS
-            stats_query = '''
-                SELECT
-                    SUM(CASE WHEN g.status = 'Submitted' THEN 1 ELSE 0 END) as submitted,
-                    SUM(CASE WHEN g.status = 'In Progress' THEN 1 ELSE 0 END) as in_progress,
-                    SUM(CASE WHEN g.status = 'Resolved' THEN 1 ELSE 0 END) as resolved,
-                    SUM(CASE WHEN g.status = 'Reopened' THEN 1 ELSE 0 END) as reopened,
-                    COUNT(*) as total
-                FROM grievances g
-                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
-                WHERE 1=1
-            '''
-            stats_params = []
-
-            # Apply same filters as main query
-            if status:
-                stats_query += " AND g.status = %s"
-                stats_params.append(status)
+            # Aggregates are shared across admins and workers; cached per filter set
+            def load_aggregates():
+                # ✅ BUILD DYNAMIC STATS QUERY WITH FILTERS
+                stats_query = '''
+                    SELECT
+                        SUM(CASE WHEN g.status = 'Submitted' THEN 1 ELSE 0 END) as submitted,
+                        SUM(CASE WHEN g.status = 'In Progress' THEN 1 ELSE 0 END) as in_progress,
+                        SUM(CASE WHEN g.status = 'Resolved' THEN 1 ELSE 0 END) as resolved,
+                        SUM(CASE WHEN g.status = 'Reopened' THEN 1 ELSE 0 END) as reopened,
+                        COUNT(*) as total
+                    FROM grievances g
+                    LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
+                    WHERE 1=1
+                '''
+                stats_params = []
 
-            if grievance_type:
-                stats_query += " AND g.grievance_type = %s"
-                stats_params.append(grievance_type)
+                # Apply same filters as main query
+                if status:
+                    stats_query += " AND g.status = %s"
+                    stats_params.append(status)
 
-            if date_from:
-                stats_query += " AND g.submission_date::date >= %s"
-                stats_params.append(date_from)
+                if grievance_type:
+                    stats_query += " AND g.grievance_type = %s"
+                    stats_params.append(grievance_type)
 
-            if date_to:
-                stats_query += " AND g.submission_date::date <= %s"
-                stats_params.append(date_to)
+                if date_from:
+                    stats_query += " AND g.submission_date::date >= %s"
+                    stats_params.append(date_from)
 
-            if hr_emp_code:
-                stats_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
-                stats_params.append(hr_emp_code)
+                if date_to:
+                    stats_query += " AND g.submission_date::date <= %s"
+                    stats_params.append(date_to)
 
-            if search:
-                stats_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
-                search_term = f"%{search}%"
-                stats_params.extend([search_term, search_term, search_term, search_term])
-
-            # Execute dynamic stats query
-            print(f"📊 Executing stats query with filters...")
-            c.execute(stats_query, stats_params)
-            stats_row = c.fetchone()
+                if hr_emp_code:
+                    stats_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
+                    stats_params.append(hr_emp_code)
+
+                if search:
+                    stats_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
+                    search_term = f"%{search}%"
+                    stats_params.extend([search_term, search_term, search_term, search_term])
+
+                # Execute dynamic stats query
+                if filter_args:
+                    check_query_cost(c, stats_query, stats_params)
+                print(f"📊 Executing stats query with filters...")
+                c.execute(stats_query, stats_params)
+                stats_row = c.fetchone()
             
-            stats = {
-                'submitted': stats_row[0] or 0,
-                'in_progress': stats_row[1] or 0,
-                'resolved': stats_row[2] or 0,
-                'reopened': stats_row[3] or 0,
-                'total': stats_row[4] or 0
-            }
-            print(f"   📊 Filtered Stats: {stats}")
-
-            # ✅ BUILD DYNAMIC FEEDBACK STATS WITH FILTERS
-            feedback_query = '''
-                SELECT 
-                    COUNT(CASE WHEN f.rating IS NOT NULL THEN 1 END) as withfeedback,
-                    COUNT(CASE WHEN f.rating IS NULL AND g.status = 'Resolved' THEN 1 END) as withoutfeedback,
-                    COUNT(CASE WHEN f.rating = 1 THEN 1 END) as rating1,
-                    COUNT(CASE WHEN f.rating = 2 THEN 1 END) as rating2,
-                    COUNT(CASE WHEN f.rating = 3 THEN 1 END) as rating3,
-                    COUNT(CASE WHEN f.rating = 4 THEN 1 END) as rating4,
-                    COUNT(CASE WHEN f.rating = 5 THEN 1 END) as rating5
-                FROM grievances g
-                LEFT JOIN feedback f ON g.id = f.grievance_id
-                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
-                WHERE g.status = 'Resolved'
-            '''
-            feedback_params = []
+                stats = {
+                    'submitted': stats_row[0] or 0,
+                    'in_progress': stats_row[1] or 0,
+                    'resolved': stats_row[2] or 0,
+                    'reopened': stats_row[3] or 0,
+                    'total': stats_row[4] or 0
+                }
+                print(f"   📊 Filtered Stats: {stats}")
+
+                # ✅ BUILD DYNAMIC FEEDBACK STATS WITH FILTERS
+                feedback_query = '''
+                    SELECT 
+                        COUNT(CASE WHEN f.rating IS NOT NULL THEN 1 END) as withfeedback,
+                        COUNT(CASE WHEN f.rating IS NULL AND g.status = 'Resolved' THEN 1 END) as withoutfeedback,
+                        COUNT(CASE WHEN f.rating = 1 THEN 1 END) as rating1,
+                        COUNT(CASE WHEN f.rating = 2 THEN 1 END) as rating2,
+                        COUNT(CASE WHEN f.rating = 3 THEN 1 END) as rating3,
+                        COUNT(CASE WHEN f.rating = 4 THEN 1 END) as rating4,
+                        COUNT(CASE WHEN f.rating = 5 THEN 1 END) as rating5
+                    FROM grievances g
+                    LEFT JOIN feedback f ON g.id = f.grievance_id
+                    LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
+                    WHERE g.status = 'Resolved'
+                '''
+                feedback_params = []
 
-            # Apply same filters (excluding status since we already filter for 'Resolved')
-            if grievance_type:
-                feedback_query += " AND g.grievance_type = %s"
-                feedback_params.append(grievance_type)
+                # Apply same filters (excluding status since we already filter for 'Resolved')
+                if grievance_type:
+                    feedback_query += " AND g.grievance_type = %s"
+                    feedback_params.append(grievance_type)
 
-            if date_from:
-                feedback_query += " AND g.submission_date::date >= %s"
-                feedback_params.append(date_from)
+                if date_from:
+                    feedback_query += " AND g.submission_date::date >= %s"
+                    feedback_params.append(date_from)
 
-            if date_to:
-                feedback_query += " AND g.submission_date::date <= %s"
-                feedback_params.append(date_to)
+                if date_to:
+                    feedback_query += " AND g.submission_date::date <= %s"
+                    feedback_params.append(date_to)
 
-            if hr_emp_code:
-                feedback_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
-                feedback_params.append(hr_emp_code)
+                if hr_emp_code:
+                    feedback_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
+                    feedback_params.append(hr_emp_code)
 
-            if search:
-                feedback_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
-                search_term = f"%{search}%"
-                feedback_params.extend([search_term, search_term, search_term, search_term])
+                if search:
+                    feedback_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
+                    search_term = f"%{search}%"
+                    feedback_params.extend([search_term, search_term, search_term, search_term])
 
-            c.execute(feedback_query, feedback_params)
-            row = c.fetchone() or (0, 0, 0, 0, 0, 0, 0)
+                c.execute(feedback_query, feedback_params)
+                row = c.fetchone() or (0, 0, 0, 0, 0, 0, 0)
 
-            with_fb = row[0] or 0
-            without_fb = row[1] if row[1] is not None else max(0, (stats.get('resolved', 0) - with_fb))
+                with_fb = row[0] or 0
+                without_fb = row[1] if row[1] is not None else max(0, (stats.get('resolved', 0) - with_fb))
             
-            stats.update({
-                "withfeedback": with_fb,
-                "withoutfeedback": without_fb,
-                "rating1": row[2] or 0,
-                "rating2": row[3] or 0,
-                "rating3": row[4] or 0,
-                "rating4": row[5] or 0,
-                "rating5": row[6] or 0,
-            })
+                stats.update({
+                    "withfeedback": with_fb,
+                    "withoutfeedback": without_fb,
+                    "rating1": row[2] or 0,
+                    "rating2": row[3] or 0,
+                    "rating3": row[4] or 0,
+                    "rating4": row[5] or 0,
+                    "rating5": row[6] or 0,
+                })
 
-            # ✅ BUILD DYNAMIC TYPE-STATUS COUNTS WITH FILTERS
-            type_status_query = '''
-                SELECT 
-                    g.grievance_type as type, 
-                    g.status,
-                    COUNT(g.id) as count
-                FROM grievances g
-                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
-                WHERE 1=1
-            '''
-            type_status_params = []
+                # ✅ BUILD DYNAMIC TYPE-STATUS COUNTS WITH FILTERS
+                type_status_query = '''
+                    SELECT 
+                        g.grievance_type as type, 
+                        g.status,
+                        COUNT(g.id) as count
+                    FROM grievances g
+                    LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
+                    WHERE 1=1
+                '''
+                type_status_params = []
 
-            if status:
-                type_status_query += " AND g.status = %s"
-                type_status_params.append(status)
+                if status:
+                    type_status_query += " AND g.status = %s"
+                    type_status_params.append(status)
 
-            if grievance_type:
-                type_status_query += " AND g.grievance_type = %s"
-                type_status_params.append(grievance_type)
+                if grievance_type:
+                    type_status_query += " AND g.grievance_type = %s"
+                    type_status_params.append(grievance_type)
 
-            if date_from:
-                type_status_query += " AND g.submission_date::date >= %s"
-                type_status_params.append(date_from)
+                if date_from:
+                    type_status_query += " AND g.submission_date::date >= %s"
+                    type_status_params.append(date_from)
 
-            if date_to:
-                type_status_query += " AND g.submission_date::date <= %s"
-                type_status_params.append(date_to)
+                if date_to:
+                    type_status_query += " AND g.submission_date::date <= %s"
+                    type_status_params.append(date_to)
 
-            if hr_emp_code:
-                type_status_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
-                type_status_params.append(hr_emp_code)
+                if hr_emp_code:
+                    type_status_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
+                    type_status_params.append(hr_emp_code)
+
+                if search:
+                    type_status_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
+                    search_term = f"%{search}%"
+                    type_status_params.extend([search_term, search_term, search_term, search_term])
+
+                type_status_query += " GROUP BY g.grievance_type, g.status"
+
+                c.execute(type_status_query, type_status_params)
+                type_status_counts = {}
+                for row in c.fetchall():
+                    type_name = GRIEVANCE_TYPES.get(row[0], row[0])
+                    status_val = row[1]
+                    count = row[2]
+                    type_status_counts[(type_name, status_val)] = count
+
+                # ✅ BUILD DYNAMIC TYPE COUNTS WITH FILTERS
+                type_counts_query = '''
+                    SELECT g.grievance_type, COUNT(*) as count
+                    FROM grievances g
+                    LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
+                    WHERE 1=1
+                '''
+                type_counts_params = []
 
-            if search:
-                type_status_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
-                search_term = f"%{search}%"
-                type_status_params.extend([search_term, search_term, search_term, search_term])
+                if status:
+                    type_counts_query += " AND g.status = %s"
+                    type_counts_params.append(status)
 
-            type_status_query += " GROUP BY g.grievance_type, g.status"
+                if grievance_type:
+                    type_counts_query += " AND g.grievance_type = %s"
+                    type_counts_params.append(grievance_type)
 
-            c.execute(type_status_query, type_status_params)
-            type_status_counts = {}
-            for row in c.fetchall():
-                type_name = GRIEVANCE_TYPES.get(row[0], row[0])
-                status_val = row[1]
-                count = row[2]
-                type_status_counts[(type_name, status_val)] = count
+                if date_from:
+                    type_counts_query += " AND g.submission_date::date >= %s"
+                    type_counts_params.append(date_from)
 
-            # Get HR staff
-            c.execute('''
-                SELECT emp_code, employee_name FROM users
-                WHERE role = 'hr'
-                ORDER BY employee_name
-            ''')
-            hr_staff = c.fetchall()
-
-            # ✅ BUILD DYNAMIC TYPE COUNTS WITH FILTERS
-            type_counts_query = '''
-                SELECT g.grievance_type, COUNT(*) as count
-                FROM grievances g
-                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
-                WHERE 1=1
-            '''
-            type_counts_params = []
+                if date_to:
+                    type_counts_query += " AND g.submission_date::date <= %s"
+                    type_counts_params.append(date_to)
 
-            if status:
-                type_counts_query += " AND g.status = %s"
-                type_counts_params.append(status)
-
-            if grievance_type:
-                type_counts_query += " AND g.grievance_type = %s"
-                type_counts_params.append(grievance_type)
-
-            if date_from:
-                type_counts_query += " AND g.submission_date::date >= %s"
-                type_counts_params.append(date_from)
+                if hr_emp_code:
+                    type_counts_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
+                    type_counts_params.append(hr_emp_code)
 
-            if date_to:
-                type_counts_query += " AND g.submission_date::date <= %s"
-                type_counts_params.append(date_to)
+                if search:
+                    type_counts_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
+                    search_term = f"%{search}%"
+                    type_counts_params.extend([search_term, search_term, search_term, search_term])
 
-            if hr_emp_code:
-                type_counts_query += " AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %s"
-                type_counts_params.append(hr_emp_code)
+                type_counts_query += " GROUP BY g.grievance_type ORDER BY count DESC"
 
-            if search:
-                type_counts_query += " AND (g.id ILIKE %s OR g.employee_name ILIKE %s OR g.subject ILIKE %s OR g.emp_code ILIKE %s)"
-                search_term = f"%{search}%"
-                type_counts_params.extend([search_term, search_term, search_term, search_term])
+                c.execute(type_counts_query, type_counts_params)
+                grievance_type_counts = c.fetchall()
+            
+                # Convert to a dictionary with human-readable names
+                type_counts = {}
+                for g_type, count in grievance_type_counts:
+                    type_name = GRIEVANCE_TYPES.get(g_type, g_type)
+                    type_counts[type_name] = count
+
+                return {
+                    'stats': stats,
+                    'type_status_counts': [[t, s, n] for (t, s), n in type_status_counts.items()],
+                    'type_counts': type_counts,
+                }
 
-            type_counts_query += " GROUP BY g.grievance_type ORDER BY count DESC"
+            aggregates_key = hashlib.sha1(json.dumps(filter_args, sort_keys=True).encode('utf-8')).hexdigest()
+            aggregates, _ = shared_cache.get_or_load(
+                DASHBOARD_CACHE_NAMESPACE, f'master:{aggregates_key}', load_aggregates,
+                ttl=DASHBOARD_AGGREGATE_CACHE_TTL_SECONDS
+            )
+            stats = aggregates['stats']
+            type_status_counts = {(t, s): n for t, s, n in aggregates['type_status_counts']}
+            type_counts = aggregates['type_counts']
 
-            c.execute(type_counts_query, type_counts_params)
-            grievance_type_counts = c.fetchall()
-            
-            # Convert to a dictionary with human-readable names
-            type_counts = {}
-            for g_type, count in grievance_type_counts:
-                type_name = GRIEVANCE_TYPES.get(g_type, g_type)
-                type_counts[type_name] = count
+            # Get HR staff
+            hr_staff = hr_directory.hr_staff()
 
             # Build the main query for grievances list
             query = '''
@@ -2647,22 +4410,21 @@ def reply_grievance(grievance_id):
                 attachment_path = None
                 up_file = request.files.get('attachment')
                 if up_file and up_file.filename and allowed_file(up_file.filename):
-                    upload_dir = get_upload_path('employee', user['emp_code'])
                     fname = secure_filename(f"reply_{grievance_id}_{reply_count+1}_{up_file.filename}")
-                    up_file.save(os.path.join(upload_dir, fname))
-                    attachment_path = fname
+                    _, attachment_sha256, attachment_size = save_upload(up_file)
+                    attachment_path = unique_attachment_name(c, 'employee', user['emp_code'], fname, attachment_sha256)
                 c.execute("""INSERT INTO responses
                              (grievance_id, responder_email, responder_name, response_text, response_date, attachment_path)
-                             VALUES (%s,%s,%s,%s,%s,%s)""",
+                             VALUES (%s,%s,%s,%s,%s,%s) RETURNING id""",
                           (grievance_id, gr[3], gr[2], reply_text, datetime.now(), attachment_path))
+                response_id = c.fetchone()[0]
+                if attachment_path:
+                    add_attachment_ref(c, 'employee', user['emp_code'], attachment_path, attachment_sha256,
+                                       attachment_size, grievance_id, up_file.filename, response_id)
                 c.execute("UPDATE grievances SET reply_count=reply_count+1, updated_at=%s WHERE id=%s",
                           (datetime.now(), grievance_id))
                 # Notify HR
-                c.execute("""SELECT u.employee_email, u.employee_name, u.employee_phone
-                             FROM hr_grievance_mapping m
-                             JOIN users u ON m.hr_emp_code=u.emp_code
-                             WHERE m.grievance_type=%s""", (gr[5],))
-                hr_info = c.fetchone()
+                hr_info = hr_directory.contact_for_type(gr[5])
                 if hr_info:
                     hr_email, hr_name, hr_phone = hr_info
                     subj = f"Employee Reply #{reply_count+1} - Query {grievance_id}"
@@ -2683,6 +4445,7 @@ def reply_grievance(grievance_id):
                             parameters=[hr_name, grievance_id, gr[2], gr[6], reply_text]
                         )
                 conn.commit()
+                invalidate_dashboard_cache()
                 flash('Reply submitted.', 'success')
                 return redirect(url_for('my_queries'))
             # GET view
@@ -2728,14 +4491,14 @@ def edit_grievance(grievance_id):
                 subject = request.form.get('subject')
                 description = request.form.get('description')
                 attachment_path = grievance[11]
+                attachment_sha256 = None
                 emp_code = grievance[1]
                 if 'attachment' in request.files:
                     file = request.files['attachment']
                     if file and file.filename != '' and allowed_file(file.filename):
-                        upload_dir = get_upload_path('employee', emp_code)
                         filename = secure_filename(f"{grievance_id}_{file.filename}")
-                        file.save(os.path.join(upload_dir, filename))
-                        attachment_path = filename  
+                        _, attachment_sha256, attachment_size = save_upload(file)
+                        attachment_path = unique_attachment_name(c, 'employee', emp_code, filename, attachment_sha256)
 
                 if not subject or not description:
                     flash('Subject and description are required.', 'error')
@@ -2750,7 +4513,13 @@ def edit_grievance(grievance_id):
                     SET subject = %s, grievance_type = %s, attachment_path = %s, description = %s, edit_count = edit_count + 1, updated_at = %s
                     WHERE id = %s
                 ''', (subject, grievance_type, attachment_path, description, datetime.now(), grievance_id))
+                if attachment_sha256:
+                    add_attachment_ref(c, 'employee', emp_code, attachment_path, attachment_sha256,
+                                       attachment_size, grievance_id, file.filename)
+                    if grievance[11] and grievance[11] != attachment_path:
+                        release_attachment_ref(c, 'employee', emp_code, grievance[11])
                 conn.commit()
+                invalidate_dashboard_cache()
 
                 
                 employee_email = grievance[3]
@@ -2918,8 +4687,10 @@ def delete_grievance_employee():
             c.execute('DELETE FROM feedback WHERE grievance_id = %s', (grievance_id,))
             c.execute('DELETE FROM responses WHERE grievance_id = %s', (grievance_id,))
             c.execute('DELETE FROM reminder_sent WHERE grievance_id = %s', (grievance_id,))
+            release_grievance_attachments(c, grievance_id)
             c.execute('DELETE FROM grievances WHERE id = %s AND emp_code = %s', (grievance_id, user['emp_code']))
             conn.commit()
+            invalidate_dashboard_cache()
 
             
             employee_name = gr[2]
@@ -3041,8 +4812,10 @@ def delete_grievance():
             c.execute('DELETE FROM feedback WHERE grievance_id = %s', (grievance_id,))
             c.execute('DELETE FROM responses WHERE grievance_id = %s', (grievance_id,))
             c.execute('DELETE FROM reminder_sent WHERE grievance_id = %s', (grievance_id,))
+            release_grievance_attachments(c, grievance_id)
             c.execute('DELETE FROM grievances WHERE id = %s', (grievance_id,))
             conn.commit()
+            invalidate_dashboard_cache()
 
             
             email_subject = f"Your Query Request Deleted (ID: {grievance_id})"
@@ -3135,29 +4908,20 @@ def manage_hr_mappings():
                     SET hr_emp_code = EXCLUDED.hr_emp_code
                 ''', (grievance_type, hr_emp_code))
 
+                notify_hr_directory_changed(c)
                 conn.commit()
+                invalidate_dashboard_cache()
+                hr_directory.invalidate()
+                employee_index.upsert(hr_emp_code, hr_name)
                 flash(f'HR mapping updated successfully. {hr_name} is now assigned.', 'success')
                 return redirect(url_for('manage_hr_mappings'))
 
             # For the GET request, the logic remains mostly the same
-            c.execute('''
-                SELECT m.grievance_type, u.employee_name, u.emp_code
-                FROM hr_grievance_mapping m
-                LEFT JOIN users u ON m.hr_emp_code = u.emp_code
-            ''')
-            mapping_rows = c.fetchall()
-
-            mappings = {}
-            for row in mapping_rows:
-                mappings[row[0]] = {
-                    'name': row[1],
-                    'emp_code': row[2]
-                }
+            mappings = hr_directory.mappings()
             
             # The hr_staff variable is no longer needed for the form,
             # but we keep it for now if other parts of the system use it.
-            c.execute("SELECT emp_code, employee_name FROM users WHERE role = 'hr' ORDER BY employee_name")
-            hr_staff = c.fetchall()
+            hr_staff = hr_directory.hr_staff()
 
             return render_template('manage_mappings.html',
                                  mappings=mappings,
@@ -3175,16 +4939,11 @@ def get_current_hr(grievance_id):
     conn = db_pool.getconn()
     try:
         with conn.cursor() as c:
-            c.execute('''
-                SELECT COALESCE(g.assigned_hr_emp_code, m.hr_emp_code)
-                FROM grievances g
-                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
-                WHERE g.id = %s
-            ''', (grievance_id,))
+            c.execute('SELECT assigned_hr_emp_code, grievance_type FROM grievances WHERE id = %s', (grievance_id,))
             result = c.fetchone()
             
             if result:
-                return jsonify({'success': True, 'current_hr': result[0]})
+                return jsonify({'success': True, 'current_hr': result[0] or hr_directory.hr_for_type(result[1])})
             return jsonify({'success': False, 'error': 'No HR mapping found'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -3264,6 +5023,7 @@ def reassign_grievance():
                 f"Grievance forwarded to {new_hr[0]} by admin. Reason: {reason}", datetime.now()))
 
             conn.commit()
+            invalidate_dashboard_cache()
 
             
             notify_subject = f"Query forwarded to You - {grievance[3]} (ID: {grievance_id})"
@@ -3353,6 +5113,310 @@ def reassign_grievance():
     finally:
         db_pool.putconn(conn)
 
+BULK_REASSIGN_MAX_TICKETS = 500
+
+def _ticket_rows_html(tickets):
+    return ''.join(
+        f"<tr><td style='padding:4px 8px;'>{Markup.escape(t['id'])}</td>"
+        f"<td style='padding:4px 8px;'>{Markup.escape(GRIEVANCE_TYPES.get(t['grievance_type'], t['grievance_type']))}</td>"
+        f"<td style='padding:4px 8px;'>{Markup.escape(t['employee_name'] or '')}</td>"
+        f"<td style='padding:4px 8px;'>{Markup.escape(t['subject'] or '')}</td></tr>"
+        for t in tickets
+    )
+
+def bulk_reassign_notifications(c, moved, new_hr, actor_name, reason):
+    """
+    One summary email (and WhatsApp to the new HR) per HR instead of per
+    ticket, as (channel, payload) pairs for queue_notifications.
+    """
+    by_old_hr = defaultdict(list)
+    for t in moved:
+        by_old_hr[t['old_hr']].append(t)
+
+    c.execute('SELECT emp_code, employee_name, employee_email FROM users WHERE emp_code = ANY(%s)',
+              ([code for code in by_old_hr if code],))
+    old_hrs = {row[0]: row[1:] for row in c.fetchall()}
+
+    table_head = ("<table style='border-collapse:collapse; background:white; width:100%;'>"
+                  "<tr><th align='left' style='padding:4px 8px;'>Query ID</th><th align='left' style='padding:4px 8px;'>Type</th>"
+                  "<th align='left' style='padding:4px 8px;'>Employee</th><th align='left' style='padding:4px 8px;'>Subject</th></tr>")
+    new_hr_name, new_hr_email, new_hr_phone = new_hr
+    notifications = [('email', {'to_email': new_hr_email, 'subject': f"{len(moved)} queries forwarded to you", 'body': f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #2c3e50;">
+        <div style="max-width: 700px; margin: 0 auto; padding: 20px; background: #f7fafc; border-radius: 8px;">
+            <h2 style="color:#1e3a8a;">Queries forwarded: Ask HR</h2>
+            <p>Dear {Markup.escape(new_hr_name)},</p>
+            <p>{Markup.escape(actor_name)} has <b>forwarded {len(moved)} queries</b> to you.</p>
+            <p><strong>Reason for change:</strong> {Markup.escape(reason)}</p>
+            {table_head}{_ticket_rows_html(moved)}</table>
+            <p>Please review and respond as soon as possible.</p>
+            <p><a href="{url_for('hr_dashboard', _external=True)}"
+                style="display:inline-block; background:#1e3a8a; color:#fff; padding:10px 18px; border-radius:5px; text-decoration:none; font-weight:bold;">
+                Open HR Dashboard</a>
+            </p>
+            <p><em>Human Resources</em></p>
+        </div>
+    </body>
+    </html>
+    """})]
+    if new_hr_phone:
+        ids = ', '.join(t['id'] for t in moved[:5]) + (f' +{len(moved) - 5} more' if len(moved) > 5 else '')
+        notifications.append(('whatsapp', {
+            'to_phone': new_hr_phone,
+            'template_name': "grievance_reassigned_hr",
+            'lang_code': "en",
+            'parameters': [new_hr_name, ids, f"{len(moved)} queries forwarded", datetime.now().strftime('%d-%m-%Y, %H:%M:%S')],
+        }))
+
+    for old_hr_code, tickets in by_old_hr.items():
+        old_hr = old_hrs.get(old_hr_code)
+        if not old_hr or not old_hr[1]:
+            continue
+        notifications.append(('email', {'to_email': old_hr[1], 'subject': f"{len(tickets)} of your queries were forwarded", 'body': f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #2c3e50;">
+            <div style="max-width: 700px; margin: 0 auto; padding: 20px; background: #f7fafc; border-radius: 8px;">
+                <h2 style="color:#1e3a8a;">Queries forwarded: Ask HR</h2>
+                <p>Dear {Markup.escape(old_hr[0])},</p>
+                <p>{len(tickets)} queries previously assigned to you have been <b>forwarded</b> to {Markup.escape(new_hr_name)} by {Markup.escape(actor_name)}.</p>
+                <p><strong>Reason for change:</strong> {Markup.escape(reason)}</p>
+                {table_head}{_ticket_rows_html(tickets)}</table>
+                <p><em>Human Resources</em></p>
+            </div>
+        </body>
+        </html>
+        """}))
+    return notifications
+
+@app.route('/api/grievances/bulk-reassign', methods=['POST'])
+def bulk_reassign_grievances():
+    """
+    Move many open queries to one HR in a single transaction. Select them by
+    grievance_ids, from_hr (current assignee) and/or grievance_type; the
+    filters combine. dry_run returns the selection without changing anything.
+    """
+    user = session.get('user')
+    if not user or not user.get('authenticated') or user.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or request.form
+    grievance_ids = data.get('grievance_ids')
+    if isinstance(grievance_ids, str):
+        grievance_ids = [g for g in re.split(r'[\s,]+', grievance_ids) if g]
+    if not grievance_ids and hasattr(data, 'getlist'):
+        grievance_ids = data.getlist('grievance_ids[]') or None
+    from_hr = (data.get('from_hr') or '').strip() or None
+    grievance_type = (data.get('grievance_type') or '').strip() or None
+    new_hr_emp_code = (data.get('new_hr') or '').strip()
+    reason = (data.get('reason') or '').strip()
+    dry_run = str(data.get('dry_run', '')).lower() in ('1', 'true', 'on', 'yes')
+
+    if not new_hr_emp_code or not reason:
+        return jsonify({'success': False, 'error': 'new_hr and reason are required'}), 400
+    if not (grievance_ids or from_hr or grievance_type):
+        return jsonify({'success': False, 'error': 'Select queries by grievance_ids, from_hr or grievance_type'}), 400
+    if grievance_type and grievance_type not in GRIEVANCE_TYPES:
+        return jsonify({'success': False, 'error': f'Unknown grievance type: {grievance_type}'}), 400
+
+    now = datetime.now()
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute('SELECT employee_name, employee_email, employee_phone FROM users WHERE emp_code = %s', (new_hr_emp_code,))
+            new_hr = c.fetchone()
+            if not new_hr:
+                return jsonify({'success': False, 'error': 'Selected HR staff not found'}), 404
+
+            # Lock at most one query past the cap, so an oversized selection is
+            # refused before anything is locked in bulk or updated
+            c.execute('''
+                SELECT g.id, COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) AS old_hr,
+                       g.employee_name, g.grievance_type, g.subject
+                FROM grievances g
+                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
+                WHERE g.status <> 'Resolved'
+                  AND (%(ids)s::text[] IS NULL OR g.id = ANY(%(ids)s::text[]))
+                  AND (%(from_hr)s::text IS NULL OR COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) = %(from_hr)s)
+                  AND (%(grievance_type)s::text IS NULL OR g.grievance_type = %(grievance_type)s)
+                  AND COALESCE(g.assigned_hr_emp_code, m.hr_emp_code) IS DISTINCT FROM %(new_hr)s
+                ORDER BY old_hr, g.id
+                LIMIT %(limit)s
+                FOR UPDATE OF g
+            ''', {
+                'ids': list(grievance_ids) if grievance_ids else None,
+                'from_hr': from_hr,
+                'grievance_type': grievance_type,
+                'new_hr': new_hr_emp_code,
+                'limit': BULK_REASSIGN_MAX_TICKETS + 1,
+            })
+            moved = [dict(zip(('id', 'old_hr', 'employee_name', 'grievance_type', 'subject'), row)) for row in c.fetchall()]
+
+            if len(moved) > BULK_REASSIGN_MAX_TICKETS:
+                conn.rollback()
+                return jsonify({'success': False, 'error': f'More than {BULK_REASSIGN_MAX_TICKETS} queries selected; narrow the selection'}), 400
+            if dry_run or not moved:
+                conn.rollback()
+            else:
+                # Move and log the locked queries in one statement
+                c.execute('''
+                    WITH moved AS (
+                        UPDATE grievances
+                        SET assigned_hr_emp_code = %(new_hr)s, updated_at = %(now)s
+                        WHERE id = ANY(%(ids)s)
+                        RETURNING id
+                    )
+                    INSERT INTO responses (grievance_id, responder_email, responder_name, response_text, response_date)
+                    SELECT id, %(actor_email)s, %(actor_name)s, %(note)s, %(now)s FROM moved
+                ''', {
+                    'ids': [t['id'] for t in moved],
+                    'new_hr': new_hr_emp_code,
+                    'now': now,
+                    'actor_email': user.get('employee_email'),
+                    'actor_name': user.get('employee_name'),
+                    'note': f"Grievance forwarded to {new_hr[0]} by admin. Reason: {reason}",
+                })
+                queue_notifications(c, bulk_reassign_notifications(c, moved, new_hr, user.get('employee_name'), reason))
+                conn.commit()
+                invalidate_dashboard_cache()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error in bulk reassignment: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'success': False, 'error': f'Error reassigning queries: {str(e)}'}), 500
+    finally:
+        db_pool.putconn(conn)
+
+    by_previous_hr = defaultdict(int)
+    for t in moved:
+        by_previous_hr[t['old_hr'] or 'unassigned'] += 1
+    moved_ids = {t['id'] for t in moved}
+    result = {
+        'success': True,
+        'dry_run': dry_run,
+        'new_hr': new_hr_emp_code,
+        'moved': len(moved),
+        'grievance_ids': [t['id'] for t in moved],
+        'by_previous_hr': dict(by_previous_hr),
+    }
+    if grievance_ids:
+        # Resolved, already with new_hr, filtered out or unknown
+        result['skipped'] = [g for g in grievance_ids if g not in moved_ids]
+
+    if moved and not dry_run:
+        print(f"🔀 {user.get('employee_name')} moved {len(moved)} queries to {new_hr_emp_code}")
+        metric_inc('grievances.bulk_reassigned', len(moved))
+        kick_notification_delivery()
+    return jsonify(result)
+
+BULK_RESPOND_MAX_TICKETS = 200
+BULK_RESPOND_STATUSES = ('In Progress', 'Resolved')
+
+@app.route('/api/grievances/bulk-respond', methods=['POST'])
+def bulk_respond_grievances():
+    """
+    Apply one response and status to many queries in a single transaction.
+    HR may only update queries assigned to them; resolved queries are left
+    alone. Employee notifications go to notification_outbox, one email and
+    WhatsApp per employee, and are sent after the request returns. The
+    response reports the outcome for every requested id.
+    """
+    user = session.get('user')
+    if not user or not user.get('authenticated') or user.get('role') not in ['hr', 'admin']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or request.form
+    grievance_ids = data.get('grievance_ids')
+    if isinstance(grievance_ids, str):
+        grievance_ids = [g for g in re.split(r'[\s,]+', grievance_ids) if g]
+    if not grievance_ids and hasattr(data, 'getlist'):
+        grievance_ids = data.getlist('grievance_ids[]')
+    grievance_ids = list(dict.fromkeys(str(g).strip() for g in grievance_ids or [] if str(g).strip()))
+    response_text = (data.get('response_text') or '').strip()
+    new_status = (data.get('status') or '').strip()
+    additional_info_required = str(data.get('additional_info_required', '')).lower() in ('1', 'true', 'on', 'yes')
+
+    if not grievance_ids:
+        return jsonify({'success': False, 'error': 'Select at least one query'}), 400
+    if len(grievance_ids) > BULK_RESPOND_MAX_TICKETS:
+        return jsonify({'success': False, 'error': f'{len(grievance_ids)} queries selected; select at most {BULK_RESPOND_MAX_TICKETS}'}), 400
+    if not response_text:
+        return jsonify({'success': False, 'error': 'Response text is required'}), 400
+    if new_status not in BULK_RESPOND_STATUSES:
+        return jsonify({'success': False, 'error': f"Status must be one of: {', '.join(BULK_RESPOND_STATUSES)}"}), 400
+
+    hr_row = hr_directory.person(user['emp_code'])
+    responder_name = hr_row['employee_name'] if hr_row else user.get('employee_name', '')
+    responder_email = hr_row['employee_email'] if hr_row else user.get('employee_email', '')
+    is_admin = user.get('role') == 'admin'
+
+    results = dict.fromkeys(grievance_ids, 'not_found')
+    notifications = []
+    now = datetime.now()
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            # Lock in id order so overlapping bulk actions cannot deadlock
+            c.execute('''
+                SELECT g.id, g.status, COALESCE(g.assigned_hr_emp_code, m.hr_emp_code),
+                       g.emp_code, g.employee_name, g.employee_email, g.employee_phone, g.subject
+                FROM grievances g
+                LEFT JOIN hr_grievance_mapping m ON g.grievance_type = m.grievance_type
+                WHERE g.id = ANY(%s)
+                ORDER BY g.id
+                FOR UPDATE OF g
+            ''', (grievance_ids,))
+            by_employee = OrderedDict()
+            for gid, status, assigned_hr, emp_code, employee_name, employee_email, employee_phone, subject in c.fetchall():
+                if status == 'Resolved':
+                    results[gid] = 'already_resolved'
+                elif not is_admin and assigned_hr != user['emp_code']:
+                    results[gid] = 'not_assigned'
+                else:
+                    results[gid] = 'updated'
+                    employee = by_employee.setdefault(emp_code, {
+                        'contact': (employee_name, employee_email, employee_phone), 'tickets': []})
+                    employee['tickets'].append((gid, subject))
+
+            updated = [gid for gid, result in results.items() if result == 'updated']
+            if updated:
+                psycopg2.extras.execute_values(c, '''
+                    INSERT INTO responses
+                    (grievance_id, responder_email, responder_name, response_text, response_date, additional_info_required)
+                    VALUES %s
+                ''', [(gid, responder_email, responder_name, response_text, now, additional_info_required)
+                      for gid in updated])
+                c.execute('UPDATE grievances SET status = %s, updated_at = %s WHERE id = ANY(%s)',
+                          (new_status, now, updated))
+                for employee in by_employee.values():
+                    notifications.extend(response_notifications(
+                        *employee['contact'], employee['tickets'], new_status, additional_info_required, now))
+                queue_notifications(c, notifications)
+                conn.commit()
+                invalidate_dashboard_cache()
+            else:
+                conn.rollback()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error in bulk response: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'success': False, 'error': f'Error updating queries: {str(e)}'}), 500
+    finally:
+        db_pool.putconn(conn)
+
+    if updated:
+        print(f"📝 {responder_name} set {len(updated)} queries to {new_status}; {len(notifications)} notification(s) queued")
+        metric_inc('grievances.bulk_responded', len(updated))
+        kick_notification_delivery()
+    return jsonify({
+        'success': True,
+        'status': new_status,
+        'updated': len(updated),
+        'skipped': len(results) - len(updated),
+        'notifications_queued': len(notifications),
+        'results': [{'grievance_id': gid, 'result': result} for gid, result in results.items()],
+    })
+
 @app.route('/update-mapping', methods=['POST'])
 def update_mapping():
     return redirect(url_for('manage_hr_mappings'))
@@ -3403,7 +5467,7 @@ def resend_otp():
     return jsonify({'success': True, 'message': 'OTP resent successfully!'})
 
 def parse_sap_date(date_string):
-    """Parse SAP date format like /Date(1749168000000)/"""
+    """Parse SAP date format like /Date(1749168000000)/ or /Date(1749168000000+0000)/ (UTC)."""
     if not date_string or not isinstance(date_string, str):
         return None
 
@@ -3411,208 +5475,684 @@ def parse_sap_date(date_string):
     from datetime import datetime
 
     
-    match = re.search(r'/Date\((\d+)\)/', date_string)
+    match = re.search(r'/Date\((-?\d+)(?:[+-]\d+)?\)/', date_string)
     if not match:
         return None
 
     
     milliseconds = int(match.group(1))
-    seconds = milliseconds / 1000  
-    dt = datetime.fromtimestamp(seconds)
+    dt = datetime(1970, 1, 1) + timedelta(milliseconds=milliseconds)
 
     return dt
 
-@app.route('/api/get_employee_sap', methods=['GET'])
-def get_employee_sap():
+SAP_ODATA_BASE_URL = "https://api44.sapsf.com/odata/v2"
+SAP_REQUEST_TIMEOUT_SECONDS = 5
+SAP_POOL_SIZE = 10
+SAP_BATCH_SIZE = 100  # userIds per `userId in ...` filter, keeps the URL well under gateway limits
+
+SAP_SYNC_PAGE_SIZE = 500
+SAP_SYNC_TIMEOUT_SECONDS = 60
+SAP_SYNC_HOUR = 2  # nightly delta sync; full resync on Sundays
+
+# Every EmpJob field we read, as an OData path. `results/<n>` steps index into
+# expanded collections and `results/*` maps over them. $select/$expand are
+# derived from this, so nothing else is requested from SAP.
+SAP_EMPLOYEE_FIELDS = {
+    'user_id': 'userId',
+    'status': 'emplStatusNav/picklistLabels/results/0/label',
+    'first_name': 'employmentNav/personNav/personalInfoNav/results/0/firstName',
+    'middle_name': 'employmentNav/personNav/personalInfoNav/results/0/middleName',
+    'last_name': 'employmentNav/personNav/personalInfoNav/results/0/lastName',
+    'date_of_birth': 'employmentNav/personNav/dateOfBirth',
+    'division': 'division',
+    'division_name': 'divisionNav/name',
+    'department': 'department',
+    'department_name': 'departmentNav/name',
+    'phones': 'employmentNav/personNav/phoneNav/results/*/phoneNumber',
+    'emails': 'employmentNav/personNav/emailNav/results/*/emailAddress',
+    'last_modified': 'lastModifiedDateTime',
+}
+
+def compile_sap_path(path):
+    """'a/results/0/b' -> ('a', 'results', 0, 'b'), parsed once at import."""
+    return tuple(int(step) if step.isdigit() else step for step in path.split('/'))
+
+def _sap_projection(fields):
+    select, expand = [], []
+    for path in fields.values():
+        steps = [step for step in path.split('/') if step not in ('results', '*') and not step.isdigit()]
+        select.append('/'.join(steps))
+        if len(steps) > 1:
+            expand.append('/'.join(steps[:-1]))
+    return ','.join(dict.fromkeys(select)), ','.join(dict.fromkeys(expand))
+
+SAP_EMPLOYEE_PATHS = {name: compile_sap_path(path) for name, path in SAP_EMPLOYEE_FIELDS.items()}
+SAP_EMPJOB_SELECT, SAP_EMPJOB_EXPAND = _sap_projection(SAP_EMPLOYEE_FIELDS)
+
+def _sap_get(data, *keys):
+    for i, key in enumerate(keys):
+        if key == '*':
+            if not isinstance(data, list):
+                return None
+            return [_sap_get(item, *keys[i + 1:]) for item in data]
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and isinstance(key, int) and len(data) > key:
+            data = data[key]
+        else:
+            return None
+        if data is None:
+            return None
+    return data
+
+def extract_sap_fields(result):
+    return {name: _sap_get(result, *path) for name, path in SAP_EMPLOYEE_PATHS.items()}
+
+def _odata_quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def sap_query_params(**params):
+    """EmpJob query string: the caller's filter/paging plus our projection."""
+    params.update({'$select': SAP_EMPJOB_SELECT, '$expand': SAP_EMPJOB_EXPAND, '$format': 'json'})
+    return params
+
+def sap_employee_filter(emp_code):
+    return f"userId eq {_odata_quote(emp_code)}"
+
+class SAPAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'API returned status code {status_code}')
+        self.status_code = status_code
+
+class SAPClient:
+    """
+    SAP SuccessFactors EmpJob client. One keep-alive session (and TLS
+    connection pool) is shared by every lookup; each call records its latency
+    under sap.call_seconds.<operation>.
+    """
+
+    def __init__(self, base_url, username, password, pool_size=SAP_POOL_SIZE, timeout=SAP_REQUEST_TIMEOUT_SECONDS):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username, password)  # HTTP basic
+        self.session.headers.update({'Accept': 'application/json', 'Cache-Control': 'no-cache'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _query(self, operation, timeout=None, **params):
+        params = sap_query_params(**params)
+        breaker = circuit_breakers['sap']
+        if not breaker.allow():
+            raise CircuitOpenError('sap')
+        start_time = time.time()
+        try:
+            response = self.session.get(f"{self.base_url}/EmpJob", params=params, timeout=timeout or self.timeout)
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            metric_observe(f'sap.call_seconds.{operation}', time.time() - start_time)
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if response.status_code != 200:
+            metric_inc(f'sap.call_errors.{operation}')
+            print(f"❌ SAP {operation} returned {response.status_code}: {response.text[:200]}...")
+            raise SAPAPIError(response.status_code)
+        return response.json().get('d', {}).get('results', [])
+
+    def get_employee(self, emp_code):
+        """Raw EmpJob result for one userId, or None."""
+        results = self._query('get_employee', **{'$filter': sap_employee_filter(emp_code)})
+        return results[0] if results else None
+
+    def get_employees(self, emp_codes):
+        """Raw EmpJob results for many userIds, batched. Returns {userId: result}."""
+        emp_codes = list(dict.fromkeys(code for code in emp_codes if code))
+        found = {}
+        for i in range(0, len(emp_codes), SAP_BATCH_SIZE):
+            chunk = emp_codes[i:i + SAP_BATCH_SIZE]
+            results = self._query(
+                'get_employees',
+                **{'$filter': 'userId in ' + ','.join(_odata_quote(code) for code in chunk), '$top': len(chunk)}
+            )
+            for result in results:
+                found.setdefault(result.get('userId'), result)
+        return found
+
+    def iter_pages(self, filter_expr=None, page_size=SAP_SYNC_PAGE_SIZE, timeout=SAP_SYNC_TIMEOUT_SECONDS):
+        """Yield EmpJob result pages ordered by userId, using $top/$skip."""
+        skip = 0
+        while True:
+            params = {'$orderby': 'userId', '$top': page_size, '$skip': skip}
+            if filter_expr:
+                params['$filter'] = filter_expr
+            results = self._query('page', timeout=timeout, **params)
+            yield results
+            if len(results) < page_size:
+                return
+            skip += page_size
+
+_sap_client = None
+_sap_client_lock = threading.Lock()
+
+def get_sap_client():
+    """Shared SAPClient, created on first use."""
+    global _sap_client
+    if _sap_client is None:
+        with _sap_client_lock:
+            if _sap_client is None:
+                _sap_client = SAPClient(SAP_ODATA_BASE_URL, os.environ.get('SAP_API_USERNAME'), os.environ.get('SAP_API_PASSWORD'))
+    return _sap_client
+
+def parse_sap_employee(result):
+    """Flatten one EmpJob result into an employee_directory record."""
+    fields = extract_sap_fields(result)
+    employee_status = fields['status']
+
+    full_name = f"{fields['first_name'] or ''} {fields['middle_name'] or ''} {fields['last_name'] or ''}".replace('  ', ' ').strip()
+
+    dob_date = parse_sap_date(fields['date_of_birth'])
+    date_of_birth = dob_date.strftime('%Y-%m-%d') if dob_date else None
+
+    # Strict rule: only the phone entry at index 1 is the employee's mobile
+    phones = fields['phones'] or []
+    phone_number = ''.join(filter(str.isdigit, phones[1] or '')) if len(phones) > 1 else ''
+    phone_number = '+91' + phone_number if len(phone_number) >= 10 else ''
+
+    work_email = ''
+    for email_address in fields['emails'] or []:
+        if email_address and email_address.lower().endswith(f"@{COMPANY_EMAIL_DOMAIN}"):
+            work_email = email_address
+            break
+
+    return {
+        'emp_code': fields['user_id'],
+        'employee_name': full_name,
+        'employee_email': work_email,
+        'employee_phone': phone_number,
+        'date_of_birth': date_of_birth,
+        'business_unit': fields['division_name'] or fields['division'] or '',
+        'department': fields['department_name'] or fields['department'] or '',
+        'employment_status': employee_status,
+        'is_active': bool(employee_status) and employee_status.lower() == 'active',
+        'sap_last_modified': parse_sap_date(fields['last_modified']),
+    }
+
+def upsert_employee_directory(c, records):
+    """
+    Bulk upsert parsed SAP records into employee_directory. Call
+    update_employee_index with the same records once the transaction commits.
+    """
+    rows = [
+        (r['emp_code'], r['employee_name'], r['employee_email'], r['employee_phone'],
+         r['date_of_birth'], r['business_unit'], r['department'], r['employment_status'],
+         r['is_active'], r.get('sap_last_modified'))
+        for r in records if r.get('emp_code')
+    ]
+    if not rows:
+        return 0
+    psycopg2.extras.execute_values(c, '''
+        INSERT INTO employee_directory
+            (emp_code, employee_name, employee_email, employee_phone, date_of_birth,
+             business_unit, department, employment_status, is_active, sap_last_modified)
+        VALUES %s
+        ON CONFLICT (emp_code) DO UPDATE SET
+            employee_name = EXCLUDED.employee_name,
+            employee_email = EXCLUDED.employee_email,
+            employee_phone = EXCLUDED.employee_phone,
+            date_of_birth = EXCLUDED.date_of_birth,
+            business_unit = EXCLUDED.business_unit,
+            department = EXCLUDED.department,
+            employment_status = EXCLUDED.employment_status,
+            is_active = EXCLUDED.is_active,
+            sap_last_modified = COALESCE(EXCLUDED.sap_last_modified, employee_directory.sap_last_modified),
+            synced_at = CURRENT_TIMESTAMP
+    ''', rows, page_size=SAP_SYNC_PAGE_SIZE)
+    return len(rows)
+
+def update_employee_index(c, records):
+    """
+    Apply committed employee_directory upserts to the in-memory suggest index.
+    Portal users keep their users entry, as in rebuild_employee_index.
+    """
+    codes = [r['emp_code'] for r in records if r.get('emp_code')]
+    if not codes:
+        return
+    c.execute('SELECT emp_code FROM users WHERE emp_code = ANY(%s)', (codes,))
+    portal_users = {row[0] for row in c.fetchall()}
+    for r in records:
+        if not r.get('emp_code') or r['emp_code'] in portal_users:
+            continue
+        if r['is_active']:
+            employee_index.upsert(r['emp_code'], r['employee_name'])
+        else:
+            employee_index.remove(r['emp_code'])
+
+def sync_employee_directory(full=False):
+    """
+    Page through SAP EmpJob and bulk-upsert into employee_directory. Only records
+    modified since the last successful run are fetched unless full=True or there
+    is no watermark yet.
+    """
     start_time = time.time()
-    emp_code = request.args.get('emp_code')
+    conn = db_pool.getconn(budget='background')
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT watermark FROM sap_sync_state WHERE job = 'employee_directory'")
+            row = c.fetchone()
+            watermark = None if full or not row else row[0]
+
+            filter_expr = None
+            if watermark:
+                filter_expr = f"lastModifiedDateTime gt datetimeoffset'{watermark.strftime('%Y-%m-%dT%H:%M:%SZ')}'"
+
+            print(f"🔄 Employee directory sync started ({'delta since ' + str(watermark) if watermark else 'full'})")
+            total, new_watermark = 0, watermark
+            for results in get_sap_client().iter_pages(filter_expr):
+                records = [parse_sap_employee(result) for result in results]
+                total += upsert_employee_directory(c, records)
+                conn.commit()
+                update_employee_index(c, records)
 
-    print(f"\n" + "="*50)
-    print(f"📡 API REQUEST: Fetching employee data for: {emp_code}")
-    print("="*50)
+                for record in records:
+                    modified = record['sap_last_modified']
+                    if modified and (new_watermark is None or modified > new_watermark):
+                        new_watermark = modified
 
-    if not emp_code:
-        print("❌ ERROR: No employee code provided")
-        return jsonify({'success': False, 'error': 'No employee code provided'}), 400
+            # Portal users SAP never returned in a page (e.g. first seen after a
+            # failed run) are fetched directly in batches.
+            c.execute('''
+                SELECT u.emp_code FROM users u
+                WHERE NOT EXISTS (SELECT 1 FROM employee_directory d WHERE d.emp_code = u.emp_code)
+            ''')
+            missing = [row[0] for row in c.fetchall()]
+            if missing:
+                found = get_sap_client().get_employees(missing)
+                records = [parse_sap_employee(result) for result in found.values()]
+                total += upsert_employee_directory(c, records)
+                conn.commit()
+                update_employee_index(c, records)
+
+            c.execute('''
+                INSERT INTO sap_sync_state (job, watermark, last_run_at, rows_synced)
+                VALUES ('employee_directory', %s, CURRENT_TIMESTAMP, %s)
+                ON CONFLICT (job) DO UPDATE SET
+                    watermark = EXCLUDED.watermark,
+                    last_run_at = EXCLUDED.last_run_at,
+                    rows_synced = EXCLUDED.rows_synced
+            ''', (new_watermark, total))
+        conn.commit()
+
+        if total:
+            shared_cache.invalidate(SAP_CACHE_NAMESPACE)
+        rebuild_emp_code_filter()
+        rebuild_employee_index()
+        metric_observe('sap.directory_sync_seconds', time.time() - start_time)
+        metric_inc('sap.directory_sync_rows', total)
+        print(f"✅ Employee directory sync finished: {total} rows in {time.time() - start_time:.1f}s")
+        return total
+    except Exception as e:
+        conn.rollback()
+        metric_inc('sap.directory_sync_failures')
+        print(f"❌ Employee directory sync failed: {str(e)}")
+        print(traceback.format_exc())
+        return 0
+    finally:
+        db_pool.putconn(conn)
+
+def get_directory_employee(emp_code):
+    """Answer a lookup from employee_directory. Returns (status_code, body) or None on a miss."""
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            c.execute('''
+                SELECT employee_name, employee_email, employee_phone, date_of_birth,
+                       business_unit, department, employment_status, is_active
+                FROM employee_directory
+                WHERE emp_code = %s
+            ''', (emp_code,))
+            row = c.fetchone()
+    finally:
+        db_pool.putconn(conn)
 
+    if not row:
+        return None
+    name, email, phone, dob, division, department, employee_status, is_active = row
+    if not is_active:
+        return 403, {'success': False, 'error': f'Employee {emp_code} is not active. Current status: {employee_status or "Unknown"}. Only active employees can submit queries.'}
+    return 200, {'success': True, 'employee': {
+        'emp_code': emp_code,
+        'employee_name': name or '',
+        'employee_email': email or '',
+        'employee_phone': phone or '',
+        'date_of_birth': dob.strftime('%Y-%m-%d') if dob else None,
+        'business_unit': division or '',
+        'department': department or '',
+    }}
+
+SAP_CACHE_NAMESPACE = 'sap_employee'
+SAP_CACHE_TTL_SECONDS = 15 * 60              # found, active employees
+SAP_NEGATIVE_CACHE_TTL_SECONDS = 5 * 60      # not found / inactive codes
+# Only these outcomes are cached; timeouts and upstream errors are retried
+SAP_CACHEABLE_STATUSES = {200: SAP_CACHE_TTL_SECONDS, 403: SAP_NEGATIVE_CACHE_TTL_SECONDS, 404: SAP_NEGATIVE_CACHE_TTL_SECONDS}
+
+EMP_CODE_FILTER_ERROR_RATE = 0.01
+EMP_CODE_FILTER_HEADROOM = 1.25       # room for write-through adds between rebuilds
+EMP_CODE_FILTER_REBUILD_MINUTES = 60
+
+# Bloom filter of every known emp code. None until the directory has completed
+# a sync; until then every lookup goes through.
+emp_code_filter = None
+
+def rebuild_emp_code_filter():
+    """Rebuild the known-emp-code filter from employee_directory and users."""
+    global emp_code_filter
+    start_time = time.time()
+    conn = db_pool.getconn()
     try:
-        url = f"https://api44.sapsf.com/odata/v2/EmpJob?$select=division,divisionNav/name,location,locationNav/name,userId,employmentNav/personNav/personalInfoNav/firstName,employmentNav/personNav/personalInfoNav/middleName,employmentNav/personNav/personalInfoNav/lastName,department,departmentNav/name,employmentNav/personNav/emailNav/emailAddress,employmentNav/personNav/phoneNav/phoneNumber,employmentNav/personNav/dateOfBirth,emplStatusNav/picklistLabels/label&$expand=employmentNav/personNav/personalInfoNav,divisionNav,locationNav,departmentNav,employmentNav/personNav/phoneNav,employmentNav/personNav/emailNav,emplStatusNav/picklistLabels&$filter=userId eq '{emp_code}'&$format=json"
+        with conn.cursor() as c:
+            c.execute("SELECT 1 FROM sap_sync_state WHERE job = 'employee_directory' AND last_run_at IS NOT NULL")
+            if not c.fetchone():
+                print("⚠️ Employee directory has never synced; emp code filter disabled")
+                emp_code_filter = None
+                return None
+            c.execute('SELECT emp_code FROM employee_directory UNION SELECT emp_code FROM users')
+            codes = [row[0] for row in c.fetchall()]
+    finally:
+        db_pool.putconn(conn)
 
-        print(f"🔗 Using API URL: {url}")
+    new_filter = BloomFilter(int(len(codes) * EMP_CODE_FILTER_HEADROOM) + 100, EMP_CODE_FILTER_ERROR_RATE)
+    for code in codes:
+        new_filter.add(code)
+    emp_code_filter = new_filter
+    _record_emp_code_filter_metrics(new_filter)
+    print(f"🧮 Emp code filter rebuilt: {len(codes)} codes, {new_filter.size_bytes} bytes in {time.time() - start_time:.2f}s")
+    return new_filter
+
+def _record_emp_code_filter_metrics(bloom):
+    metric_set('sap.emp_code_filter.entries', bloom.count)
+    metric_set('sap.emp_code_filter.bytes', bloom.size_bytes)
+    metric_set('sap.emp_code_filter.expected_false_positive_rate', round(bloom.false_positive_rate, 6))
+
+def emp_code_not_listed_response(emp_code):
+    """404 for a code the emp code filter has never seen; the form offers a refresh."""
+    return 404, {'success': False, 'not_listed': True,
+                 'error': f'No employee found with ID: {emp_code}'}
+
+def lookup_sap_employee(emp_code, refresh=False):
+    """
+    Cached, coalesced SAP lookup. Returns (status_code, body) where body is the
+    JSON payload served by /api/get_employee_sap. Codes the emp code filter has
+    never seen get a (negatively cached) 404 without a lookup; otherwise the
+    local employee_directory is consulted and SAP is only called live on a miss.
+    refresh=True ("not listed? check again" on the form) drops the cached answer
+    and skips the filter, so hires since the last sync can still be found.
+    """
+    bloom = emp_code_filter
+    filter_miss = emp_code_filter_miss(bloom, emp_code)
+    if refresh:
+        metric_inc('sap.refreshes')
+        shared_cache.invalidate(SAP_CACHE_NAMESPACE, emp_code)
+
+    def load():
+        if filter_miss and not refresh:
+            return emp_code_not_listed_response(emp_code)
+        result = get_directory_employee(emp_code)
+        if result is not None:
+            metric_inc('sap.directory_hits')
+        else:
+            metric_inc('sap.directory_misses')
+            result = fetch_sap_employee(emp_code)
+            if result[0] == 200:
+                remember_sap_employee(result[1]['employee'])
+        return result
+
+    result, source = shared_cache.get_or_load(
+        SAP_CACHE_NAMESPACE, emp_code, load,
+        ttl=lambda result: SAP_CACHEABLE_STATUSES.get(result[0])
+    )
+    metric_inc({'hit': 'sap.cache_hits', 'miss': 'sap.cache_misses', 'coalesced': 'sap.coalesced_waits'}[source])
+    if source == 'miss':
+        record_emp_code_filter_outcome(bloom, filter_miss, result[0])
+    return result
+
+def emp_code_filter_miss(bloom, emp_code):
+    """True when the emp code filter has never seen the code."""
+    if bloom is None:
+        return False
+    if emp_code not in bloom:
+        metric_inc('sap.emp_code_filter.misses')
+        return True
+    metric_inc('sap.emp_code_filter.passes')
+    return False
 
-        username = os.environ.get('SAP_API_USERNAME')
-        password = os.environ.get('SAP_API_PASSWORD')
+def record_emp_code_filter_outcome(bloom, filter_miss, status):
+    """Count filter mistakes; only call this for freshly loaded results, not cached ones."""
+    if bloom is None:
+        return
+    if filter_miss and status == 200:
+        metric_inc('sap.emp_code_filter.stale_misses')
+    elif not filter_miss and status == 404:
+        metric_inc('sap.emp_code_filter.false_positives')
+
+def remember_sap_employee(employee):
+    """Write a live SAP hit through to employee_directory and the emp code filter."""
+    record = dict(employee, employment_status='Active', is_active=True)
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            upsert_employee_directory(c, [record])
+            conn.commit()
+            update_employee_index(c, [record])
+            conn.commit()
+        if emp_code_filter is not None:
+            emp_code_filter.add(employee['emp_code'])
+            _record_emp_code_filter_metrics(emp_code_filter)
+    except psycopg2.Error as e:
+        print(f"⚠️ Could not write {employee['emp_code']} to employee directory: {str(e)}")
+    finally:
+        db_pool.putconn(conn)
 
-        print(f"👤 Using username: {username}")
-        print(f"🔑 Password provided: {'Yes' if password else 'No'}")
+EMPLOYEE_SUGGEST_DEFAULT_LIMIT = 10
+EMPLOYEE_SUGGEST_MAX_LIMIT = 25
+EMPLOYEE_SUGGEST_SCAN_LIMIT = 200     # prefix keys examined per query, bounds latency
+EMPLOYEE_SUGGEST_REBUILD_MINUTES = 60
 
-        print(f"🚀 Sending API request with 5-second timeout...")
-        response = requests.get(
-            url,
-            auth=HTTPBasicAuth(username, password),
-            timeout=5,
-            headers={'Cache-Control': 'no-cache'}
+def normalise_search_text(text):
+    """Lower-case, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+class EmployeeSuggestIndex:
+    """
+    Sorted array of (search key, emp_code) for prefix lookups. Each employee is
+    indexed under their emp code, full name and every later name token, so
+    "sha" finds "Rahul Sharma". Loaded from users and employee_directory and
+    updated in place as either table changes in this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+
+    @staticmethod
+    def _keys_for(emp_code, name):
+        keys = {normalise_search_text(emp_code)}
+        name = normalise_search_text(name)
+        if name:
+            keys.add(name)
+            tokens = name.split(' ')
+            keys.update(' '.join(tokens[i:]) for i in range(1, len(tokens)))
+        keys.discard('')
+        return [(key, emp_code) for key in keys]
+
+    def load(self, rows):
+        """Replace the index with [(emp_code, employee_name)]."""
+        entries = {emp_code: name for emp_code, name in rows if emp_code}
+        keys = sorted(key for emp_code, name in entries.items() for key in self._keys_for(emp_code, name))
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+
+    def _remove_locked(self, emp_code):
+        if emp_code not in self._entries:
+            return
+        for key in self._keys_for(emp_code, self._entries.pop(emp_code)):
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def upsert(self, emp_code, name):
+        if not emp_code:
+            return
+        with self._lock:
+            if emp_code in self._entries and self._entries[emp_code] == name:
+                return
+            self._remove_locked(emp_code)
+            self._entries[emp_code] = name
+            for key in self._keys_for(emp_code, name):
+                bisect.insort(self._keys, key)
+
+    def remove(self, emp_code):
+        with self._lock:
+            self._remove_locked(emp_code)
+
+    def suggest(self, query, limit=EMPLOYEE_SUGGEST_DEFAULT_LIMIT):
+        """Top `limit` [(emp_code, employee_name)], emp code matches first."""
+        query = normalise_search_text(query)
+        if not query:
+            return []
+        with self._lock:
+            keys, entries = self._keys, self._entries
+            i = bisect.bisect_left(keys, (query,))
+            matches = {}
+            for key, emp_code in keys[i:i + EMPLOYEE_SUGGEST_SCAN_LIMIT]:
+                if not key.startswith(query):
+                    break
+                matches.setdefault(emp_code, entries.get(emp_code))
+        code_query = query.replace(' ', '')
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (not normalise_search_text(item[0]).replace(' ', '').startswith(code_query),
+                              (item[1] or '').lower(), item[0])
         )
+        return ranked[:limit]
 
-        api_time = time.time() - start_time
-        print(f"⏱️ API responded in {api_time:.2f} seconds with status: {response.status_code}")
+    def __len__(self):
+        return len(self._entries)
 
-        if response.status_code != 200:
-            print(f"❌ API ERROR: Status code {response.status_code}")
-            print(f"Response text: {response.text[:200]}...")
-            return jsonify({
-                'success': False,
-                'error': f'API returned status code {response.status_code}'
-            }), 500
-
-        data = response.json()
-        results = data.get('d', {}).get('results', [])
-
-        if not results:
-            print(f"❌ No results found for employee ID: {emp_code}")
-            return jsonify({
-                'success': False,
-                'error': f'No employee found with ID: {emp_code}'
-            }), 404
-
-        result = results[0]
-        print(f"✅ Found employee data, processing...")
-
-        def safe_get(data, *keys):
-            for key in keys:
-                if isinstance(data, dict):
-                    data = data.get(key)
-                elif isinstance(data, list) and isinstance(key, int) and len(data) > key:
-                    data = data[key]
-                else:
-                    return None
-                if data is None:
-                    return None
-            return data
-                # Check Employee Status
-        print(f"🔍 CHECKING EMPLOYEE STATUS:")
-        employee_status = safe_get(result, 'emplStatusNav', 'picklistLabels', 'results', 0, 'label')
-        print(f"  Employee Status: {employee_status}")
-
-        if not employee_status or employee_status.lower() != 'active':
-            print(f"❌ Employee {emp_code} is not active. Status: {employee_status}")
-            return jsonify({
-                'success': False,
-                'error': f'Employee {emp_code} is not active. Current status: {employee_status or "Unknown"}. Only active employees can submit queries.'
-            }), 403
-
-        print(f"✅ Employee {emp_code} is active, proceeding with data extraction...")
-        personal_info = safe_get(result, 'employmentNav', 'personNav', 'personalInfoNav', 'results', 0)
-        first_name = safe_get(personal_info, 'firstName') or ''
-        middle_name = safe_get(personal_info, 'middleName') or ''
-        last_name = safe_get(personal_info, 'lastName') or ''
-
-        date_of_birth_raw = safe_get(result, 'employmentNav', 'personNav', 'dateOfBirth')
-        date_of_birth = None
-
-        if date_of_birth_raw:
-            print(f"📅 Raw DOB: {date_of_birth_raw}")
-            dob_date = parse_sap_date(date_of_birth_raw)
-            if dob_date:
-                date_of_birth = dob_date.strftime('%Y-%m-%d')
-                print(f"📅 Parsed DOB: {date_of_birth}")
-            else:
-                print(f"⚠️ Could not parse DOB: {date_of_birth_raw}")
+employee_index = EmployeeSuggestIndex()
+
+def rebuild_employee_index():
+    start_time = time.time()
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as c:
+            # users wins over the directory for people in both
+            c.execute('''
+                SELECT emp_code, employee_name FROM users
+                UNION ALL
+                SELECT d.emp_code, d.employee_name FROM employee_directory d
+                WHERE d.is_active AND NOT EXISTS (SELECT 1 FROM users u WHERE u.emp_code = d.emp_code)
+            ''')
+            rows = c.fetchall()
+    finally:
+        db_pool.putconn(conn)
+    employee_index.load(rows)
+    metric_set('employee_index.entries', len(employee_index))
+    print(f"🔎 Employee suggest index loaded: {len(employee_index)} employees in {time.time() - start_time:.2f}s")
 
-        division = safe_get(result, 'divisionNav', 'name') or result.get('division', '')
-        department = safe_get(result, 'departmentNav', 'name') or result.get('department', '')
+@app.route('/api/employees/suggest', methods=['GET'])
+def suggest_employees():
+    user = session.get('user')
+    if not user or not user.get('authenticated') or user.get('role') not in ('hr', 'admin'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
-        print(f"🔍 PHONE EXTRACTION (STRICT MODE):")
-        phone_nav = safe_get(result, 'employmentNav', 'personNav', 'phoneNav')
-        print(f"  Raw phone data: {phone_nav}")
+    try:
+        limit = int(request.args.get('limit', EMPLOYEE_SUGGEST_DEFAULT_LIMIT))
+    except ValueError:
+        limit = EMPLOYEE_SUGGEST_DEFAULT_LIMIT
+    limit = max(1, min(limit, EMPLOYEE_SUGGEST_MAX_LIMIT))
 
-        phone_number = ""
-        phone_results = None
+    start_time = time.time()
+    matches = employee_index.suggest(request.args.get('q', ''), limit)
+    metric_observe('employee_index.suggest_seconds', time.time() - start_time)
+    return jsonify({
+        'success': True,
+        'results': [{'emp_code': emp_code, 'employee_name': name} for emp_code, name in matches],
+    })
 
-        if isinstance(phone_nav, dict) and 'results' in phone_nav:
-            phone_results = phone_nav.get('results')
-        elif isinstance(phone_nav, list):
-            phone_results = phone_nav
+@app.route('/api/get_employee_sap', methods=['GET'])
+def get_employee_sap():
+    emp_code = (request.args.get('emp_code') or '').strip()
+    if not emp_code:
+        print("❌ ERROR: No employee code provided")
+        return jsonify({'success': False, 'error': 'No employee code provided'}), 400
 
-        if phone_results and len(phone_results) > 1:
-            phone_item_at_index_1 = phone_results[1]
-            if isinstance(phone_item_at_index_1, dict) and phone_item_at_index_1.get('phoneNumber'):
-                phone_number = phone_item_at_index_1['phoneNumber']
-                print(f"  ✅ Found required phone number at index 1: {phone_number}")
-            else:
-                print("  ⚠️ Item at index 1 is not a valid phone object or has no number.")
-        else:
-            print("  ⚠️ Phone results list does not have an item at index 1. No other fallbacks will be used.")
+    status_code, body = lookup_sap_employee(emp_code, refresh=request.args.get('refresh') == '1')
+    return jsonify(body), status_code
 
-        if phone_number:
-            phone_number = ''.join(filter(str.isdigit, phone_number))
+SAP_UNAVAILABLE_RESPONSE = (503, {'success': False, 'error': 'Employee lookup is temporarily unavailable. Please try again in a minute.'})
 
-            if phone_number and len(phone_number) >= 10:
-                if not phone_number.startswith('+'):
-                    if phone_number.startswith('91'):
-                        phone_number = '+91' + phone_number
-                    else:
-                        phone_number = '+91' + phone_number
-            else:
-                print("  ⚠️ Phone number format invalid, using empty value")
-                phone_number = ""
-        else:
-            print("  ⚠️ No phone number found using the strict index 1 rule.")
-
-        print(f"  📱 Final phone number: {phone_number}")
-
-        full_name = f"{first_name} {middle_name} {last_name}".replace('  ', ' ').strip()
-
-        work_email = ''  
-        email_list = safe_get(result, 'employmentNav', 'personNav', 'emailNav', 'results')
-
-        print(f"📧 EMAIL EXTRACTION DEBUG: Found email list: {email_list}")
-
-        if isinstance(email_list, list):
-            for email_item in email_list:
-                email_address = safe_get(email_item, 'emailAddress')
-                if email_address and email_address.lower().endswith(f"@{COMPANY_EMAIL_DOMAIN}"):
-                    work_email = email_address
-                    print(f"  ✅ Found work email: {work_email}")
-                    break 
-        email = work_email
-
-        employee_data = {
-            'emp_code': emp_code,
-            'employee_name': full_name,
-            'employee_email': email,
-            'employee_phone': phone_number,
-            'date_of_birth': date_of_birth,
-            'business_unit': division,
-            'department': department
-        }
+def sap_employee_response(emp_code, result):
+    """(status_code, body) for one raw EmpJob result (None when SAP found nothing)."""
+    if not result:
+        print(f"❌ No results found for employee ID: {emp_code}")
+        return 404, {'success': False, 'error': f'No employee found with ID: {emp_code}'}
 
-        print(f"📤 Returning employee data: {employee_data}")
-        total_time = time.time() - start_time
-        print(f"⏱️ Total processing time: {total_time:.2f} seconds")
-        print("="*50)
+    record = parse_sap_employee(result)
+    employee_status = record['employment_status']
 
-        return jsonify({'success': True, 'employee': employee_data})
+    if not record['is_active']:
+        print(f"❌ Employee {emp_code} is not active. Status: {employee_status}")
+        return 403, {'success': False, 'error': f'Employee {emp_code} is not active. Current status: {employee_status or "Unknown"}. Only active employees can submit queries.'}
 
+    employee_data = {
+        'emp_code': emp_code,
+        'employee_name': record['employee_name'],
+        'employee_email': record['employee_email'],
+        'employee_phone': record['employee_phone'],
+        'date_of_birth': record['date_of_birth'],
+        'business_unit': record['business_unit'],
+        'department': record['department']
+    }
+
+    print(f"✅ Employee {emp_code} found (email: {'yes' if record['employee_email'] else 'no'}, phone: {'yes' if record['employee_phone'] else 'no'})")
+    return 200, {'success': True, 'employee': employee_data}
+
+def fetch_sap_employee(emp_code):
+    """Call SAP SuccessFactors for one emp code. Returns (status_code, body)."""
+    import requests
+    start_time = time.time()
+    print(f"📡 SAP lookup for employee: {emp_code}")
+
+    try:
+        result = get_sap_client().get_employee(emp_code)
+        print(f"⏱️ SAP responded in {time.time() - start_time:.2f} seconds")
+        return sap_employee_response(emp_code, result)
+
+    except SAPAPIError as e:
+        return 500, {'success': False, 'error': str(e)}
+    except CircuitOpenError:
+        return SAP_UNAVAILABLE_RESPONSE
     except requests.exceptions.Timeout:
-        print(f"⏰ API request timed out after 5 seconds")
-        return jsonify({
-            'success': False,
-            'error': 'API request timed out. Please try again.'
-        }), 504
+        print(f"⏰ API request timed out after {SAP_REQUEST_TIMEOUT_SECONDS} seconds")
+        return 504, {'success': False, 'error': 'API request timed out. Please try again.'}
     except requests.exceptions.RequestException as e:
         print(f"🌐 Network error: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f'Network error: {str(e)}'
-        }), 503
+        return 503, {'success': False, 'error': f'Network error: {str(e)}'}
     except Exception as e:
         print(f"❌ Unexpected error: {str(e)}")
         print(traceback.format_exc())
-        return jsonify({
-            'success': False,
-            'error': f'Error: {str(e)}'
-        }), 500
+        return 500, {'success': False, 'error': f'Error: {str(e)}'}
 
 @app.route('/privacy-policy')
 def privacy_policy():
@@ -3622,31 +6162,83 @@ def privacy_policy():
 def terms_of_service():
     return render_template('terms.html')
 
+def send_attachment(path, download_name, etag=None):
+    """
+    Serve an upload inline. Blobs pass their SHA-256 as etag: the same URL
+    never changes content, so they are marked immutable and revalidate to 304.
+    Range requests are answered by send_file (or by the proxy when offloaded).
+    """
+    if ATTACHMENT_OFFLOAD == 'x-accel':
+        if etag and request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            rel_path = os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/')
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = ATTACHMENT_ACCEL_PREFIX.rstrip('/') + '/' + quote(rel_path)
+            response.mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+            response.headers.set('Content-Disposition', 'inline', filename=download_name)
+        metric_inc('downloads.offloaded')
+    else:
+        response = send_file(path, download_name=download_name, as_attachment=False,
+                             conditional=True, etag=etag or True)
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'private, max-age={ATTACHMENT_CACHE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/preview/<user_type>/<emp_code>/<filename>')
+def preview_attachment(user_type, emp_code, filename):
+    """WebP thumbnail (?variant=thumb) or PDF first page (?variant=page); 404 until rendered."""
+    import previews
+    variant = request.args.get('variant', 'thumb')
+    kind = previews.preview_kind(filename)
+    if user_type not in ('employee', 'hr', 'admin') or not kind or variant not in previews.variants_for(kind):
+        return make_response('', 404)
+    # Checked before anything is looked up or rendered, so anonymous hits cost nothing
+    if not can_view_attachment(session.get('user'), user_type, emp_code, filename):
+        return make_response('', 404)
+    attachment = lookup_attachment(user_type, emp_code, filename)
+    if not attachment:
+        return make_response('', 404)
+    blob_file, sha256, _ = attachment
+    path = previews.preview_path(blob_file, variant)
+    if not os.path.exists(path):
+        # Not rendered yet (pool busy, or uploaded before previews existed)
+        schedule_preview(blob_file, filename)
+        response = make_response('', 404)
+        response.headers['Retry-After'] = '5'
+        return response
+    return send_attachment(path, f"{filename}.{variant}.webp", etag=f"{sha256}-{variant}")
+
 @app.route('/download/<user_type>/<emp_code>/<filename>')
 def download_file(user_type, emp_code, filename):
+    user = session.get('user')
+    if not user or not user.get('authenticated'):
+        flash('Please log in to view attachments.', 'error')
+        return redirect(url_for('login'))
     try:
         if user_type not in ['employee', 'hr','admin']:
             flash('Invalid file type requested.', 'error')
             return redirect(url_for('index'))
-        
-        file_directory = os.path.join(UPLOAD_FOLDER, user_type, emp_code)
-        
-        if not os.path.exists(file_directory):
-            flash('File not found.', 'error') 
-            return redirect(url_for('index'))
-        
-        full_file_path = os.path.join(file_directory, filename)
-        if not os.path.exists(full_file_path):
-            flash('File not found.', 'error')
-            return redirect(url_for('index'))
-            
-        print(f"📁 Serving file: {full_file_path}")
-        
-        return send_from_directory(
-            directory=file_directory,
-            path=filename,
-            as_attachment=False  
-        )        
+        if not can_view_attachment(user, user_type, emp_code, filename):
+            # Same answer as a missing file, so names cannot be probed
+            print(f"🚫 Download refused: {user.get('emp_code')} -> {user_type}/{emp_code}/{filename}")
+            return make_response('File not found.', 404)
+
+        attachment = lookup_attachment(user_type, emp_code, filename)
+        if attachment:
+            blob_file, sha256, _ = attachment
+            return send_attachment(blob_file, filename, etag=sha256)
+
+        # Uploaded before the blob store: still on disk under uploads/<user_type>/<emp_code>/
+        full_file_path = safe_join(UPLOAD_FOLDER, user_type, emp_code, filename)
+        if full_file_path is None:
+            raise NotFound()
+        return send_attachment(full_file_path, filename)
+    except (FileNotFoundError, NotFound):
+        print(f"❌ File not found: {user_type}/{emp_code}/{filename}")
+        flash('File not found.', 'error')
+        return redirect(url_for('index'))
     except Exception as e:
         print(f"❌ Download error: {str(e)}")
         flash('Error accessing file.', 'error')
@@ -3740,50 +6332,272 @@ def export_grievance_stats():
     finally:
         db_pool.putconn(conn)
 
-if __name__ == '__main__':
-    init_db()
-    # Immediate runs wrapper
-    def run_overdue_scan():
-        with app.app_context():
-            check_pending_grievances(debug=True)
+SCHEDULER_NODE_ID = os.environ.get('SCHEDULER_NODE_ID') or f"{socket.gethostname()}:{os.getpid()}"
+JOB_LEASE_SECONDS = 60
+# A node that wins the lock still skips the job if another node started it
+# this recently, so clock skew between nodes cannot cause a double run.
+JOB_MIN_INTERVAL_SECONDS = {
+    'overdue_scan': 30 * 60,
+    'daily_hr_summary': 60 * 60,
+    'feedback_reminders': 12 * 60 * 60,
+    'purge_expired_sessions': 5 * 60,
+    'employee_directory_sync': 12 * 60 * 60,
+    'purge_unreferenced_blobs': 12 * 60 * 60,
+    'deliver_queued_notifications': 30,
+}
 
-    def run_daily_summary():
-        with app.app_context():
-            send_daily_hr_pending_summary(debug=True)
-
-    # Overdue scan scheduler (hourly)
-    scheduler_overdue = BackgroundScheduler()
-    scheduler_overdue.add_job(
-        func=run_overdue_scan,
-        trigger=IntervalTrigger(hours=REMINDER_SCAN_INTERVAL_HOURS),
-        id='overdue_scan',
-        replace_existing=True,
-    )
-    scheduler_overdue.start()
-    print("📅 Overdue reminder scheduler (hourly + immediate) started")
-
-    # Daily HR summary (09:00 & 16:00)
-    scheduler_daily = BackgroundScheduler()
-    scheduler_daily.add_job(
-        func=run_daily_summary,
-        trigger=CronTrigger(hour="9,16", minute=0),
-        id='daily_hr_summary',
-        replace_existing=True,
-    )
-    scheduler_daily.start()
-    print("📅 Daily HR summary scheduler (09:00 & 16:00 + immediate) started")
-
-    # Existing feedback reminders (daily at startup time)
-    scheduler_feedback = BackgroundScheduler()
-    scheduler_feedback.add_job(
-        func=lambda: send_pending_feedback_reminders(),
-        trigger=IntervalTrigger(days=1),
-        id='feedback_reminders',
-        replace_existing=True,
+def run_exclusive(job_id, func):
+    """
+    Run func on at most one node at a time, guarded by a session-level
+    pg_try_advisory_lock keyed on job_id. Nodes that lose the race return
+    immediately. While func runs, a heartbeat renews the lease in
+    scheduler_jobs on the lock's own connection.
+    """
+    conn = db_pool.getconn(budget='background', readonly=False)
+    # Never hand a connection that may still hold the lock back to the pool
+    close = True
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT pg_try_advisory_lock(hashtext('scheduler_job:' || %s))", (job_id,))
+            acquired = c.fetchone()[0]
+            conn.commit()
+            if not acquired:
+                close = False
+                metric_inc(f'scheduler.{job_id}.skipped_locked')
+                return None
+            try:
+                c.execute("""
+                    SELECT node, started_at FROM scheduler_jobs
+                    WHERE job_id = %s AND started_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """, (job_id, JOB_MIN_INTERVAL_SECONDS.get(job_id, 0)))
+                recent = c.fetchone()
+                if recent:
+                    conn.commit()
+                    metric_inc(f'scheduler.{job_id}.skipped_recent')
+                    print(f"⏭️ {job_id} already ran on {recent[0]} at {recent[1]}; skipping")
+                    return None
+                c.execute("""
+                    INSERT INTO scheduler_jobs (job_id, node, status, started_at, finished_at, duration_seconds, lease_until, error)
+                    VALUES (%s, %s, 'running', CURRENT_TIMESTAMP, NULL, NULL, CURRENT_TIMESTAMP + make_interval(secs => %s), NULL)
+                    ON CONFLICT (job_id) DO UPDATE SET
+                        node = EXCLUDED.node, status = EXCLUDED.status, started_at = EXCLUDED.started_at,
+                        finished_at = NULL, duration_seconds = NULL, lease_until = EXCLUDED.lease_until, error = NULL
+                """, (job_id, SCHEDULER_NODE_ID, JOB_LEASE_SECONDS))
+                conn.commit()
+
+                stop = threading.Event()
+                conn_lock = threading.Lock()
+
+                def renew_lease():
+                    while not stop.wait(JOB_LEASE_SECONDS / 3):
+                        try:
+                            with conn_lock, conn.cursor() as hc:
+                                hc.execute("""
+                                    UPDATE scheduler_jobs SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                                    WHERE job_id = %s AND node = %s
+                                """, (JOB_LEASE_SECONDS, job_id, SCHEDULER_NODE_ID))
+                                conn.commit()
+                        except psycopg2.Error as e:
+                            # The lock dies with this connection; another node may take over
+                            metric_inc(f'scheduler.{job_id}.lease_lost')
+                            print(f"⚠️ Lost lease for {job_id}: {e}")
+                            return
+
+                heartbeat = threading.Thread(target=renew_lease, name=f'lease-{job_id}', daemon=True)
+                heartbeat.start()
+                start_time = time.time()
+                status, error = 'succeeded', None
+                try:
+                    return func()
+                except Exception as e:
+                    status, error = 'failed', str(e)
+                    print(f"❌ Job {job_id} failed: {e}")
+                    print(traceback.format_exc())
+                    raise
+                finally:
+                    stop.set()
+                    heartbeat.join()
+                    duration = time.time() - start_time
+                    metric_observe(f'scheduler.{job_id}.run_seconds', duration)
+                    with conn_lock:
+                        c.execute("""
+                            UPDATE scheduler_jobs
+                            SET status = %s, finished_at = CURRENT_TIMESTAMP, duration_seconds = %s,
+                                lease_until = CURRENT_TIMESTAMP, error = %s
+                            WHERE job_id = %s AND node = %s
+                        """, (status, duration, error, job_id, SCHEDULER_NODE_ID))
+                        conn.commit()
+            finally:
+                c.execute("SELECT pg_advisory_unlock(hashtext('scheduler_job:' || %s))", (job_id,))
+                conn.commit()
+                close = False
+    except psycopg2.Error as e:
+        if close:
+            print(f"⚠️ Scheduler lock error for {job_id}: {e}")
+        raise
+    finally:
+        db_pool.putconn(conn, close=close)
+
+PROCESS_REFRESH_JOBS = (
+    # (function, minutes) rebuilt inside every web process; they are in-memory
+    (rebuild_emp_code_filter, EMP_CODE_FILTER_REBUILD_MINUTES),
+    (rebuild_employee_index, EMPLOYEE_SUGGEST_REBUILD_MINUTES),
+)
+
+SCHEDULER_MAX_WORKERS = int(os.environ.get('SCHEDULER_MAX_WORKERS', 4))
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.environ.get('SCHEDULER_MISFIRE_GRACE_SECONDS', 15 * 60))
+FEEDBACK_REMINDER_HOUR = 10
+
+def run_overdue_scan():
+    with app.app_context():
+        check_pending_grievances(debug=True)
+
+def run_daily_summary():
+    with app.app_context():
+        send_daily_hr_pending_summary(debug=True)
+
+def run_feedback_reminders():
+    send_pending_feedback_reminders()
+
+def run_employee_directory_sync():
+    sync_employee_directory(full=datetime.now().weekday() == 6)
+
+def run_notification_delivery():
+    while deliver_queued_notifications() == OUTBOX_BATCH_SIZE:
+        pass
+
+def scheduled_jobs():
+    """(job_id, func, trigger) for every cluster-wide job."""
+    from apscheduler.triggers.interval import IntervalTrigger
+    from apscheduler.triggers.cron import CronTrigger
+    return [
+        ('overdue_scan', run_overdue_scan, IntervalTrigger(hours=REMINDER_SCAN_INTERVAL_HOURS)),
+        ('daily_hr_summary', run_daily_summary,
+         CronTrigger(hour=','.join(str(h) for h in DAILY_SUMMARY_HOURS), minute=0)),
+        ('feedback_reminders', run_feedback_reminders, CronTrigger(hour=FEEDBACK_REMINDER_HOUR, minute=0)),
+        ('purge_expired_sessions', purge_expired_sessions, IntervalTrigger(minutes=SESSION_PURGE_INTERVAL_MINUTES)),
+        ('employee_directory_sync', run_employee_directory_sync, CronTrigger(hour=SAP_SYNC_HOUR, minute=0)),
+        ('purge_unreferenced_blobs', purge_unreferenced_blobs, CronTrigger(hour=ATTACHMENT_PURGE_HOUR, minute=30)),
+        ('deliver_queued_notifications', run_notification_delivery,
+         IntervalTrigger(minutes=OUTBOX_DELIVERY_INTERVAL_MINUTES)),
+    ]
+
+def scheduler_engine():
+    """
+    SQLAlchemy engine for the job store. Connections come from psycopg2 with
+    the app's own DB_CONFIG, so unix-socket hosts and other DSN options work
+    exactly as they do for the pool.
+    """
+    from sqlalchemy import create_engine
+    return create_engine('postgresql+psycopg2://', creator=lambda: psycopg2.connect(**app.config['DB_CONFIG']),
+                         pool_pre_ping=True)
+
+def start_schedulers(persistent=True):
+    """
+    Start the single job scheduler (see worker.py). With persistent=True jobs
+    live in the apscheduler_jobs table, so next run times and misfires survive
+    restarts; the development server uses an in-memory store instead.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.executors.pool import ThreadPoolExecutor
+    jobstores = {}
+    if persistent:
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        jobstores['default'] = SQLAlchemyJobStore(engine=scheduler_engine(), tablename='apscheduler_jobs')
+
+    scheduler = BackgroundScheduler(
+        jobstores=jobstores,
+        executors={'default': ThreadPoolExecutor(SCHEDULER_MAX_WORKERS)},
+        job_defaults={
+            'coalesce': True,            # run once after downtime, not once per missed slot
+            'max_instances': 1,
+            'misfire_grace_time': SCHEDULER_MISFIRE_GRACE_SECONDS,
+        },
     )
-    scheduler_feedback.start()
-    print("📅 Feedback reminder scheduler (daily + immediate) started")
+    scheduler.start(paused=True)
+
+    # Reconcile the stored jobs with the code: keep unchanged ones (and their
+    # next run time), replace changed ones, drop removed ones.
+    wanted = scheduled_jobs()
+    wanted_ids = {job_id for job_id, _, _ in wanted}
+    for job in scheduler.get_jobs():
+        if job.id not in wanted_ids:
+            job.remove()
+    for job_id, func, trigger in wanted:
+        existing = scheduler.get_job(job_id)
+        if existing and str(existing.trigger) == str(trigger) and existing.args == (job_id, func):
+            continue
+        scheduler.add_job(run_exclusive, trigger=trigger, args=[job_id, func], id=job_id,
+                          name=func.__name__, replace_existing=True)
+
+    scheduler.resume()
+    for job in scheduler.get_jobs():
+        print(f"📅 {job.id}: {job.trigger} (next run {job.next_run_time})")
+    print(f"📅 Scheduler started with {SCHEDULER_MAX_WORKERS} worker thread(s)"
+          f"{' and a persistent job store' if persistent else ''}")
+    return scheduler
+
+def start_process_refresh():
+    """Periodic rebuilds of this process's in-memory indexes."""
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+    scheduler_refresh = BackgroundScheduler()
+    for func, minutes in PROCESS_REFRESH_JOBS:
+        scheduler_refresh.add_job(
+            func=func,
+            trigger=IntervalTrigger(minutes=minutes),
+            id=func.__name__,
+            replace_existing=True,
+        )
+    scheduler_refresh.start()
+    return scheduler_refresh
+
+def warm_up():
+    """Open pooled connections and compile templates and routes before serving."""
+    start_time = time.time()
+    conns = []
+    try:
+        for _ in range(DB_POOL_MIN_CONNECTIONS):
+            conn = db_pool.getconn(budget='background', readonly=True)
+            conns.append(conn)
+            with conn.cursor() as c:
+                c.execute('SELECT 1')
+    finally:
+        for conn in conns:
+            db_pool.putconn(conn)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    app.url_map.update()
+    print(f"🔥 Worker {os.getpid()} warmed up in {time.time() - start_time:.2f}s")
+
+_app_ready = False
+
+def create_app():
+    """
+    WSGI application factory used by wsgi.py. Loads the in-process caches and
+    indexes and warms the worker. Does not create the schema or start the
+    scheduled jobs; those belong to init_db() and worker.py.
+    """
+    global _app_ready
+    if _app_ready:
+        return app
+    hr_directory.reload()
+    start_hr_directory_listener()
+    shared_cache.start_listener()
+    rebuild_emp_code_filter()
+    rebuild_employee_index()
+    start_process_refresh()
+    warm_up()
+    _app_ready = True
+    return app
+
+if __name__ == '__main__':
+    # Development server: single process running the web app and all jobs
+    detect_ngrok_host()
+    init_db()
+    create_app()
+    start_schedulers(persistent=False)
 
     print(f"🔭 Final SERVER_HOST: {SERVER_HOST} | PORT: {PORT} | app.config['SERVER_NAME']: {app.config.get('SERVER_NAME')}")
 
-    app.run(host='0.0.0.0', port=PORT, debug=True, use_reloader=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT, debug=True, use_reloader=False)
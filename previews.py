@@ -0,0 +1,97 @@
+"""
+Attachment thumbnail / preview rendering.
+
+Runs inside the preview process pool, so it imports neither Flask nor the
+database driver. Pillow renders images; PDFs additionally need PyMuPDF.
+Both are optional: without them no previews are generated and the
+templates fall back to plain attachment links.
+
+Output goes next to the blob as <blob>.<variant>.webp:
+    thumb  - small thumbnail for lists and modals (images and PDFs)
+    page   - first page of a PDF at readable size
+"""
+import importlib.util
+import os
+
+PREVIEW_VARIANTS = {
+    'thumb': 320,
+    'page': 1200,
+}
+WEBP_QUALITY = 80
+
+PREVIEW_KINDS = {
+    'png': 'image',
+    'jpg': 'image',
+    'jpeg': 'image',
+    'gif': 'image',
+    'pdf': 'pdf',
+}
+
+
+def preview_kind(filename):
+    """'image', 'pdf' or None for a download name."""
+    if not filename or '.' not in filename:
+        return None
+    return PREVIEW_KINDS.get(filename.rsplit('.', 1)[1].lower())
+
+
+def renderer_available(kind):
+    """Check for the optional libraries without importing them."""
+    if importlib.util.find_spec('PIL') is None:
+        return False
+    if kind == 'pdf':
+        return importlib.util.find_spec('fitz') is not None
+    return kind == 'image'
+
+
+def preview_path(blob_file, variant):
+    return f"{blob_file}.{variant}.webp"
+
+
+def variants_for(kind):
+    return ('thumb', 'page') if kind == 'pdf' else ('thumb',)
+
+
+def _save_webp(image, dest):
+    # Write then rename so a half-written preview is never served
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    image.save(tmp, 'WEBP', quality=WEBP_QUALITY, method=4)
+    os.replace(tmp, dest)
+
+
+def _render_image(blob_file, dest, max_side):
+    from PIL import Image, ImageOps
+    with Image.open(blob_file) as image:
+        image.draft('RGB', (max_side, max_side))  # JPEG: decode at reduced scale
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        _save_webp(image, dest)
+
+
+def _render_pdf_page(blob_file, dest, max_side):
+    import fitz
+    from PIL import Image
+    with fitz.open(blob_file) as doc:
+        page = doc.load_page(0)
+        zoom = max_side / max(page.rect.width, page.rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    _save_webp(image, dest)
+
+
+def render_previews(blob_file, kind):
+    """Render every missing variant for one blob. Returns the paths written."""
+    written = []
+    for variant in variants_for(kind):
+        dest = preview_path(blob_file, variant)
+        if os.path.exists(dest):
+            continue
+        max_side = PREVIEW_VARIANTS[variant]
+        if kind == 'pdf':
+            _render_pdf_page(blob_file, dest, max_side)
+        else:
+            _render_image(blob_file, dest, max_side)
+        written.append(dest)
+    return written
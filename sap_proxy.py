@@ -0,0 +1,250 @@
+"""
+Asynchronous SAP employee lookup tier.
+
+Serves /api/get_employee_sap so that a slow SAP costs one coroutine per
+waiting form instead of one Gunicorn worker thread. Run it next to the web
+workers and route that path to it at the front proxy:
+
+    uvicorn sap_proxy:app --host 127.0.0.1 --port 8113
+
+Lookups take the same path as the WSGI view: shared cache, emp code filter,
+employee_directory, then a live SAP call written through to the directory.
+Database and cache calls are short and run on the default thread pool; the
+SAP call is an httpx.AsyncClient request. At most SAP_PROXY_MAX_CONCURRENCY
+SAP calls are in flight. Further lookups wait up to the SAP timeout for a
+slot, and past SAP_PROXY_MAX_WAITING waiters they get a 503 straight away.
+Concurrent lookups of the same emp code share one upstream call.
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+import hr_ticket_system
+from hr_ticket_system import (
+    EMP_CODE_FILTER_REBUILD_MINUTES,
+    SAP_CACHE_NAMESPACE,
+    SAP_CACHEABLE_STATUSES,
+    SAP_ODATA_BASE_URL,
+    SAP_REQUEST_TIMEOUT_SECONDS,
+    SAP_UNAVAILABLE_RESPONSE,
+    circuit_breakers,
+    emp_code_filter_miss,
+    emp_code_not_listed_response,
+    get_directory_employee,
+    metric_inc,
+    metric_observe,
+    rebuild_emp_code_filter,
+    record_emp_code_filter_outcome,
+    remember_sap_employee,
+    sap_employee_filter,
+    sap_employee_response,
+    sap_query_params,
+    shared_cache,
+)
+
+SAP_PROXY_MAX_CONCURRENCY = int(os.environ.get('SAP_PROXY_MAX_CONCURRENCY', 50))
+SAP_PROXY_MAX_WAITING = int(os.environ.get('SAP_PROXY_MAX_WAITING', 5000))
+
+LOOKUP_PATH = '/api/get_employee_sap'
+HEALTH_PATH = '/sap-proxy/health'
+
+BUSY_RESPONSE = (503, {'success': False, 'error': 'Employee lookup is busy. Please try again shortly.'})
+
+
+class SAPProxy:
+    """Minimal ASGI app: no framework, two routes."""
+
+    def __init__(self):
+        self.client = None
+        self.slots = None
+        self.waiting = 0
+        self.in_flight = {}
+        self._refresh_task = None
+
+    async def startup(self):
+        self.client = httpx.AsyncClient(
+            auth=(os.environ.get('SAP_API_USERNAME', ''), os.environ.get('SAP_API_PASSWORD', '')),
+            headers={'Accept': 'application/json', 'Cache-Control': 'no-cache'},
+            timeout=SAP_REQUEST_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=SAP_PROXY_MAX_CONCURRENCY,
+                                max_keepalive_connections=SAP_PROXY_MAX_CONCURRENCY),
+        )
+        self.slots = asyncio.Semaphore(SAP_PROXY_MAX_CONCURRENCY)
+        shared_cache.start_listener()
+        await self._rebuild_filter()
+        self._refresh_task = asyncio.create_task(self._refresh_filter())
+        print(f"🚀 SAP proxy ready ({SAP_PROXY_MAX_CONCURRENCY} concurrent SAP calls)")
+
+    async def shutdown(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        if self.client:
+            await self.client.aclose()
+
+    async def _rebuild_filter(self):
+        try:
+            await asyncio.to_thread(rebuild_emp_code_filter)
+        except Exception as e:
+            print(f"⚠️ Emp code filter rebuild failed: {str(e)}")
+
+    async def _refresh_filter(self):
+        while True:
+            await asyncio.sleep(EMP_CODE_FILTER_REBUILD_MINUTES * 60)
+            await self._rebuild_filter()
+
+    async def lookup(self, emp_code, refresh=False):
+        bloom = hr_ticket_system.emp_code_filter
+        filter_miss = emp_code_filter_miss(bloom, emp_code)
+
+        if refresh:
+            metric_inc('sap.refreshes')
+            await asyncio.to_thread(shared_cache.invalidate, SAP_CACHE_NAMESPACE, emp_code)
+        else:
+            cached = await asyncio.to_thread(shared_cache.get, SAP_CACHE_NAMESPACE, emp_code)
+            if cached is not None:
+                metric_inc('sap.cache_hits')
+                return cached
+
+        # A refresh must not join a load that may end in the filter's 404
+        task = None if refresh else self.in_flight.get(emp_code)
+        if task:
+            metric_inc('sap.coalesced_waits')
+        else:
+            metric_inc('sap.cache_misses')
+            task = asyncio.create_task(self._load(emp_code, bloom, filter_miss, refresh))
+            self.in_flight[emp_code] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(emp_code, None))
+        # shield: a client hanging up must not cancel a load others wait on
+        return await asyncio.shield(task)
+
+    async def _load(self, emp_code, bloom, filter_miss, refresh):
+        if filter_miss and not refresh:
+            result = emp_code_not_listed_response(emp_code)
+        else:
+            result = await asyncio.to_thread(get_directory_employee, emp_code)
+            if result is not None:
+                metric_inc('sap.directory_hits')
+            else:
+                metric_inc('sap.directory_misses')
+                result = await self.fetch(emp_code)
+                if result[0] == 200:
+                    await asyncio.to_thread(remember_sap_employee, result[1]['employee'])
+        record_emp_code_filter_outcome(bloom, filter_miss, result[0])
+        ttl = SAP_CACHEABLE_STATUSES.get(result[0])
+        if ttl:
+            await asyncio.to_thread(shared_cache.set, SAP_CACHE_NAMESPACE, emp_code, result, ttl)
+        return result
+
+    async def fetch(self, emp_code):
+        """Live SAP call for one emp code. Returns (status_code, body)."""
+        if self.waiting >= SAP_PROXY_MAX_WAITING:
+            metric_inc('sap_proxy.shed')
+            return BUSY_RESPONSE
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=SAP_REQUEST_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            metric_inc('sap_proxy.slot_timeouts')
+            return BUSY_RESPONSE
+        finally:
+            self.waiting -= 1
+
+        breaker = circuit_breakers['sap']
+        if not breaker.allow():
+            self.slots.release()
+            return SAP_UNAVAILABLE_RESPONSE
+
+        print(f"📡 SAP lookup for employee: {emp_code}")
+        start_time = time.time()
+        try:
+            response = await self.client.get(
+                f"{SAP_ODATA_BASE_URL}/EmpJob",
+                params=sap_query_params(**{'$filter': sap_employee_filter(emp_code)}),
+            )
+        except httpx.TimeoutException:
+            breaker.record_failure()
+            print(f"⏰ API request timed out after {SAP_REQUEST_TIMEOUT_SECONDS} seconds")
+            return 504, {'success': False, 'error': 'API request timed out. Please try again.'}
+        except httpx.HTTPError as e:
+            breaker.record_failure()
+            print(f"🌐 Network error: {str(e)}")
+            return 503, {'success': False, 'error': f'Network error: {str(e)}'}
+        finally:
+            self.slots.release()
+            metric_observe('sap.call_seconds.get_employee', time.time() - start_time)
+
+        print(f"⏱️ SAP responded in {time.time() - start_time:.2f} seconds")
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if response.status_code != 200:
+            metric_inc('sap.call_errors.get_employee')
+            print(f"❌ SAP get_employee returned {response.status_code}: {response.text[:200]}...")
+            return 500, {'success': False, 'error': f'API returned status code {response.status_code}'}
+        results = response.json().get('d', {}).get('results', [])
+        return sap_employee_response(emp_code, results[0] if results else None)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path']
+        if path == LOOKUP_PATH and scope['method'] in ('GET', 'HEAD'):
+            query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            emp_code = (query.get('emp_code') or [''])[0].strip()
+            if not emp_code:
+                status, body = 400, {'success': False, 'error': 'No employee code provided'}
+            else:
+                try:
+                    refresh = (query.get('refresh') or [''])[0] == '1'
+                    status, body = await self.lookup(emp_code, refresh)
+                except Exception as e:
+                    print(f"❌ Unexpected error: {str(e)}")
+                    status, body = 500, {'success': False, 'error': f'Error: {str(e)}'}
+        elif path == HEALTH_PATH:
+            status, body = 200, {
+                'success': True,
+                'in_flight': len(self.in_flight),
+                'waiting_for_slot': self.waiting,
+                'max_concurrency': SAP_PROXY_MAX_CONCURRENCY,
+                'circuit': circuit_breakers['sap'].snapshot(),
+            }
+        else:
+            status, body = 404, {'success': False, 'error': 'Not found'}
+        await self._send_json(send, status, body)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _send_json(send, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode('ascii')),
+                (b'cache-control', b'no-store'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+app = SAPProxy()
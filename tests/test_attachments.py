@@ -0,0 +1,36 @@
+import pytest
+
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+from hr_ticket_system import can_view_attachment
+
+
+@pytest.fixture
+def no_db(monkeypatch):
+    def getconn(*args, **kwargs):
+        raise AssertionError('opened a database connection')
+    monkeypatch.setattr(hr_ticket_system.db_pool, 'getconn', getconn)
+
+
+def test_anonymous_users_cannot_view_attachments(no_db):
+    assert not can_view_attachment(None, 'employee', 'E100', 'payslip.pdf')
+    assert not can_view_attachment({'emp_code': 'E100'}, 'employee', 'E100', 'payslip.pdf')
+
+
+def test_uploader_and_admin_need_no_ticket_lookup(no_db):
+    employee = {'emp_code': 'E100', 'role': 'employee', 'authenticated': True}
+    admin = {'emp_code': 'A1', 'role': 'admin', 'authenticated': True}
+    assert can_view_attachment(employee, 'employee', 'E100', 'payslip.pdf')
+    assert can_view_attachment(admin, 'hr', 'H7', 'letter.pdf')
+
+
+def test_anonymous_preview_never_schedules_a_render(monkeypatch, no_db):
+    pytest.importorskip('previews')
+    def fail(*args, **kwargs):
+        raise AssertionError('preview looked up or scheduled for an anonymous request')
+    monkeypatch.setattr(hr_ticket_system, 'lookup_attachment', fail)
+    monkeypatch.setattr(hr_ticket_system, 'schedule_preview', fail)
+
+    response = hr_ticket_system.app.test_client().get('/preview/employee/E100/scan.pdf?variant=thumb')
+
+    assert response.status_code == 404
@@ -0,0 +1,42 @@
+import pytest
+
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+from flask import flash, jsonify, session
+from psycopg2 import errors as pg_errors
+
+from hr_ticket_system import app, note_db_budget_error, surface_db_budget_errors
+
+
+def test_swallowed_timeout_still_becomes_503():
+    with app.test_request_context('/api/hr_filter', headers={'Accept': 'application/json'}):
+        try:
+            e = pg_errors.QueryCanceled('canceling statement due to statement timeout')
+            note_db_budget_error(e)
+            raise e
+        except Exception:
+            response = jsonify({'success': True, 'grievances': []})
+
+        response = surface_db_budget_errors(response)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+
+def test_swallowed_cost_rejection_renders_503_page_and_drops_error_flash():
+    with app.test_request_context('/hr_dashboard?status=Submitted'):
+        flash('Welcome back', 'success')
+        note_db_budget_error(hr_ticket_system.QueryCostExceeded('estimated cost 1e9 exceeds ceiling 1e6'))
+        flash('Error loading dashboard', 'error')
+
+        response = surface_db_budget_errors(app.response_class('dashboard', status=200))
+
+        assert response.status_code == 503
+        assert b'too broad' in response.get_data()
+        assert session['_flashes'] == [('success', 'Welcome back')]
+
+
+def test_untouched_responses_pass_through():
+    with app.test_request_context('/'):
+        response = app.response_class('ok', status=200)
+        assert surface_db_budget_errors(response) is response
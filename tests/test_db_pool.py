@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+import psycopg2
+import psycopg2.extensions
+
+from hr_ticket_system import BudgetedConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+
+class FakeConnection:
+    closed = 0
+
+    def set_session(self, **kwargs):
+        pass
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+@pytest.fixture
+def one_connection_pool(monkeypatch):
+    monkeypatch.setattr(psycopg2, 'connect', lambda *args, **kwargs: FakeConnection())
+    monkeypatch.setattr(hr_ticket_system, 'DB_POOL_TIMEOUT_SECONDS', 0.2)
+    return BudgetedConnectionPool(0, 1)
+
+
+def test_checkout_waits_for_a_returned_connection(one_connection_pool):
+    conn = one_connection_pool.getconn(budget='background')
+    threading.Timer(0.05, one_connection_pool.putconn, (conn,)).start()
+
+    assert one_connection_pool.getconn(budget='background') is not None
+
+
+def test_checkout_times_out_instead_of_failing_immediately(one_connection_pool):
+    one_connection_pool.getconn(budget='background')
+
+    with pytest.raises(PoolTimeout):
+        one_connection_pool.getconn(budget='background')
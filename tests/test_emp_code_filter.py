@@ -0,0 +1,41 @@
+import pytest
+
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+from hr_ticket_system import BloomFilter, SAP_CACHE_NAMESPACE, lookup_sap_employee
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    bloom = BloomFilter(100)
+    bloom.add('EMP001')
+    monkeypatch.setattr(hr_ticket_system, 'emp_code_filter', bloom)
+    monkeypatch.setattr(hr_ticket_system, 'shared_cache', hr_ticket_system.LocalCache())
+    calls = []
+
+    def fetch(emp_code):
+        calls.append(emp_code)
+        return 200, {'success': True, 'employee': {'emp_code': emp_code}}
+
+    monkeypatch.setattr(hr_ticket_system, 'get_directory_employee', lambda emp_code: None)
+    monkeypatch.setattr(hr_ticket_system, 'fetch_sap_employee', fetch)
+    monkeypatch.setattr(hr_ticket_system, 'remember_sap_employee', lambda employee: None)
+    return calls
+
+
+def test_unknown_code_gets_cached_404_without_lookup(lookups):
+    for _ in range(50):
+        status, body = lookup_sap_employee('EMP9')
+        assert status == 404 and body['not_listed']
+    assert lookups == []
+    assert hr_ticket_system.shared_cache.get(SAP_CACHE_NAMESPACE, 'EMP9')[0] == 404
+
+
+def test_refresh_bypasses_filter_and_cached_miss(lookups):
+    assert lookup_sap_employee('EMP2')[0] == 404
+
+    assert lookup_sap_employee('EMP2', refresh=True)[0] == 200
+    assert lookups == ['EMP2']
+    # The fresh answer replaces the cached 404
+    assert lookup_sap_employee('EMP2')[0] == 200
+    assert lookups == ['EMP2']
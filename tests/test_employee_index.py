@@ -0,0 +1,32 @@
+import pytest
+
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+from hr_ticket_system import EmployeeSuggestIndex, update_employee_index
+
+
+class UsersCursor:
+    def __init__(self, user_codes):
+        self.user_codes = user_codes
+
+    def execute(self, query, params):
+        self.rows = [(code,) for code in params[0] if code in self.user_codes]
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_directory_updates_do_not_override_portal_users(monkeypatch):
+    index = EmployeeSuggestIndex()
+    index.load([('E1', 'Asha Portal Name'), ('E2', 'Ravi Kumar')])
+    monkeypatch.setattr(hr_ticket_system, 'employee_index', index)
+
+    update_employee_index(UsersCursor({'E1', 'E2'}), [
+        {'emp_code': 'E1', 'employee_name': 'Asha SAP Name', 'is_active': True},
+        {'emp_code': 'E2', 'employee_name': 'Ravi Kumar', 'is_active': False},
+        {'emp_code': 'E3', 'employee_name': 'Meera Nair', 'is_active': True},
+    ])
+
+    assert index.suggest('asha', 5) == [('E1', 'Asha Portal Name')]
+    assert index.suggest('ravi', 5) == [('E2', 'Ravi Kumar')]
+    assert index.suggest('meera', 5) == [('E3', 'Meera Nair')]
@@ -0,0 +1,37 @@
+import pytest
+
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+from hr_ticket_system import PostgresSessionInterface, app, metrics_snapshot
+
+
+def session_counters():
+    counters = metrics_snapshot()['counters']
+    return counters.get('session.db_loads', 0), counters.get('session.hot_hits', 0)
+
+
+def test_static_request_skips_session_lookup(monkeypatch):
+    def no_db(*args, **kwargs):
+        raise AssertionError('static request opened a database connection')
+    monkeypatch.setattr(hr_ticket_system.db_pool, 'getconn', no_db)
+
+    client = app.test_client()
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], 'some-session-id',
+                      domain=(app.config.get('SERVER_NAME') or 'localhost').split(':')[0])
+    before = session_counters()
+
+    response = client.get('/static/ask_hr_logo.png')
+
+    assert response.status_code == 200
+    assert session_counters() == before
+
+
+def test_hot_cache_needs_a_shared_invalidation_channel():
+    # LocalCache invalidations never reach other workers, so no in-process copy
+    assert PostgresSessionInterface(hr_ticket_system.LocalCache()).hot_cache is None
+
+
+def test_hot_cache_enabled_with_redis():
+    fakeredis = pytest.importorskip('fakeredis')
+    cache = hr_ticket_system.RedisCache(client=fakeredis.FakeRedis(server=fakeredis.FakeServer()), prefix='test')
+    assert PostgresSessionInterface(cache).hot_cache is not None
@@ -0,0 +1,100 @@
+"""
+RedisCache against fakeredis, an in-memory server speaking the same commands
+(lock release needs its Lua support: pip install 'fakeredis[lua]').
+"""
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+hr_ticket_system = pytest.importorskip('hr_ticket_system')
+
+from hr_ticket_system import RedisCache
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_cache(server):
+    return RedisCache(client=fakeredis.FakeRedis(server=server), prefix='test')
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_set_is_visible_to_other_processes(server):
+    a, b = make_cache(server), make_cache(server)
+    a.set('sap_employee', 'E1', {'name': 'Asha'}, ttl=60)
+    assert b.get('sap_employee', 'E1') == {'name': 'Asha'}
+    assert b.get('sap_employee', 'E2') is None
+
+
+def test_values_expire_with_their_ttl(server):
+    a = make_cache(server)
+    a.set('sap_employee', 'E1', [404, {'success': False}], ttl=60)
+    key = a._key('sap_employee', 'E1')
+    assert 0 < a.client.ttl(key) <= 60
+
+
+def test_namespace_invalidation_bumps_generation_without_scanning(server):
+    a, b = make_cache(server), make_cache(server)
+    a.set('dashboard', 'stats', {'total': 3}, ttl=120)
+    a.set('dashboard', 'types', ['IT'], ttl=120)
+    old_key = a._key('dashboard', 'stats')
+
+    b.invalidate('dashboard')
+
+    assert int(a.client.get('test:dashboard:generation')) == 1
+    # Old entries are left to expire rather than deleted key by key
+    assert a.client.exists(old_key)
+    c = make_cache(server)
+    assert c.get('dashboard', 'stats') is None
+    assert c._key('dashboard', 'stats') != old_key
+
+
+def test_pubsub_invalidation_reaches_other_processes(server):
+    a, b = make_cache(server), make_cache(server)
+    b.start_listener()
+    time.sleep(0.1)  # let the listener subscribe
+
+    a.set('dashboard', 'stats', {'total': 3}, ttl=120)
+    assert b.get('dashboard', 'stats') == {'total': 3}   # now also in b's near cache
+
+    a.invalidate('dashboard')
+    assert wait_for(lambda: b.get('dashboard', 'stats') is None)
+
+    a.set('sap_employee', 'E1', {'name': 'Asha'}, ttl=60)
+    assert b.get('sap_employee', 'E1') == {'name': 'Asha'}
+    a.invalidate('sap_employee', 'E1')
+    assert wait_for(lambda: b.get('sap_employee', 'E1') is None)
+
+
+def test_get_or_load_releases_its_lock(server):
+    a = make_cache(server)
+    value, source = a.get_or_load('sap_employee', 'E1', lambda: {'name': 'Asha'}, ttl=60)
+    assert (value, source) == ({'name': 'Asha'}, 'miss')
+    assert not a.client.exists(a._key('sap_employee', 'E1') + ':lock')
+    assert a.get_or_load('sap_employee', 'E1', lambda: pytest.fail('reloaded'), ttl=60)[1] == 'hit'
+
+
+def test_get_or_load_waits_for_the_lock_holder(server):
+    a, b = make_cache(server), make_cache(server)
+    lock_key = a._key('sap_employee', 'E1') + ':lock'
+    a.client.set(lock_key, 'other-worker', px=5000)
+
+    def other_worker_finishes():
+        time.sleep(0.2)
+        b.set('sap_employee', 'E1', {'name': 'Asha'}, ttl=60)
+
+    threading.Thread(target=other_worker_finishes).start()
+    value, _ = a.get_or_load('sap_employee', 'E1', lambda: pytest.fail('loaded twice'), ttl=60)
+    assert value == {'name': 'Asha'}
@@ -0,0 +1,31 @@
+"""
+Background job runner: overdue reminders, HR summaries, feedback reminders,
+session purge and the SAP directory sync. Jobs are kept in the
+apscheduler_jobs table and each run is guarded by an advisory lock, so a
+restart keeps the schedule and extra workers never double-run a job.
+
+    python worker.py
+
+SCHEDULER_MAX_WORKERS sets how many jobs may run at once.
+"""
+import signal
+import threading
+
+from hr_ticket_system import init_db, start_schedulers
+
+def main():
+    init_db()
+    scheduler = start_schedulers()
+    print("🛠️ Worker running; press Ctrl+C to stop")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    scheduler.shutdown(wait=True)
+    print("👋 Worker stopped")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+Production WSGI entrypoint.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Scheduled jobs are not started here; run `python worker.py` as a separate
+process.
+"""
+from hr_ticket_system import create_app
+
+app = create_app()